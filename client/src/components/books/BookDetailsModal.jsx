@@ -63,7 +63,7 @@ export default function BookDetailsModal({ book, show, onHide, onEdit }) {
             <div className="me-4" style={{ minWidth: "150px" }}>
               {displayBook.large_thumbnail ? (
                 <img
-                  src={displayBook.large_thumbnail}
+                  src={displayBook.large_cover_url || displayBook.large_thumbnail}
                   alt={displayBook.title}
                   className="img-fluid"
                 />
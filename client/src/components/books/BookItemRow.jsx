@@ -15,7 +15,7 @@ export default function BookItemRow({
       <td className="text-center align-middle">
         {book.small_thumbnail ? (
           <img
-            src={book.small_thumbnail}
+            src={book.small_cover_url || book.small_thumbnail}
             alt={book.title}
             style={{ width: "70px", height: "auto", maxHeight: "100px" }}
             className="my-1"
@@ -9,24 +9,7 @@ export default function BookTable({
   onBookDetailsClick,
   onBookEditClick,
 }) {
-  // Sort books by sort_key
-  const sortedBooks = books
-    ? [...books].sort((a, b) => {
-        if (!a.sort_key || !b.sort_key) return 0;
-
-        // Compare each element of the sort_key array
-        for (
-          let i = 0;
-          i < Math.min(a.sort_key.length, b.sort_key.length);
-          i++
-        ) {
-          if (a.sort_key[i] < b.sort_key[i]) return -1;
-          if (a.sort_key[i] > b.sort_key[i]) return 1;
-        }
-        return 0;
-      })
-    : [];
-
+  // Books arrive already ordered by sort_key from the API
   if (loading) {
     return (
       <div className="text-center my-4">
@@ -55,7 +38,7 @@ export default function BookTable({
         </tr>
       </thead>
       <tbody>
-        {sortedBooks.map((book) => (
+        {books.map((book) => (
           <BookItemRow
             key={book.id}
             book={book}
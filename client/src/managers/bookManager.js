@@ -1,9 +1,11 @@
 const _apiUrl = "/api/books/";
+// The book table doesn't show descriptions or large covers
+const _listView = "view=compact";
 
 // Get all books for the current user
 export const getBooks = () => {
   const token = localStorage.getItem("jwt");
-  return fetch(_apiUrl, {
+  return fetch(`${_apiUrl}?${_listView}`, {
     headers: {
       Authorization: `Bearer ${token}`,
     },
@@ -13,7 +15,7 @@ export const getBooks = () => {
 // Get books by bookshelf
 export const getBooksByBookcase = (bookcaseId) => {
   const token = localStorage.getItem("jwt");
-  return fetch(`${_apiUrl}?bookshelf=${bookcaseId}`, {
+  return fetch(`${_apiUrl}?bookshelf=${bookcaseId}&${_listView}`, {
     headers: {
       Authorization: `Bearer ${token}`,
     },
@@ -0,0 +1,133 @@
+"""
+Async versions of the ISBN search and book-create endpoints.
+
+DRF views are sync-only, so these are plain Django async views. Under
+ASGI (personal_library.asgi) the Google Books calls are awaited on the
+event loop instead of holding a worker thread for two network round-trips;
+only the DB work is handed off with sync_to_async. Under WSGI they still
+work, each request running on an event loop of its own.
+"""
+
+import json
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIRequest
+from django.http import JsonResponse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_GET, require_POST
+from rest_framework.exceptions import AuthenticationFailed
+
+from .authentication import CookieJWTAuthentication
+from .serializers import BookSerializer
+from .models import Book
+from .services import enrichment
+from .services.async_google_books import afetch_book_data, close_session
+from .services.bulk_import import is_valid_isbn
+from .services.google_books import GoogleBooksUnavailable, book_fields_from_data
+from .services.metadata_cache import normalize_isbn
+from .services.metadata_snapshots import snapshot_fields
+
+
+def _authenticate(request):
+    """Return the user for the request's JWT cookie, or None."""
+    try:
+        result = CookieJWTAuthentication().authenticate(request)
+    except AuthenticationFailed:
+        return None
+    return result[0] if result else None
+
+
+def closes_session(view):
+    """
+    Close the event loop's Google Books session when the view returns,
+    unless serving under ASGI.
+
+    Under WSGI (runserver included) Django runs each async view on an event
+    loop that ends with the request, so a session left open would leak its
+    connections. Under ASGI the loop, and the pooled session, last as long
+    as the server.
+    """
+
+    @wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        try:
+            return await view(request, *args, **kwargs)
+        finally:
+            if not isinstance(request, ASGIRequest):
+                await close_session()
+
+    return wrapper
+
+
+@require_GET
+@closes_session
+async def search_book_by_isbn_async(request):
+    """
+    Search for a book by ISBN using Google Books API
+    """
+    isbn = request.GET.get("isbn")
+    if not isbn:
+        return JsonResponse({"error": "ISBN parameter is required."}, status=400)
+    if not is_valid_isbn(normalize_isbn(isbn)):
+        return JsonResponse({"error": "Invalid ISBN."}, status=400)
+
+    try:
+        data = await afetch_book_data(isbn)
+    except GoogleBooksUnavailable:
+        return JsonResponse(
+            {"error": "Google Books is unavailable. Please try again later."},
+            status=503,
+        )
+    if not data:
+        return JsonResponse(
+            {"error": "No data found for the provided ISBN."}, status=404
+        )
+    return JsonResponse(data)
+
+
+# Like the DRF views, authentication comes from the JWT cookie rather than
+# a session, so Django's CSRF check doesn't apply
+@csrf_exempt
+@require_POST
+@closes_session
+async def create_book_async(request):
+    """
+    Add a book to the current user's library, populating it from Google Books
+    """
+    user = await sync_to_async(_authenticate)(request)
+    if user is None:
+        return JsonResponse(
+            {"detail": "Authentication credentials were not provided."}, status=401
+        )
+
+    try:
+        payload = json.loads(request.body or b"{}")
+    except ValueError:
+        return JsonResponse({"detail": "Invalid JSON body."}, status=400)
+
+    serializer = BookSerializer(data=payload)
+    # Validation resolves the related bookshelf/category/series rows
+    if not await sync_to_async(serializer.is_valid)():
+        return JsonResponse(serializer.errors, status=400)
+    if not is_valid_isbn(normalize_isbn(serializer.validated_data.get("isbn"))):
+        return JsonResponse(
+            {"isbn": ["Enter a valid ISBN-10 or ISBN-13."]}, status=400
+        )
+
+    try:
+        book_data = await afetch_book_data(serializer.validated_data.get("isbn"))
+        # Stored like the sync create path does, so retrieving the book
+        # doesn't fetch it again
+        fields = {**book_fields_from_data(book_data), **snapshot_fields(book_data)}
+    except GoogleBooksUnavailable:
+        # Save the book anyway and let the enrichment worker fill it in
+        fields = {"enrichment_status": Book.EnrichmentStatus.PENDING}
+
+    def save():
+        book = serializer.save(user=user, **fields)
+        if book.enrichment_status == Book.EnrichmentStatus.PENDING:
+            enrichment.enqueue([book])
+        return serializer.data
+
+    return JsonResponse(await sync_to_async(save)(), status=201)
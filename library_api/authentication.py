@@ -1,6 +1,12 @@
+from functools import partial
+
 from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.settings import api_settings
 from django.conf import settings
 
+from .services import request_metrics
+from .services.user_cache import user_cache
+
 
 class CookieJWTAuthentication(JWTAuthentication):
     def authenticate(self, request):
@@ -10,5 +16,16 @@ class CookieJWTAuthentication(JWTAuthentication):
         if raw_token is None:
             return None
 
-        validated_token = self.get_validated_token(raw_token)
-        return self.get_user(validated_token), validated_token
+        with request_metrics.timed("auth"):
+            validated_token = self.get_validated_token(raw_token)
+            return self.get_user(validated_token), validated_token
+
+    def get_user(self, validated_token):
+        """Return the token's user from the per-process user cache if possible"""
+        user_id = validated_token.get(api_settings.USER_ID_CLAIM)
+        token_id = validated_token.get(api_settings.JTI_CLAIM)
+        if user_id is None or token_id is None:
+            return super().get_user(validated_token)
+        return user_cache.get_user(
+            user_id, token_id, partial(super().get_user, validated_token)
+        )
@@ -0,0 +1,296 @@
+"""
+Local stand-in for the Google Books volumes API.
+
+Serves the two endpoints fetch_volume_info uses (ISBN search and volume
+detail) from an in-memory table, so imports, benchmarks and tests can run
+without network access. Point GOOGLE_BOOKS_API_URL at `stub.url` to use it.
+The same books are also served in the format of Open Library's Books API
+at `stub.open_library_url`, for the open_library metadata provider.
+
+The server is a minimal HTTP/1.1 implementation on asyncio streams, so
+hundreds of concurrent keep-alive connections with simulated latency cost
+one thread rather than one thread each.
+"""
+
+import asyncio
+import json
+import multiprocessing
+import random
+import threading
+from contextlib import contextmanager
+from http import HTTPStatus
+from urllib.parse import parse_qs, urlsplit
+
+API_PATH = "/books/v1/volumes"
+OPEN_LIBRARY_PATH = "/api/books"
+# Search results per page when the request doesn't ask for more, as in Google's API
+DEFAULT_MAX_RESULTS = 10
+
+
+def generated_volume_info(isbn):
+    """Build a plausible volumeInfo payload for an ISBN."""
+    return {
+        "title": f"Book {isbn}",
+        "subtitle": "A Generated Volume",
+        "authors": [f"Author {isbn[-3:]}"],
+        "description": f"Stub description for ISBN {isbn}.",
+        "industryIdentifiers": [{"type": "ISBN_13", "identifier": isbn}],
+        "imageLinks": {
+            "smallThumbnail": f"http://books.example/{isbn}/small.jpg",
+            "thumbnail": f"http://books.example/{isbn}/thumb.jpg",
+        },
+    }
+
+
+def search_volume_info(isbn, volume_info):
+    """
+    The volumeInfo of a search result. As in Google's API, it always lists
+    the book's ISBNs but only has the two smallest cover images.
+    """
+    volume_info = {
+        "industryIdentifiers": [{"type": "ISBN_13", "identifier": isbn}],
+        **volume_info,
+    }
+    if "imageLinks" in volume_info:
+        volume_info["imageLinks"] = {
+            name: url
+            for name, url in volume_info["imageLinks"].items()
+            if name in ("smallThumbnail", "thumbnail")
+        }
+    return volume_info
+
+
+def open_library_record(volume_info):
+    """Convert a volumeInfo payload to an Open Library Books API record."""
+    record = {
+        "title": volume_info.get("title", ""),
+        "authors": [{"name": name} for name in volume_info.get("authors", [])],
+    }
+    if volume_info.get("subtitle"):
+        record["subtitle"] = volume_info["subtitle"]
+    image_links = volume_info.get("imageLinks")
+    if image_links:
+        record["cover"] = {
+            "small": image_links.get("smallThumbnail"),
+            "medium": image_links.get("thumbnail"),
+        }
+    return record
+
+
+class BooksAPIStub:
+    """
+    HTTP server imitating the Google Books volumes API.
+
+    Use start()/stop() (or a with block) to run it on a background thread,
+    or serve_forever() to run it in the current thread.
+
+    Args:
+        volumes (dict, optional): Maps ISBN to the volumeInfo to return.
+        generate_missing (bool): Invent a volume for ISBNs not in `volumes`
+            instead of answering "no results".
+        latency (float): Seconds to wait before answering each request.
+        error_rate (float): Fraction of requests answered with HTTP 503.
+        seed (int, optional): Seed for the error-rate random generator.
+    """
+
+    def __init__(
+        self,
+        volumes=None,
+        generate_missing=False,
+        latency=0.0,
+        error_rate=0.0,
+        seed=None,
+        host="127.0.0.1",
+        port=0,
+    ):
+        self.volumes = dict(volumes or {})
+        self.generate_missing = generate_missing
+        self.latency = latency
+        self.error_rate = error_rate
+        self.host = host
+        self.port = port
+        self.request_count = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._loop = None
+        self._stopped = None
+        self._connections = {}
+        self._thread = None
+
+    @property
+    def url(self):
+        return f"http://{self.host}:{self.port}{API_PATH}"
+
+    @property
+    def open_library_url(self):
+        return f"http://{self.host}:{self.port}{OPEN_LIBRARY_PATH}"
+
+    def lookup(self, isbn):
+        """Return the volumeInfo for an ISBN, or None if the stub doesn't know it."""
+        if isbn in self.volumes:
+            return self.volumes[isbn]
+        if self.generate_missing:
+            return generated_volume_info(isbn)
+        return None
+
+    def respond(self, method, target):
+        """Return (status, payload) for a request. Also counts the request."""
+        with self._lock:
+            self.request_count += 1
+            failed = self.error_rate and self._random.random() < self.error_rate
+        if failed:
+            return 503, {"error": {"code": 503, "message": "Backend Error"}}
+        if method != "GET":
+            return 405, {"error": {"code": 405}}
+
+        url = urlsplit(target)
+        path = url.path.rstrip("/")
+
+        if path == API_PATH:
+            params = parse_qs(url.query)
+            # "isbn:A" or, for batched lookups, "isbn:A OR isbn:B ..."
+            terms = params.get("q", [""])[0].split(" OR ")
+            max_results = int(params.get("maxResults", [DEFAULT_MAX_RESULTS])[0])
+            items = []
+            for term in terms:
+                isbn = term.strip().removeprefix("isbn:")
+                volume_info = self.lookup(isbn)
+                if volume_info is not None:
+                    items.append(
+                        {
+                            "id": f"vol-{isbn}",
+                            "volumeInfo": search_volume_info(isbn, volume_info),
+                        }
+                    )
+            if not items:
+                return 200, {"kind": "books#volumes", "totalItems": 0}
+            return 200, {
+                "kind": "books#volumes",
+                "totalItems": len(items),
+                "items": items[:max_results],
+            }
+
+        if path == OPEN_LIBRARY_PATH:
+            bibkeys = parse_qs(url.query).get("bibkeys", [""])[0]
+            records = {}
+            for bibkey in filter(None, bibkeys.split(",")):
+                volume_info = self.lookup(bibkey.removeprefix("ISBN:"))
+                if volume_info is not None:
+                    records[bibkey] = open_library_record(volume_info)
+            return 200, records
+
+        if path.startswith(f"{API_PATH}/vol-"):
+            isbn = path[len(f"{API_PATH}/vol-"):]
+            volume_info = self.lookup(isbn)
+            if volume_info is not None:
+                return 200, {"id": f"vol-{isbn}", "volumeInfo": volume_info}
+
+        return 404, {"error": {"code": 404}}
+
+    async def _handle_connection(self, reader, writer):
+        self._connections[asyncio.current_task()] = writer
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, target, version = request_line.decode("latin-1").split()
+
+                headers = {}
+                while (line := await reader.readline()) not in (b"\r\n", b"\n", b""):
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                if headers.get("content-length"):
+                    await reader.readexactly(int(headers["content-length"]))
+
+                if self.latency:
+                    await asyncio.sleep(self.latency)
+                status, payload = self.respond(method, target)
+
+                keep_alive = (
+                    version == "HTTP/1.1"
+                    and headers.get("connection", "").lower() != "close"
+                )
+                body = json.dumps(payload).encode()
+                head = (
+                    f"HTTP/1.1 {status} {HTTPStatus(status).phrase}\r\n"
+                    "Content-Type: application/json; charset=UTF-8\r\n"
+                    f"Content-Length: {len(body)}\r\n"
+                    f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n"
+                )
+                writer.write(head.encode("latin-1") + body)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            self._connections.pop(asyncio.current_task(), None)
+            writer.close()
+
+    async def _serve(self, on_ready):
+        self._loop = asyncio.get_running_loop()
+        self._stopped = asyncio.Event()
+        server = await asyncio.start_server(
+            self._handle_connection, self.host, self.port, backlog=1024
+        )
+        self.port = server.sockets[0].getsockname()[1]
+        on_ready()
+        await self._stopped.wait()
+
+        server.close()
+        # Closing the transports ends any keep-alive reads, so the handlers
+        # can finish before asyncio.run() tears the loop down
+        handlers = list(self._connections.items())
+        for _, writer in handlers:
+            writer.close()
+        await asyncio.gather(*(task for task, _ in handlers), return_exceptions=True)
+
+    def serve_forever(self, on_ready=lambda: None):
+        """Run the server in the current thread until stop() is called."""
+        asyncio.run(self._serve(on_ready))
+
+    def start(self):
+        ready = threading.Event()
+        self._thread = threading.Thread(
+            target=self.serve_forever, args=(ready.set,), daemon=True
+        )
+        self._thread.start()
+        ready.wait()
+        return self
+
+    def stop(self):
+        self._loop.call_soon_threadsafe(self._stopped.set)
+        if self._thread is not None:
+            self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+
+def _serve_in_child(connection, options):
+    stub = BooksAPIStub(**options)
+    stub.serve_forever(on_ready=lambda: connection.send(stub.url))
+
+
+@contextmanager
+def stub_process(**options):
+    """
+    Run a BooksAPIStub in a child process and yield its URL.
+
+    Benchmarks should use this rather than an in-process stub, so the stub's
+    work doesn't compete with the code being measured for the GIL.
+    """
+    parent, child = multiprocessing.Pipe()
+    process = multiprocessing.Process(
+        target=_serve_in_child, args=(child, options), daemon=True
+    )
+    process.start()
+    try:
+        yield parent.recv()
+    finally:
+        process.terminate()
+        process.join()
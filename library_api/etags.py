@@ -0,0 +1,56 @@
+from django.core.exceptions import ValidationError
+from django.utils.http import parse_etags, quote_etag
+from rest_framework import status
+from rest_framework.response import Response
+
+from .services.library_version import get_version
+
+
+class LibraryVersionETagMixin:
+    """
+    Conditional GET for list and detail views of the user's library.
+
+    The ETag is the user's LibraryVersion (plus the negotiated media type),
+    so it can be checked before the view's own queryset is touched: a
+    matching If-None-Match gets a 304 after a single version lookup. On
+    detail views the object's existence is checked too, so a deleted
+    object or another user's still gets its 404.
+    """
+
+    def get_library_etag(self, request):
+        version = get_version(request.user.id)
+        media_type = request.accepted_renderer.media_type.split(";")[0]
+        return quote_etag(f"{request.user.id}.{version}.{media_type}")
+
+    def object_exists(self):
+        """True if the detail view's object is in the user's queryset."""
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        queryset = self.filter_queryset(self.get_queryset())
+        try:
+            return queryset.filter(
+                **{self.lookup_field: self.kwargs[lookup_url_kwarg]}
+            ).exists()
+        except (TypeError, ValueError, ValidationError):
+            return False
+
+    def conditional_response(self, request, view, *args, detail=False, **kwargs):
+        etag = self.get_library_etag(request)
+        if_none_match = parse_etags(request.headers.get("If-None-Match", ""))
+        not_modified = etag in if_none_match or "*" in if_none_match
+        if not_modified and (not detail or self.object_exists()):
+            response = Response(status=status.HTTP_304_NOT_MODIFIED)
+        else:
+            response = view(request, *args, **kwargs)
+        if response.status_code in (status.HTTP_200_OK, status.HTTP_304_NOT_MODIFIED):
+            response["ETag"] = etag
+            # Let browsers keep the response but revalidate it every time
+            response["Cache-Control"] = "private, no-cache"
+        return response
+
+    def list(self, request, *args, **kwargs):
+        return self.conditional_response(request, super().list, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.conditional_response(
+            request, super().retrieve, *args, detail=True, **kwargs
+        )
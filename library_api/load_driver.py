@@ -0,0 +1,251 @@
+"""
+Load driver for the book API.
+
+Sends a mix of requests for the main endpoints on behalf of a set of
+users (usually made by synthetic_data.generate_libraries) and reports
+latency percentiles, throughput and database queries per request for
+each scenario. Requests go either through Django's test client in this
+process, which also counts queries, or over HTTP to a running server.
+"""
+
+import random
+import statistics
+import threading
+from dataclasses import dataclass, field
+from time import perf_counter
+
+import requests
+from django.conf import settings
+from django.db import connection, connections
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+
+from .models import Book
+from .synthetic_data import TITLE_WORDS, isbn13
+
+# Book IDs sampled per user for the detail scenario
+SAMPLED_BOOK_IDS = 1000
+
+
+@dataclass
+class Library:
+    """A user requests are sent for, with some of their book IDs."""
+
+    user: object
+    book_ids: list = field(default_factory=list)
+
+    @classmethod
+    def load(cls, user):
+        book_ids = list(
+            Book.objects.filter(user=user)
+            .order_by("?")
+            .values_list("id", flat=True)[:SAMPLED_BOOK_IDS]
+        )
+        return cls(user, book_ids)
+
+
+def _detail_path(rng, library):
+    if not library.book_ids:
+        return "/api/books/0/"
+    return f"/api/books/{rng.choice(library.book_ids)}/"
+
+
+# Maps scenario names to functions returning the path of one request
+SCENARIOS = {
+    "list": lambda rng, library: "/api/books/",
+    "page": lambda rng, library: "/api/books/?page_size=50",
+    "fields": lambda rng, library: "/api/books/?fields=id,title,author",
+    "detail": _detail_path,
+    "find": lambda rng, library: f"/api/books/find/?q={rng.choice(TITLE_WORDS)}",
+    "stats": lambda rng, library: "/api/books/stats/",
+    "bookshelves": lambda rng, library: "/api/bookshelves/",
+    # Random ISBNs; a seed's first run misses the metadata cache
+    "isbn_search": lambda rng, library: (
+        f"/api/books/search/?isbn={isbn13(rng.randrange(10**9))}"
+    ),
+}
+# Scenarios that can answer 404 as a matter of course
+NOT_FOUND_OK = {"isbn_search"}
+
+
+def access_token(user):
+    return str(AccessToken.for_user(user))
+
+
+class InProcessClient:
+    """Sends requests through Django's test client and counts their queries."""
+
+    def __init__(self, user):
+        self.client = APIClient(raise_request_exception=False)
+        self.client.cookies[settings.SIMPLE_JWT["AUTH_COOKIE"]] = access_token(user)
+
+    def get(self, path):
+        """Return (seconds, status code, queries) for a GET request."""
+        with CaptureQueriesContext(connection) as queries:
+            start = perf_counter()
+            response = self.client.get(path)
+            seconds = perf_counter() - start
+        return seconds, response.status_code, len(queries)
+
+
+class HTTPClient:
+    """
+    Sends requests to a running server. Query counts aren't available.
+
+    Tokens are signed with this project's settings, so the server must
+    share its SECRET_KEY and database.
+    """
+
+    def __init__(self, base_url, user, timeout=30):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.session.cookies.set(settings.SIMPLE_JWT["AUTH_COOKIE"], access_token(user))
+
+    def get(self, path):
+        start = perf_counter()
+        try:
+            response = self.session.get(self.base_url + path, timeout=self.timeout)
+            status_code = response.status_code
+        except requests.RequestException:
+            status_code = 0
+        return perf_counter() - start, status_code, None
+
+
+def percentiles_ms(latencies):
+    """p50, p95 and p99 of latencies in seconds, in milliseconds."""
+    if len(latencies) == 1:
+        cuts = latencies * 99
+    else:
+        cuts = statistics.quantiles(latencies, n=100, method="inclusive")
+    return {
+        "p50_ms": round(cuts[49] * 1000, 2),
+        "p95_ms": round(cuts[94] * 1000, 2),
+        "p99_ms": round(cuts[98] * 1000, 2),
+    }
+
+
+def run_scenario(
+    scenario, libraries, requests_count, concurrency, make_client, warmup=0, seed=0
+):
+    """
+    Send `requests_count` requests of one scenario and summarize them.
+
+    Requests are spread round-robin over the libraries and sent from
+    `concurrency` threads, each with its own client per user. With a
+    concurrency of 1 they're sent from the calling thread, which keeps
+    the run inside the caller's transaction (as in tests).
+
+    Args:
+        scenario (str): Key of SCENARIOS
+        libraries (list): Library instances to send requests for
+        make_client (callable): Called with a user, returns a client
+            (InProcessClient or HTTPClient)
+        warmup (int): Requests sent first and left out of the summary
+
+    Returns:
+        dict: Request and error counts, status codes, seconds,
+        requests per second, latency percentiles, and mean and maximum
+        queries per request (None over HTTP)
+    """
+    rng = random.Random(f"{seed}-{scenario}")
+    build_path = SCENARIOS[scenario]
+
+    def plan(count):
+        return [
+            (library, build_path(rng, library))
+            for library in (libraries[i % len(libraries)] for i in range(count))
+        ]
+
+    warmup_requests = plan(warmup)
+    timed_requests = plan(requests_count)
+
+    def send_all(planned, results):
+        clients = {}
+        for library, path in planned:
+            client = clients.get(library.user.pk)
+            if client is None:
+                client = clients[library.user.pk] = make_client(library.user)
+            results.append(client.get(path))
+
+    send_all(warmup_requests, [])
+    samples = []
+    if concurrency == 1:
+        start = perf_counter()
+        send_all(timed_requests, samples)
+        elapsed = perf_counter() - start
+    else:
+        shares = [timed_requests[i::concurrency] for i in range(concurrency)]
+        results = [[] for _ in shares]
+
+        def worker(planned, worker_results):
+            try:
+                send_all(planned, worker_results)
+            finally:
+                connections.close_all()
+
+        threads = [
+            threading.Thread(target=worker, args=args) for args in zip(shares, results)
+        ]
+        start = perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = perf_counter() - start
+        samples = [sample for worker_results in results for sample in worker_results]
+
+    latencies = [seconds for seconds, _, _ in samples]
+    status_codes = {}
+    for _, status_code, _ in samples:
+        status_codes[str(status_code)] = status_codes.get(str(status_code), 0) + 1
+    allowed = {404} if scenario in NOT_FOUND_OK else set()
+    errors = sum(
+        1
+        for _, status_code, _ in samples
+        if not 200 <= status_code < 400 and status_code not in allowed
+    )
+    queries = [count for _, _, count in samples if count is not None]
+
+    return {
+        "scenario": scenario,
+        "requests": len(samples),
+        "errors": errors,
+        "status_codes": status_codes,
+        "seconds": round(elapsed, 3),
+        "requests_per_second": round(len(samples) / elapsed, 1),
+        **percentiles_ms(latencies),
+        "mean_queries": round(statistics.mean(queries), 2) if queries else None,
+        "max_queries": max(queries) if queries else None,
+    }
+
+
+def compare(previous, current):
+    """
+    Compare two load_test reports scenario by scenario.
+
+    Returns:
+        list: For each scenario in both, its name and the relative change
+        (current / previous - 1) in p95 latency and throughput
+    """
+    before = {result["scenario"]: result for result in previous["results"]}
+    changes = []
+    for result in current["results"]:
+        old = before.get(result["scenario"])
+        if old is None:
+            continue
+        changes.append(
+            {
+                "scenario": result["scenario"],
+                "p95_change": _change(old["p95_ms"], result["p95_ms"]),
+                "throughput_change": _change(
+                    old["requests_per_second"], result["requests_per_second"]
+                ),
+            }
+        )
+    return changes
+
+
+def _change(old, new):
+    return round(new / old - 1, 3) if old else None
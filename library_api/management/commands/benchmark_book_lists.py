@@ -0,0 +1,137 @@
+import json
+from time import perf_counter
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from rest_framework.renderers import JSONRenderer
+
+from library_api.models import Book, Bookshelf, Category, Series
+from library_api.serializers import (
+    BookListSerializer,
+    BookRowSerializer,
+    BookSerializer,
+)
+
+
+def create_books(user, count):
+    """Create `count` books with realistic field sizes for user."""
+    bookshelves = [
+        Bookshelf.objects.create(name=f"Shelf {i}", user=user) for i in range(5)
+    ]
+    categories = [
+        Category.objects.create(name=f"Category {i}", user=user) for i in range(8)
+    ]
+    series = [Series.objects.create(title=f"Series {i}", user=user) for i in range(20)]
+    books = []
+    for i in range(count):
+        category = categories[i % 8] if i % 5 else None
+        series_row = series[i % 20] if i % 3 == 0 else None
+        book = Book(
+            isbn=str(9780000000000 + i),
+            title=f"Book Title Number {i}",
+            subtitle="A Novel" if i % 2 else None,
+            author=f"Author Name {i % 300}",
+            small_thumbnail=(
+                f"http://books.google.com/books/content?id=vol{i}"
+                "&printsec=frontcover&img=1&zoom=5&source=gbs_api"
+            ),
+            large_thumbnail=(
+                f"http://books.google.com/books/content?id=vol{i}"
+                "&printsec=frontcover&img=1&zoom=1&source=gbs_api"
+            ),
+            details="A description of the book, as Google Books returns it. " * 20,
+            bookshelf=bookshelves[i % 5],
+            user=user,
+            category=category,
+            series=series_row,
+            volume_number=(i // 20) + 1 if series_row else None,
+        )
+        book.refresh_sort_key()
+        books.append(book)
+    Book.objects.bulk_create(books, batch_size=5000)
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare rows per second of the DRF book list serializer and the "
+        "BookRowSerializer fast path. Creates a throwaway library inside a "
+        "transaction that is rolled back afterwards."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--sizes",
+            default="1000,10000,100000",
+            help="Comma-separated list sizes to benchmark.",
+        )
+        parser.add_argument(
+            "--full",
+            action="store_true",
+            help="Benchmark the full representation instead of the compact one.",
+        )
+        parser.add_argument(
+            "--repeat", type=int, default=3, help="Runs per size; the best is kept."
+        )
+        parser.add_argument("--json", help="Also write the results to this file.")
+
+    def handle(self, *args, **options):
+        sizes = sorted(int(size) for size in options["sizes"].split(","))
+        serializer_class = BookSerializer if options["full"] else BookListSerializer
+
+        results = []
+        with transaction.atomic():
+            user = User.objects.create(username="benchmark-book-lists")
+            create_books(user, sizes[-1])
+            books = Book.objects.filter(user=user).order_by("sort_key_text", "id")
+            for size in sizes:
+                result = self.run(books[:size], serializer_class, options["repeat"])
+                results.append({"rows": size, **result})
+                self.stdout.write(
+                    "{rows:>7} rows: serializer {serializer_rows_per_second}/s, "
+                    "fast path {fast_rows_per_second}/s ({speedup}x), "
+                    "identical: {identical}".format(**results[-1])
+                )
+            transaction.set_rollback(True)
+
+        if options["json"]:
+            report = {"serializer": serializer_class.__name__, "results": results}
+            with open(options["json"], "w") as f:
+                json.dump(report, f, indent=2)
+
+    def run(self, books, serializer_class, repeat):
+        """Best-of-`repeat` seconds to query, serialize and render `books` both ways."""
+        renderer = JSONRenderer()
+        paths = serializer_class.model_field_paths()
+        related = list(
+            dict.fromkeys(path.split("__")[0] for path in paths if "__" in path)
+        )
+        instances = books.select_related(*related).only("id", *related, *paths)
+        rows = BookRowSerializer(serializer_class)
+        values = books.values(*rows.value_paths)
+
+        def serializer_path():
+            return renderer.render(serializer_class(instances, many=True).data)
+
+        def fast_path():
+            return renderer.render(rows.to_representation(values))
+
+        timings = {}
+        output = {}
+        for name, render in [("serializer", serializer_path), ("fast", fast_path)]:
+            best = float("inf")
+            for _ in range(repeat):
+                start = perf_counter()
+                output[name] = render()
+                best = min(best, perf_counter() - start)
+            timings[name] = best
+
+        count = books.count()
+        return {
+            "serializer_seconds": round(timings["serializer"], 4),
+            "fast_seconds": round(timings["fast"], 4),
+            "serializer_rows_per_second": round(count / timings["serializer"]),
+            "fast_rows_per_second": round(count / timings["fast"]),
+            "speedup": round(timings["serializer"] / timings["fast"], 1),
+            "identical": output["serializer"] == output["fast"],
+        }
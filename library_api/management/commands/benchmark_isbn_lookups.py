@@ -0,0 +1,108 @@
+import asyncio
+import json
+from concurrent.futures import ThreadPoolExecutor
+from time import perf_counter
+
+from django.core.management.base import BaseCommand
+
+from library_api.books_api_stub import stub_process
+from library_api.load_driver import percentiles_ms
+from library_api.services import google_books
+from library_api.services.async_google_books import afetch_volume_info, close_session
+
+
+def summarize(mode, latencies, elapsed):
+    """Latency percentiles (ms) and throughput for one benchmark run."""
+    return {
+        "mode": mode,
+        "lookups": len(latencies),
+        "seconds": round(elapsed, 3),
+        "lookups_per_second": round(len(latencies) / elapsed, 1),
+        **percentiles_ms(latencies),
+    }
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare the sync (requests + thread pool) and async (aiohttp) Google Books "
+        "clients against a local stub of the API."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--lookups", type=int, default=200)
+        parser.add_argument(
+            "--concurrency",
+            type=int,
+            default=20,
+            help="Worker threads (sync) or in-flight requests (async).",
+        )
+        parser.add_argument(
+            "--latency",
+            type=float,
+            default=0.05,
+            help="Seconds the stub waits before answering each request.",
+        )
+        parser.add_argument(
+            "--keep-rate-limit",
+            action="store_true",
+            help="Leave GOOGLE_BOOKS_RATE_LIMIT in place (off by default).",
+        )
+        parser.add_argument("--json", help="Also write the results to this file.")
+
+    def handle(self, *args, **options):
+        isbns = [str(9780000000000 + i) for i in range(options["lookups"])]
+        concurrency = options["concurrency"]
+
+        if not options["keep_rate_limit"]:
+            google_books.rate_limiter = None
+
+        with stub_process(generate_missing=True, latency=options["latency"]) as url:
+            results = [
+                self.run_sync(url, isbns, concurrency),
+                self.run_async(url, isbns, concurrency),
+            ]
+
+        for result in results:
+            self.stdout.write(
+                "{mode:>5}: {lookups} lookups in {seconds}s "
+                "({lookups_per_second}/s), p50 {p50_ms}ms, p95 {p95_ms}ms, "
+                "p99 {p99_ms}ms".format(**result)
+            )
+
+        if options["json"]:
+            report = {
+                "latency": options["latency"],
+                "concurrency": concurrency,
+                "results": results,
+            }
+            with open(options["json"], "w") as f:
+                json.dump(report, f, indent=2)
+
+    def run_sync(self, api_url, isbns, concurrency):
+        def lookup(isbn):
+            start = perf_counter()
+            google_books.fetch_volume_info(isbn, api_url=api_url)
+            return perf_counter() - start
+
+        start = perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            latencies = list(pool.map(lookup, isbns))
+        return summarize("sync", latencies, perf_counter() - start)
+
+    def run_async(self, api_url, isbns, concurrency):
+        async def run():
+            semaphore = asyncio.Semaphore(concurrency)
+
+            async def lookup(isbn):
+                async with semaphore:
+                    start = perf_counter()
+                    await afetch_volume_info(isbn, api_url=api_url)
+                    return perf_counter() - start
+
+            start = perf_counter()
+            latencies = await asyncio.gather(*(lookup(isbn) for isbn in isbns))
+            elapsed = perf_counter() - start
+            await close_session()
+            return summarize("async", latencies, elapsed)
+
+        return asyncio.run(run())
@@ -0,0 +1,42 @@
+import json
+from time import perf_counter
+
+from django.core.management.base import BaseCommand
+
+from library_api.synthetic_data import generate_libraries
+
+
+class Command(BaseCommand):
+    help = (
+        "Create synthetic users with realistic libraries (shelves, categories, "
+        "series and books) for load tests and benchmarks. Re-running with the "
+        "same options adds nothing."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=10)
+        parser.add_argument(
+            "--books-per-user",
+            type=int,
+            default=1000,
+            help="Average library size; each varies from half to 1.5 times this.",
+        )
+        parser.add_argument(
+            "--prefix", default="loadtest", help='Users are named "<prefix>-<n>".'
+        )
+        parser.add_argument("--password", default="loadtest")
+        parser.add_argument("--seed", type=int, default=0)
+
+    def handle(self, *args, **options):
+        start = perf_counter()
+        report = generate_libraries(
+            options["users"],
+            options["books_per_user"],
+            prefix=options["prefix"],
+            password=options["password"],
+            seed=options["seed"],
+        )
+        elapsed = perf_counter() - start
+        report["seconds"] = round(elapsed, 3)
+        report["books_per_second"] = round(report["books_created"] / elapsed)
+        self.stdout.write(json.dumps(report, indent=2))
@@ -0,0 +1,64 @@
+import json
+import os
+from itertools import chain
+from time import perf_counter
+
+from django.core.management.base import BaseCommand, CommandError
+
+from library_api.services import isbn_store
+
+
+class Command(BaseCommand):
+    help = (
+        "Build the local ISBN store from Open Library-style dumps (JSON lines "
+        "or the tab-separated editions/authors dumps, optionally gzipped), so "
+        "ISBN lookups can be answered without Google Books."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "paths",
+            nargs="+",
+            help="Dump files. Authors may come from the same or a separate dump.",
+        )
+        parser.add_argument(
+            "--store", help="Store file (default: BOOK_ISBN_STORE['PATH'])."
+        )
+        parser.add_argument("--batch-size", type=int)
+        parser.add_argument(
+            "--append",
+            action="store_true",
+            help="Add to the existing store instead of rebuilding it.",
+        )
+
+    def handle(self, *args, **options):
+        path = options["store"] or isbn_store.get_store_settings()["PATH"]
+        if not path:
+            raise CommandError(
+                "No store file: pass --store or set BOOK_ISBN_STORE['PATH']."
+            )
+        for dump in options["paths"]:
+            if not os.path.exists(dump):
+                raise CommandError(f"No such file: {dump!r}.")
+
+        start = perf_counter()
+        files = [isbn_store.open_dump(dump) for dump in options["paths"]]
+        try:
+            report = isbn_store.build(
+                chain.from_iterable(files),
+                path,
+                batch_size=options["batch_size"],
+                append=options["append"],
+            )
+        finally:
+            for f in files:
+                f.close()
+        elapsed = perf_counter() - start
+
+        report["store"] = str(path)
+        report["size_bytes"] = os.path.getsize(path)
+        report["seconds"] = round(elapsed, 3)
+        report["records_per_second"] = round(
+            (report["editions"] + report["authors"]) / elapsed, 1
+        )
+        self.stdout.write(json.dumps(report, indent=2))
@@ -0,0 +1,196 @@
+import json
+import platform
+import subprocess
+from contextlib import ExitStack
+from functools import partial
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import override_settings
+from django.utils import timezone
+
+from library_api import load_driver
+from library_api.books_api_stub import API_PATH, OPEN_LIBRARY_PATH, stub_process
+from library_api.models import Book
+from library_api.services import google_books, metadata_providers
+
+
+def git_commit():
+    """The checked-out commit, or None outside a git checkout."""
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            cwd=settings.BASE_DIR,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def percent(change):
+    return "n/a" if change is None else f"{change:+.1%}"
+
+
+class Command(BaseCommand):
+    help = (
+        "Send a mix of API requests on behalf of synthetic users (see "
+        "generate_library_data) and report latency percentiles, throughput and "
+        "queries per request for each endpoint."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--prefix",
+            default="loadtest",
+            help='Send requests for the users named "<prefix>-<n>".',
+        )
+        parser.add_argument(
+            "--scenarios",
+            default=",".join(load_driver.SCENARIOS),
+            help="Comma-separated scenarios to run (default: all).",
+        )
+        parser.add_argument(
+            "--requests", type=int, default=200, help="Requests per scenario."
+        )
+        parser.add_argument("--concurrency", type=int, default=8)
+        parser.add_argument(
+            "--warmup",
+            type=int,
+            default=10,
+            help="Requests per scenario sent first and left out of the results.",
+        )
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument(
+            "--base-url",
+            help=(
+                "Send requests over HTTP to a running server (e.g. "
+                "http://127.0.0.1:8000) instead of through Django in this "
+                "process. Query counts are only reported in-process."
+            ),
+        )
+        parser.add_argument(
+            "--stub-latency",
+            type=float,
+            default=0.05,
+            help=(
+                "Seconds the Books API stub waits before answering. In-process "
+                "runs start the stub; start it with run_books_api_stub for "
+                "--base-url runs."
+            ),
+        )
+        parser.add_argument(
+            "--stub-error-rate",
+            type=float,
+            default=0.0,
+            help="Fraction of Books API stub requests answered with HTTP 503.",
+        )
+        parser.add_argument(
+            "--keep-rate-limit",
+            action="store_true",
+            help="Leave GOOGLE_BOOKS_RATE_LIMIT in place (off by default).",
+        )
+        parser.add_argument("--json", help="Also write the report to this file.")
+        parser.add_argument(
+            "--compare", help="A previous --json report to compare the results with."
+        )
+
+    def handle(self, *args, **options):
+        scenarios = [name for name in options["scenarios"].split(",") if name]
+        unknown = sorted(set(scenarios) - load_driver.SCENARIOS.keys())
+        if unknown:
+            raise CommandError(f"Unknown scenario {unknown[0]!r}.")
+
+        users = User.objects.filter(
+            username__startswith=f"{options['prefix']}-"
+        ).order_by("id")
+        libraries = [load_driver.Library.load(user) for user in users]
+        if not libraries:
+            raise CommandError(
+                f"No users named {options['prefix']}-<n>; "
+                "run generate_library_data first."
+            )
+
+        with ExitStack() as stack:
+            if options["base_url"]:
+                make_client = partial(load_driver.HTTPClient, options["base_url"])
+            else:
+                make_client = load_driver.InProcessClient
+                stack.enter_context(
+                    override_settings(
+                        ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, "testserver"]
+                    )
+                )
+                # ISBN searches and book details look books up online
+                url = stack.enter_context(
+                    stub_process(
+                        generate_missing=True,
+                        latency=options["stub_latency"],
+                        error_rate=options["stub_error_rate"],
+                        seed=options["seed"],
+                    )
+                )
+                stack.enter_context(
+                    override_settings(
+                        GOOGLE_BOOKS_API_URL=url,
+                        BOOK_METADATA_PROVIDERS={
+                            **metadata_providers.get_provider_settings(),
+                            "OPEN_LIBRARY_URL": url.replace(
+                                API_PATH, OPEN_LIBRARY_PATH
+                            ),
+                        },
+                    )
+                )
+                if not options["keep_rate_limit"]:
+                    stack.callback(
+                        setattr, google_books, "rate_limiter", google_books.rate_limiter
+                    )
+                    google_books.rate_limiter = None
+
+            results = []
+            for scenario in scenarios:
+                result = load_driver.run_scenario(
+                    scenario,
+                    libraries,
+                    options["requests"],
+                    options["concurrency"],
+                    make_client,
+                    warmup=options["warmup"],
+                    seed=options["seed"],
+                )
+                results.append(result)
+                self.stdout.write(
+                    "{scenario:>12}: {requests} requests in {seconds}s "
+                    "({requests_per_second}/s), p50 {p50_ms}ms, p95 {p95_ms}ms, "
+                    "p99 {p99_ms}ms, {mean_queries} queries, "
+                    "{errors} errors".format(**result)
+                )
+
+        report = {
+            "started_at": timezone.now().isoformat(),
+            "git_commit": git_commit(),
+            "python": platform.python_version(),
+            "target": options["base_url"] or "in-process",
+            "users": len(libraries),
+            "books": Book.objects.filter(user__in=users).count(),
+            "requests": options["requests"],
+            "concurrency": options["concurrency"],
+            "results": results,
+        }
+
+        if options["compare"]:
+            with open(options["compare"]) as f:
+                previous = json.load(f)
+            report["compared_with"] = previous.get("git_commit")
+            report["changes"] = load_driver.compare(previous, report)
+            for change in report["changes"]:
+                self.stdout.write(
+                    f"{change['scenario']:>12}: p95 {percent(change['p95_change'])}, "
+                    f"throughput {percent(change['throughput_change'])}"
+                )
+
+        if options["json"]:
+            with open(options["json"], "w") as f:
+                json.dump(report, f, indent=2)
@@ -0,0 +1,47 @@
+from itertools import chain
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from library_api.models import Book
+from library_api.services import covers
+
+
+class Command(BaseCommand):
+    help = (
+        "Download book covers into the local cover store ahead of time, so "
+        "the first request for each doesn't wait on the image host."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--user", help="Only prewarm covers for this username's books."
+        )
+        parser.add_argument(
+            "--max-workers",
+            type=int,
+            help="Concurrent downloads (default: BOOK_COVERS['MAX_WORKERS']).",
+        )
+
+    def handle(self, *args, **options):
+        books = Book.objects.all()
+        if options["user"]:
+            try:
+                user = User.objects.get(username=options["user"])
+            except User.DoesNotExist:
+                raise CommandError(f"User {options['user']!r} does not exist.")
+            books = books.filter(user=user)
+
+        urls = chain.from_iterable(
+            books.order_by()
+            .values_list("small_thumbnail", "large_thumbnail")
+            .distinct()
+            .iterator()
+        )
+        counts = covers.prewarm(
+            (url for url in urls if url), max_workers=options["max_workers"]
+        )
+        self.stdout.write(
+            "Stored {stored}, already cached {cached}, missing {missing}, "
+            "failed {failed}".format(**counts)
+        )
@@ -0,0 +1,55 @@
+from time import sleep
+
+from django.core.management.base import BaseCommand
+
+from library_api.services import enrichment
+
+
+class Command(BaseCommand):
+    help = (
+        "Fill in pending books from Google Books. Runs until interrupted, "
+        "or until the queue has no due jobs with --once."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--once",
+            action="store_true",
+            help="Exit once no jobs are due instead of polling for more.",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            help="Jobs claimed per iteration (default: BOOK_ENRICHMENT['BATCH_SIZE']).",
+        )
+        parser.add_argument(
+            "--max-workers",
+            type=int,
+            help="Concurrent lookups per batch (default: GOOGLE_BOOKS_MAX_WORKERS).",
+        )
+        parser.add_argument(
+            "--poll-interval",
+            type=float,
+            default=2.0,
+            help="Seconds to wait when no jobs are due.",
+        )
+
+    def handle(self, *args, **options):
+        try:
+            while True:
+                counts = enrichment.run_once(
+                    batch_size=options["batch_size"],
+                    max_workers=options["max_workers"],
+                )
+                if counts["claimed"]:
+                    self.stdout.write(
+                        "Enriched {done}, retrying {retried}, failed {failed}".format(
+                            **counts
+                        )
+                    )
+                elif options["once"]:
+                    break
+                else:
+                    sleep(options["poll_interval"])
+        except KeyboardInterrupt:
+            pass
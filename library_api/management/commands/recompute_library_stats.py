@@ -0,0 +1,41 @@
+import json
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from library_api.services.library_stats import recompute
+
+
+class Command(BaseCommand):
+    help = (
+        "Rebuild the library statistics from scratch and report any counts "
+        "the incremental updates got wrong."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "usernames", nargs="*", help="Only these users (default: everyone)."
+        )
+        parser.add_argument(
+            "--check",
+            action="store_true",
+            help="Only report mismatches, and exit with an error if there are any.",
+        )
+
+    def handle(self, *args, **options):
+        user_ids = None
+        if options["usernames"]:
+            users = dict(
+                User.objects.filter(username__in=options["usernames"]).values_list(
+                    "username", "id"
+                )
+            )
+            missing = sorted(set(options["usernames"]) - users.keys())
+            if missing:
+                raise CommandError(f"No user named {missing[0]!r}.")
+            user_ids = list(users.values())
+
+        report = recompute(user_ids, dry_run=options["check"])
+        self.stdout.write(json.dumps(report, indent=2))
+        if options["check"] and report["mismatched"]:
+            raise CommandError(f"{report['mismatched']} statistics are out of date.")
@@ -0,0 +1,58 @@
+import json
+from time import perf_counter
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from library_api.models import Book
+from library_api.services import metadata_snapshots
+
+
+class Command(BaseCommand):
+    help = (
+        "Fetch the Google Books data stored with each book again where it's "
+        "missing or older than --max-age, in batches of concurrent lookups."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--max-age",
+            type=float,
+            help=(
+                "Refresh snapshots older than this many days (default: "
+                "BOOK_METADATA_SNAPSHOTS['MAX_AGE']); 0 refreshes them all."
+            ),
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            help="Books per batch (default: BOOK_METADATA_SNAPSHOTS['BATCH_SIZE']).",
+        )
+        parser.add_argument(
+            "--max-workers",
+            type=int,
+            help="Concurrent lookups per batch (default: GOOGLE_BOOKS_MAX_WORKERS).",
+        )
+        parser.add_argument(
+            "--user", help="Only refresh snapshots of this username's books."
+        )
+
+    def handle(self, *args, **options):
+        books = Book.objects.all()
+        if options["user"]:
+            try:
+                user = User.objects.get(username=options["user"])
+            except User.DoesNotExist:
+                raise CommandError(f"User {options['user']!r} does not exist.")
+            books = books.filter(user=user)
+
+        max_age = options["max_age"]
+        start = perf_counter()
+        report = metadata_snapshots.refresh(
+            max_age=None if max_age is None else max_age * 24 * 60 * 60,
+            batch_size=options["batch_size"],
+            max_workers=options["max_workers"],
+            books=books,
+        )
+        report["seconds"] = round(perf_counter() - start, 3)
+        self.stdout.write(json.dumps(report, indent=2))
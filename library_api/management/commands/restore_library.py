@@ -0,0 +1,55 @@
+import json
+from time import perf_counter
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from library_api.services.restore import csv_rows, ndjson_rows, restore_library
+
+
+class Command(BaseCommand):
+    help = (
+        "Restore books into a user's library from an NDJSON or CSV export, "
+        "without fetching anything from Google Books."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("username")
+        parser.add_argument("path", help="Export file (.ndjson/.jsonl or .csv).")
+        parser.add_argument(
+            "--format",
+            dest="file_format",
+            choices=["ndjson", "csv"],
+            help="File format (default: from the file extension).",
+        )
+        parser.add_argument("--batch-size", type=int)
+        parser.add_argument(
+            "--include-existing",
+            action="store_true",
+            help="Also restore ISBNs already in the library.",
+        )
+
+    def handle(self, *args, **options):
+        try:
+            user = User.objects.get(username=options["username"])
+        except User.DoesNotExist:
+            raise CommandError(f"No user named {options['username']!r}.")
+
+        file_format = options["file_format"] or (
+            "csv" if options["path"].lower().endswith(".csv") else "ndjson"
+        )
+        parse = csv_rows if file_format == "csv" else ndjson_rows
+
+        start = perf_counter()
+        with open(options["path"], "rb") as f:
+            report = restore_library(
+                user,
+                parse(f),
+                skip_existing=not options["include_existing"],
+                batch_size=options["batch_size"],
+            )
+        elapsed = perf_counter() - start
+
+        report["seconds"] = round(elapsed, 3)
+        report["books_per_second"] = round(report["created"] / elapsed, 1)
+        self.stdout.write(json.dumps(report, indent=2))
@@ -0,0 +1,52 @@
+from django.core.management.base import BaseCommand
+
+from library_api.books_api_stub import BooksAPIStub
+
+
+class Command(BaseCommand):
+    help = (
+        "Serve a local imitation of the Google Books volumes API. Start the "
+        "API server with GOOGLE_BOOKS_API_URL set to the printed URL to use it."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--host", default="127.0.0.1")
+        parser.add_argument("--port", type=int, default=8001)
+        parser.add_argument(
+            "--latency",
+            type=float,
+            default=0.0,
+            help="Seconds to wait before answering each request.",
+        )
+        parser.add_argument(
+            "--error-rate",
+            type=float,
+            default=0.0,
+            help="Fraction of requests answered with HTTP 503.",
+        )
+        parser.add_argument("--seed", type=int)
+        parser.add_argument(
+            "--no-generate-missing",
+            action="store_false",
+            dest="generate_missing",
+            help='Answer "no results" for every ISBN instead of inventing a volume.',
+        )
+
+    def handle(self, *args, **options):
+        stub = BooksAPIStub(
+            generate_missing=options["generate_missing"],
+            latency=options["latency"],
+            error_rate=options["error_rate"],
+            seed=options["seed"],
+            host=options["host"],
+            port=options["port"],
+        )
+
+        def ready():
+            self.stdout.write(f"Serving on {stub.url}")
+            self.stdout.flush()
+
+        try:
+            stub.serve_forever(on_ready=ready)
+        except KeyboardInterrupt:
+            pass
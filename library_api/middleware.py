@@ -0,0 +1,106 @@
+from time import perf_counter
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connection
+from django.db.backends.signals import connection_created
+
+from .services import request_metrics
+
+
+class RequestMetricsMiddleware:
+    """
+    Times each request and its SQL, Google Books, serialization, rendering
+    and authentication phases (see services.request_metrics).
+
+    The timings go into the per-view histograms served by the metrics
+    endpoint and, unless REQUEST_METRICS["SERVER_TIMING"] is off, into a
+    Server-Timing response header that browser dev tools display. Streamed
+    responses are timed until their first byte. Unless
+    REQUEST_METRICS["ENABLED"] is set, the middleware removes itself at
+    startup.
+
+    Works under both WSGI and ASGI. SQL is timed on every database
+    connection opened after startup, not just the request thread's, so
+    queries an async view hands off with sync_to_async count towards its
+    "db" phase too.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        config = request_metrics.get_request_metrics_settings()
+        if not config["ENABLED"]:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.server_timing = config["SERVER_TIMING"]
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+        # Connections opened from now on, in any thread; the current
+        # thread's may already be open, so requests check theirs too
+        connection_created.connect(
+            install_query_timer, dispatch_uid="request_metrics_query_timer"
+        )
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        install_query_timer(connection=connection)
+        with request_metrics.collect() as timings:
+            start = perf_counter()
+            response = self.get_response(request)
+            timings.total = perf_counter() - start
+        return self.finish(request, response, timings)
+
+    async def __acall__(self, request):
+        # The timings are a context variable, which sync_to_async copies
+        # into the thread it runs the view's database work on
+        with request_metrics.collect() as timings:
+            start = perf_counter()
+            response = await self.get_response(request)
+            timings.total = perf_counter() - start
+        return self.finish(request, response, timings)
+
+    def finish(self, request, response, timings):
+        """Record a finished request's timings and add its Server-Timing header."""
+        match = request.resolver_match
+        view = match.view_name if match is not None else "<unresolved>"
+        request_metrics.registry.observe(
+            view, request.method, response.status_code, timings
+        )
+        if self.server_timing:
+            response["Server-Timing"] = timings.server_timing()
+        return response
+
+    def process_template_response(self, request, response):
+        # DRF responses are rendered after the view returns
+        timings = request_metrics.current()
+        if timings is not None:
+            start = perf_counter()
+            response.add_post_render_callback(
+                lambda response: timings.add("render", perf_counter() - start)
+            )
+        return response
+
+
+def time_query(execute, sql, params, many, context):
+    """Database execute wrapper adding each query to the current request's "db"."""
+    start = perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        timings = request_metrics.current()
+        if timings is not None:
+            timings.add("db", perf_counter() - start)
+
+
+def install_query_timer(sender=None, connection=None, **kwargs):
+    """
+    Add time_query to a connection's execute wrappers, once.
+
+    It stays installed; outside a request it costs one context variable
+    lookup per query.
+    """
+    if time_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(time_query)
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library_api', '0004_book_details_book_large_thumbnail_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BookMetadata',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('isbn', models.CharField(max_length=13, unique=True)),
+                ('data', models.JSONField(default=dict)),
+                ('found', models.BooleanField(default=True)),
+                ('fetched_at', models.DateTimeField()),
+            ],
+        ),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:59
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def populate_sort_key_text(apps, schema_editor):
+    # Historical models don't have Book.refresh_sort_key, so this mirrors it
+    Book = apps.get_model('library_api', 'Book')
+    books = []
+    for book in Book.objects.select_related('category', 'series').iterator(chunk_size=500):
+        book.sort_key_text = '\x01'.join([
+            book.category.name if book.category else '',
+            book.author,
+            '1' if book.series else '0',
+            book.series.title if book.series else '',
+            f'{book.volume_number or 0:010d}',
+            book.title,
+        ])
+        books.append(book)
+        if len(books) >= 500:
+            Book.objects.bulk_update(books, ['sort_key_text'])
+            books = []
+    if books:
+        Book.objects.bulk_update(books, ['sort_key_text'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library_api', '0005_bookmetadata'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='book',
+            name='sort_key_text',
+            field=models.CharField(db_collation='C', default='', editable=False, max_length=1000),
+        ),
+        migrations.RunPython(populate_sort_key_text, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='book',
+            index=models.Index(fields=['user', 'sort_key_text', 'id'], name='book_user_sort_key_idx'),
+        ),
+    ]
@@ -0,0 +1,128 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:48
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+# Book columns the statistics are grouped by
+STAT_COLUMNS = "user_id, category_id, author, bookshelf_id, series_id, volume_number"
+
+# Adds the per-key sum of "delta" over the rows of {changes} to
+# library_api_librarystat. {changes} is a query returning STAT_COLUMNS and
+# a delta of 1 (book added) or -1 (book removed) per row.
+APPLY_CHANGES_SQL = """
+    WITH changes AS ({changes}),
+    deltas AS (
+        SELECT user_id, 'total' AS dimension, '' AS key, sum(delta) AS delta
+        FROM changes GROUP BY user_id
+        UNION ALL
+        SELECT user_id, 'category', coalesce(category_id::text, ''), sum(delta)
+        FROM changes GROUP BY user_id, category_id
+        UNION ALL
+        SELECT user_id, 'author', author, sum(delta)
+        FROM changes GROUP BY user_id, author
+        UNION ALL
+        SELECT user_id, 'bookshelf', bookshelf_id::text, sum(delta)
+        FROM changes GROUP BY user_id, bookshelf_id
+        UNION ALL
+        SELECT user_id, 'series', series_id::text, sum(delta)
+        FROM changes WHERE series_id IS NOT NULL GROUP BY user_id, series_id
+        UNION ALL
+        SELECT user_id, 'volume', series_id || ':' || volume_number, sum(delta)
+        FROM changes WHERE series_id IS NOT NULL AND volume_number IS NOT NULL
+        GROUP BY user_id, series_id, volume_number
+    )
+    INSERT INTO library_api_librarystat (user_id, dimension, key, count)
+    SELECT user_id, dimension, key, delta FROM deltas WHERE delta <> 0
+    -- A consistent order, so concurrent writers lock rows in the same order
+    ORDER BY user_id, dimension, key
+    ON CONFLICT (user_id, dimension, key)
+    DO UPDATE SET count = library_api_librarystat.count + EXCLUDED.count
+"""
+
+# One statement-level trigger per operation, each reading the rows the
+# statement changed from its transition tables, so a bulk insert, COPY
+# or delete costs one aggregate rather than an upsert per row.
+#
+# Rows the statement brought to zero or below are then deleted. Counts only
+# go negative when a user's stats were deleted before their books (both
+# cascade from the user).
+TRIGGER_SOURCES = {
+    "insert": (
+        "REFERENCING NEW TABLE AS new_rows",
+        "SELECT {columns}, 1 AS delta FROM new_rows",
+    ),
+    "update": (
+        "REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows",
+        "SELECT {columns}, -1 AS delta FROM old_rows "
+        "UNION ALL SELECT {columns}, 1 AS delta FROM new_rows",
+    ),
+    "delete": (
+        "REFERENCING OLD TABLE AS old_rows",
+        "SELECT {columns}, -1 AS delta FROM old_rows",
+    ),
+}
+
+CREATE_TRIGGERS_SQL = [
+    f"""
+    CREATE FUNCTION library_api_book_stats_{operation}() RETURNS trigger
+    LANGUAGE plpgsql AS $$
+    DECLARE
+        emptied bigint[];
+    BEGIN
+        WITH upserted AS (
+            {APPLY_CHANGES_SQL.format(changes=changes.format(columns=STAT_COLUMNS))}
+            RETURNING id, count
+        )
+        SELECT array_agg(id) INTO emptied FROM upserted WHERE count <= 0;
+        IF emptied IS NOT NULL THEN
+            DELETE FROM library_api_librarystat WHERE id = ANY(emptied);
+        END IF;
+        RETURN NULL;
+    END
+    $$;
+    CREATE TRIGGER library_api_book_stats_{operation}
+    AFTER {operation.upper()} ON library_api_book {transition}
+    FOR EACH STATEMENT EXECUTE FUNCTION library_api_book_stats_{operation}();
+    """
+    for operation, (transition, changes) in TRIGGER_SOURCES.items()
+]
+
+DROP_TRIGGERS_SQL = [
+    f"""
+    DROP TRIGGER library_api_book_stats_{operation} ON library_api_book;
+    DROP FUNCTION library_api_book_stats_{operation}();
+    """
+    for operation in TRIGGER_SOURCES
+]
+
+# Counts the books that already exist
+BACKFILL_SQL = APPLY_CHANGES_SQL.format(
+    changes=f"SELECT {STAT_COLUMNS}, 1 AS delta FROM library_api_book"
+)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library_api', '0010_coverimage'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LibraryStat',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('dimension', models.CharField(choices=[('total', 'Total'), ('category', 'Category'), ('author', 'Author'), ('bookshelf', 'Bookshelf'), ('series', 'Series'), ('volume', 'Volume')], max_length=10)),
+                ('key', models.CharField(blank=True, max_length=255)),
+                ('count', models.IntegerField(default=0)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='library_stats', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('user', 'dimension', 'key'), name='library_stat_unique_key')],
+            },
+        ),
+        migrations.RunSQL(CREATE_TRIGGERS_SQL, reverse_sql=DROP_TRIGGERS_SQL),
+        migrations.RunSQL(BACKFILL_SQL, reverse_sql=migrations.RunSQL.noop),
+    ]
@@ -1,41 +1,172 @@
 from django.db import models
 from django.contrib.auth import get_user_model
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVector, SearchVectorField
+from django.utils import timezone
 
 # For the User model
 from django.contrib.auth.models import User as DjangoUser
 
 User = get_user_model()  # type: type[DjangoUser]
 
+# Separates the parts of Book.sort_key_text. It sorts below every printable
+# character, so comparing the joined strings matches comparing the tuples.
+SORT_KEY_SEPARATOR = "\x01"
 
-class Category(models.Model):
+
+def _bump_library_version(*user_ids):
+    from .services.library_version import bump_version
+
+    bump_version(*user_ids)
+
+
+class LibraryQuerySet(models.QuerySet):
+    def delete(self):
+        """Delete the rows and bump their owners' LibraryVersion."""
+        user_ids = list(self.order_by().values_list("user_id", flat=True).distinct())
+        result = super().delete()
+        _bump_library_version(*user_ids)
+        return result
+
+    delete.alters_data = True
+    delete.queryset_only = True
+
+
+class LibraryModel(models.Model):
+    """
+    Base for the models that make up a user's library. Saving or deleting
+    one bumps the owner's LibraryVersion; cascaded deletes are covered by
+    the delete that started them, so Django can still delete them in bulk.
+    """
+
+    objects = LibraryQuerySet.as_manager()
+
+    class Meta:
+        abstract = True
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        _bump_library_version(self.user_id)
+
+    def delete(self, *args, **kwargs):
+        result = super().delete(*args, **kwargs)
+        _bump_library_version(self.user_id)
+        return result
+
+
+class Category(LibraryModel):
     name = models.CharField(max_length=100)
     user = models.ForeignKey(
-        User, on_delete=models.CASCADE, related_name="categories", null=True
+        User,
+        on_delete=models.CASCADE,
+        related_name="categories",
+        null=True,
+        # Covered by the (user, id) index
+        db_index=False,
     )
 
+    class Meta:
+        indexes = [models.Index(fields=["user", "id"], name="category_user_id_idx")]
+
     def __str__(self):
         return self.name
 
+    def save(self, *args, **kwargs):
+        renamed = (
+            self.pk is not None
+            and not Category.objects.filter(pk=self.pk, name=self.name).exists()
+        )
+        super().save(*args, **kwargs)
+        if renamed:
+            self.book_set.all().refresh_sort_keys()
+
+    def delete(self, *args, **kwargs):
+        # Books are detached with SET_NULL, which bypasses Book.save()
+        book_ids = list(self.book_set.values_list("id", flat=True))
+        result = super().delete(*args, **kwargs)
+        Book.objects.filter(id__in=book_ids).refresh_sort_keys()
+        return result
+
 
-class Series(models.Model):
+class Series(LibraryModel):
     title = models.CharField(max_length=255)
     user = models.ForeignKey(
-        User, on_delete=models.CASCADE, related_name="series", null=True
+        User,
+        on_delete=models.CASCADE,
+        related_name="series",
+        null=True,
+        # Covered by the (user, id) index
+        db_index=False,
     )
 
+    class Meta:
+        indexes = [models.Index(fields=["user", "id"], name="series_user_id_idx")]
+
     def __str__(self):
         return self.title
 
+    def save(self, *args, **kwargs):
+        renamed = (
+            self.pk is not None
+            and not Series.objects.filter(pk=self.pk, title=self.title).exists()
+        )
+        super().save(*args, **kwargs)
+        if renamed:
+            self.book_set.all().refresh_sort_keys()
+
+    def delete(self, *args, **kwargs):
+        # Books are detached with SET_NULL, which bypasses Book.save()
+        book_ids = list(self.book_set.values_list("id", flat=True))
+        result = super().delete(*args, **kwargs)
+        Book.objects.filter(id__in=book_ids).refresh_sort_keys()
+        return result
 
-class Bookshelf(models.Model):
+
+class Bookshelf(LibraryModel):
     name = models.CharField(max_length=255)
-    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="bookshelves")
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name="bookshelves",
+        # Covered by the (user, id) index
+        db_index=False,
+    )
+
+    class Meta:
+        indexes = [models.Index(fields=["user", "id"], name="bookshelf_user_id_idx")]
 
     def __str__(self):
         return f"{self.name} ({self.user.username})"
 
 
-class Book(models.Model):
+class BookQuerySet(LibraryQuerySet):
+    def refresh_sort_keys(self, batch_size=500):
+        """Recompute sort_key_text for every book in the queryset."""
+        books = []
+        user_ids = set()
+        for book in self.select_related("category", "series").iterator(
+            chunk_size=batch_size
+        ):
+            book.refresh_sort_key()
+            books.append(book)
+            user_ids.add(book.user_id)
+            if len(books) >= batch_size:
+                Book.objects.bulk_update(books, ["sort_key_text"])
+                books = []
+        if books:
+            Book.objects.bulk_update(books, ["sort_key_text"])
+        # The list order changed, so bump again after the rename's own bump
+        _bump_library_version(*user_ids)
+
+
+class Book(LibraryModel):
+    class EnrichmentStatus(models.TextChoices):
+        # Waiting for the enrichment worker to fetch Google Books metadata
+        PENDING = "pending"
+        DONE = "done"
+        # Gave up after the configured number of attempts
+        FAILED = "failed"
+
     isbn = models.CharField(max_length=13)
     title = models.CharField(max_length=255, default="Unknown Title")
     subtitle = models.CharField(max_length=255, blank=True, null=True)
@@ -46,26 +177,257 @@ class Book(models.Model):
     bookshelf = models.ForeignKey(
         Bookshelf, on_delete=models.CASCADE, related_name="books"
     )
-    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="books")
+    # Indexed by the composite indexes below, which all lead with user
+    user = models.ForeignKey(
+        User, on_delete=models.CASCADE, related_name="books", db_index=False
+    )
     category = models.ForeignKey(Category, on_delete=models.SET_NULL, null=True)
     series = models.ForeignKey(Series, on_delete=models.SET_NULL, null=True, blank=True)
     volume_number = models.PositiveIntegerField(null=True, blank=True)
+    enrichment_status = models.CharField(
+        max_length=10,
+        choices=EnrichmentStatus.choices,
+        default=EnrichmentStatus.DONE,
+        editable=False,
+    )
+    # Full Google Books data for the ISBN as of metadata_fetched_at, shown
+    # with the book's details (see services/metadata_snapshots.py)
+    metadata_snapshot = models.BinaryField(null=True, editable=False)
+    metadata_fetched_at = models.DateTimeField(null=True, editable=False, db_index=True)
+    # Materialized form of sort_key so lists can be ordered and paginated by
+    # the database. "C" collation keeps the order byte-wise, like the tuple.
+    sort_key_text = models.CharField(
+        max_length=1000, default="", editable=False, db_collation="C"
+    )
+    # Full-text search document, maintained by Postgres on every write
+    # (including bulk_create/update, which skip save())
+    search_vector = models.GeneratedField(
+        expression=(
+            SearchVector("title", weight="A", config="english")
+            + SearchVector("author", weight="A", config="english")
+            + SearchVector("subtitle", weight="B", config="english")
+            + SearchVector("details", weight="C", config="english")
+        ),
+        output_field=SearchVectorField(),
+        db_persist=True,
+    )
+
+    objects = BookQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=["user", "sort_key_text", "id"], name="book_user_sort_key_idx"
+            ),
+            # Lists of one bookshelf, in list order
+            models.Index(
+                fields=["user", "bookshelf", "sort_key_text", "id"],
+                name="book_user_shelf_sort_key_idx",
+            ),
+            # Duplicate checks when importing and restoring
+            models.Index(fields=["user", "isbn"], name="book_user_isbn_idx"),
+            GinIndex(fields=["search_vector"], name="book_search_vector_idx"),
+            # Trigram indexes for typo-tolerant title and author matches
+            GinIndex(
+                fields=["title"], opclasses=["gin_trgm_ops"], name="book_title_trgm_idx"
+            ),
+            GinIndex(
+                fields=["author"], opclasses=["gin_trgm_ops"], name="book_author_trgm_idx"
+            ),
+        ]
 
     def __str__(self):
         return f"{self.title} by {self.author}"
 
+    def save(self, *args, **kwargs):
+        self.refresh_sort_key()
+        update_fields = kwargs.get("update_fields")
+        if update_fields is not None and "sort_key_text" not in update_fields:
+            kwargs["update_fields"] = [*update_fields, "sort_key_text"]
+        super().save(*args, **kwargs)
+
     @property
     def sort_key(self):
-        return (
-            self.category.name if self.category else "",
+        return self.build_sort_key(
+            self.category.name if self.category else None,
             self.author,
-            1 if self.series else 0,
-            self.series.title if self.series else "",
-            self.volume_number or 0,
+            self.series.title if self.series else None,
+            self.volume_number,
             self.title,
         )
 
+    @staticmethod
+    def build_sort_key(category_name, author, series_title, volume_number, title):
+        """Build a sort_key tuple from plain values (None for no category/series)."""
+        return (
+            category_name or "",
+            author,
+            1 if series_title is not None else 0,
+            series_title or "",
+            volume_number or 0,
+            title,
+        )
+
+    @staticmethod
+    def encode_sort_key(sort_key):
+        """Encode a sort_key tuple as the string stored in sort_key_text."""
+        category, author, in_series, series, volume_number, title = sort_key
+        return SORT_KEY_SEPARATOR.join(
+            [
+                category,
+                author,
+                str(in_series),
+                series,
+                # Zero-padded so volumes order numerically
+                f"{volume_number:010d}",
+                title,
+            ]
+        )
+
+    def refresh_sort_key(self):
+        """Update sort_key_text from the current sort_key (does not save)."""
+        self.sort_key_text = self.encode_sort_key(self.sort_key)
+
     def get_google_data(self):
-        from .services.google_books import fetch_book_data
+        """
+        Google Books data for the ISBN: {} if not found, None if unavailable.
+
+        Served from the book's snapshot; without one, the data is looked up
+        and stored as the snapshot.
+        """
+        from .services import metadata_snapshots
+        from .services.google_books import GoogleBooksUnavailable, fetch_book_data
+
+        if self.metadata_snapshot is not None:
+            return metadata_snapshots.decode(self.metadata_snapshot)
+        try:
+            # Shown in full, so upgrade a partial search result
+            data = fetch_book_data(self.isbn, full=True)
+        except GoogleBooksUnavailable:
+            return None
+        metadata_snapshots.store(self, data)
+        return data
+
+
+class BookMetadata(models.Model):
+    """
+    Shared, persistent cache of Google Books volumeInfo keyed by normalized ISBN.
+
+    Rows are not owned by any user; an empty payload with found=False records
+    a "not found" answer so repeat misses don't hit the API either.
+    """
+
+    isbn = models.CharField(max_length=13, unique=True)
+    data = models.JSONField(default=dict)
+    found = models.BooleanField(default=True)
+    fetched_at = models.DateTimeField()
+
+    def __str__(self):
+        return f"{self.isbn} ({'found' if self.found else 'not found'})"
+
+
+class EnrichmentJob(models.Model):
+    """
+    Queued request to fill in a book's metadata from Google Books.
+
+    Drained by the process_enrichment_queue management command. A job is
+    deleted once its book is enriched; failed jobs are kept with their last
+    error until the book is re-queued.
+    """
+
+    class Status(models.TextChoices):
+        PENDING = "pending"
+        FAILED = "failed"
+
+    book = models.OneToOneField(
+        Book, on_delete=models.CASCADE, related_name="enrichment_job"
+    )
+    status = models.CharField(
+        max_length=10, choices=Status.choices, default=Status.PENDING
+    )
+    attempts = models.PositiveIntegerField(default=0)
+    # Earliest time a worker may pick the job up. Workers push it forward
+    # when they claim a job, so a crashed worker's jobs become available
+    # again once that lease runs out.
+    run_after = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True, default="")
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["status", "run_after"], name="enrichment_job_due_idx")
+        ]
+
+    def __str__(self):
+        return f"{self.book.isbn} ({self.status}, {self.attempts} attempts)"
 
-        return fetch_book_data(self.isbn)
+
+class LibraryVersion(models.Model):
+    """
+    Per-user counter bumped on every write to the user's books, bookshelves,
+    categories or series. List and detail responses use it as their ETag.
+    """
+
+    user = models.OneToOneField(
+        User, on_delete=models.CASCADE, primary_key=True, related_name="library_version"
+    )
+    version = models.PositiveBigIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.user_id} v{self.version}"
+
+
+class CoverImage(models.Model):
+    """
+    A downloaded cover image, keyed by its source URL.
+
+    The bytes live in the content-addressed cover store under their SHA-256
+    digest (see services/covers.py), so identical images share one file
+    however many books, users or URLs point at them. found=False records
+    that the source had no image, so it isn't requested again right away.
+    """
+
+    url = models.URLField(max_length=1000, unique=True)
+    digest = models.CharField(max_length=64, blank=True, db_index=True)
+    content_type = models.CharField(max_length=100, blank=True)
+    size = models.PositiveIntegerField(default=0)
+    found = models.BooleanField(default=True)
+    fetched_at = models.DateTimeField()
+
+    def __str__(self):
+        return f"{self.url} ({self.digest[:12] if self.found else 'not found'})"
+
+
+class LibraryStat(models.Model):
+    """
+    Per-user count of books by category, author, bookshelf, series and
+    series volume, plus the user's total.
+
+    Rows are kept up to date by statement-level triggers on the book table
+    (see migration 0011), so every write path, including bulk_create, COPY
+    and cascaded deletes, is counted. Rows whose count drops to zero are
+    deleted. recompute_library_stats rebuilds them from the books.
+    """
+
+    class Dimension(models.TextChoices):
+        TOTAL = "total"  # key is ""
+        CATEGORY = "category"  # key is the category id, or "" for none
+        AUTHOR = "author"  # key is the author name
+        BOOKSHELF = "bookshelf"  # key is the bookshelf id
+        SERIES = "series"  # key is the series id
+        VOLUME = "volume"  # key is "<series id>:<volume number>"
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="library_stats")
+    dimension = models.CharField(max_length=10, choices=Dimension.choices)
+    key = models.CharField(max_length=255, blank=True)
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["user", "dimension", "key"], name="library_stat_unique_key"
+            )
+        ]
+
+    def __str__(self):
+        return f"{self.user_id} {self.dimension} {self.key!r}: {self.count}"
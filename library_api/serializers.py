@@ -1,16 +1,52 @@
+from operator import itemgetter
+
 from rest_framework import serializers
 from .models import Book, Bookshelf, Category, Series
+from .services import request_metrics
+from .services.covers import cover_url, cover_url_builder
 from django.contrib.auth.models import User
 
 
-class BookSerializer(serializers.ModelSerializer):
+class SparseFieldsetMixin:
+    """
+    Lets a serializer be limited to some of its fields by passing
+    `fields` (a list of names); None keeps them all.
+    """
+
+    def __init__(self, *args, fields=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        if fields is not None:
+            for name in set(self.fields) - set(fields):
+                self.fields.pop(name)
+
+
+class TimedDataMixin:
+    """Counts building `.data` as the request's serialization time."""
+
+    @property
+    def data(self):
+        with request_metrics.timed("serialize"):
+            return super().data
+
+
+class TimedListSerializer(TimedDataMixin, serializers.ListSerializer):
+    pass
+
+
+class BookSerializer(
+    TimedDataMixin, SparseFieldsetMixin, serializers.ModelSerializer
+):
     category_name = serializers.SerializerMethodField(read_only=True)
     bookshelf_name = serializers.SerializerMethodField(read_only=True)
     series_title = serializers.SerializerMethodField(read_only=True)
     sort_key = serializers.SerializerMethodField(read_only=True)  # Add this line
+    # Thumbnails served from the local cover store
+    small_cover_url = serializers.SerializerMethodField(read_only=True)
+    large_cover_url = serializers.SerializerMethodField(read_only=True)
 
     class Meta:
         model = Book
+        list_serializer_class = TimedListSerializer
         fields = [
             "id",
             "isbn",
@@ -19,6 +55,8 @@ class BookSerializer(serializers.ModelSerializer):
             "author",
             "small_thumbnail",
             "large_thumbnail",
+            "small_cover_url",
+            "large_cover_url",
             "details",
             "bookshelf",
             "bookshelf_name",
@@ -27,10 +65,40 @@ class BookSerializer(serializers.ModelSerializer):
             "series",
             "series_title",
             "volume_number",
+            "enrichment_status",
             "user",
             "sort_key",
         ]
-        read_only_fields = ["user"]
+        read_only_fields = ["user", "enrichment_status"]
+
+    # Model fields read by the fields that aren't model fields themselves,
+    # so views can load only the columns a response needs
+    computed_field_sources = {
+        "bookshelf_name": ["bookshelf__name"],
+        "category_name": ["category__name"],
+        "series_title": ["series__title"],
+        "sort_key": [
+            "category__name",
+            "author",
+            "series__title",
+            "volume_number",
+            "title",
+        ],
+        "small_cover_url": ["small_thumbnail"],
+        "large_cover_url": ["large_thumbnail"],
+        "google_data": ["isbn", "metadata_snapshot"],
+    }
+
+    @classmethod
+    def model_field_paths(cls, fields=None):
+        """
+        Return the model field paths (e.g. "category__name") needed to
+        serialize the given fields (default: all of Meta.fields).
+        """
+        paths = []
+        for name in fields or cls.Meta.fields:
+            paths.extend(cls.computed_field_sources.get(name, [name]))
+        return list(dict.fromkeys(paths))
 
     def get_category_name(self, obj):
         return obj.category.name if obj.category else None
@@ -45,6 +113,96 @@ class BookSerializer(serializers.ModelSerializer):
     def get_sort_key(self, obj):
         return obj.sort_key
 
+    def get_small_cover_url(self, obj):
+        return cover_url(obj.small_thumbnail)
+
+    def get_large_cover_url(self, obj):
+        return cover_url(obj.large_thumbnail)
+
+
+class BookListSerializer(BookSerializer):
+    """
+    Compact representation for lists (?view=compact): leaves out the
+    description, the large cover and the owner, which a table of books
+    doesn't show.
+    """
+
+    class Meta(BookSerializer.Meta):
+        fields = [
+            "id",
+            "isbn",
+            "title",
+            "subtitle",
+            "author",
+            "small_thumbnail",
+            "small_cover_url",
+            "bookshelf",
+            "bookshelf_name",
+            "category",
+            "category_name",
+            "series",
+            "series_title",
+            "volume_number",
+            "enrichment_status",
+            "sort_key",
+        ]
+
+
+class BookRowSerializer:
+    """
+    Read-only fast path for lists of books.
+
+    Builds exactly what `serializer_class` (BookSerializer or
+    BookListSerializer, limited to `fields`) would, but from
+    `.values(*value_paths)` rows: no model instances, and no per-field
+    to_representation calls. The parity tests hold the two to
+    byte-identical JSON, so a field added to BookSerializer needs a
+    matching entry here if it isn't a plain model field.
+    """
+
+    def __init__(self, serializer_class, fields=None):
+        names = [
+            name
+            for name in serializer_class.Meta.fields
+            if fields is None or name in fields
+        ]
+        self.value_paths = serializer_class.model_field_paths(names)
+        computed = self.computed_fields()
+        unsupported = [
+            name
+            for name in names
+            if name in serializer_class.computed_field_sources and name not in computed
+        ]
+        if unsupported:
+            raise ValueError(f"No row representation for {', '.join(unsupported)}.")
+        self.getters = [
+            (name, computed.get(name) or itemgetter(name)) for name in names
+        ]
+
+    @staticmethod
+    def computed_fields():
+        """Functions building each computed field from a row."""
+        build_cover_url = cover_url_builder()
+        return {
+            "bookshelf_name": itemgetter("bookshelf__name"),
+            "category_name": itemgetter("category__name"),
+            "series_title": itemgetter("series__title"),
+            "sort_key": lambda row: Book.build_sort_key(
+                row["category__name"],
+                row["author"],
+                row["series__title"],
+                row["volume_number"],
+                row["title"],
+            ),
+            "small_cover_url": lambda row: build_cover_url(row["small_thumbnail"]),
+            "large_cover_url": lambda row: build_cover_url(row["large_thumbnail"]),
+        }
+
+    def to_representation(self, rows):
+        getters = self.getters
+        with request_metrics.timed("serialize"):
+            return [{name: get(row) for name, get in getters} for row in rows]
+
 
 class BookDetailSerializer(BookSerializer):
     google_data = serializers.SerializerMethodField(read_only=True)
@@ -56,37 +214,41 @@ class BookDetailSerializer(BookSerializer):
         return obj.get_google_data()
 
 
-class BookshelfSerializer(serializers.ModelSerializer):
+class BookshelfSerializer(TimedDataMixin, serializers.ModelSerializer):
     class Meta:
         model = Bookshelf
+        list_serializer_class = TimedListSerializer
         fields = "__all__"
         # Making user field read-only prevents validation errors during
         # POST/PUT operations since the user will be set by the ViewSet
         read_only_fields = ["user"]
 
 
-class CategorySerializer(serializers.ModelSerializer):
+class CategorySerializer(TimedDataMixin, serializers.ModelSerializer):
     class Meta:
         model = Category
+        list_serializer_class = TimedListSerializer
         fields = "__all__"
         # Making user field read-only prevents validation errors during
         # POST/PUT operations since the user will be set by the ViewSet
         read_only_fields = ["user"]
 
 
-class SeriesSerializer(serializers.ModelSerializer):
+class SeriesSerializer(TimedDataMixin, serializers.ModelSerializer):
     class Meta:
         model = Series
+        list_serializer_class = TimedListSerializer
         fields = "__all__"
         # Making user field read-only prevents validation errors during
         # POST/PUT operations since the user will be set by the ViewSet
         read_only_fields = ["user"]
 
 
-class UserSerializer(serializers.ModelSerializer):
+class UserSerializer(TimedDataMixin, serializers.ModelSerializer):
     password = serializers.CharField(write_only=True, required=False)
 
     class Meta:
         model = User
+        list_serializer_class = TimedListSerializer
         fields = ["id", "username", "email", "password"]
         extra_kwargs = {"password": {"write_only": True}}
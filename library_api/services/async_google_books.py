@@ -0,0 +1,183 @@
+"""
+Async Google Books client.
+
+Mirrors fetch_book_data / fetch_volume_info for async views, using a
+pooled keep-alive aiohttp.ClientSession so many lookups can be in flight
+on one event loop. Results share the same two-tier metadata cache and rate
+limiter as the sync client.
+"""
+
+import asyncio
+import logging
+import weakref
+
+import aiohttp
+from django.conf import settings
+
+from . import google_books, request_metrics
+from .circuit_breaker import CircuitOpenError
+from .isbn_store import isbn_store
+from .metadata_cache import metadata_cache, normalize_isbn
+
+DEFAULT_MAX_CONNECTIONS = 100
+
+logger = logging.getLogger(__name__)
+
+# A ClientSession's connections belong to the loop that opened them, so
+# keep one session per running event loop
+_sessions = weakref.WeakKeyDictionary()
+
+
+def get_session():
+    """Return the pooled ClientSession for the current event loop."""
+    loop = asyncio.get_running_loop()
+    session = _sessions.get(loop)
+    if session is None or session.closed:
+        max_connections = getattr(
+            settings, "GOOGLE_BOOKS_MAX_CONNECTIONS", DEFAULT_MAX_CONNECTIONS
+        )
+        session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=max_connections)
+        )
+        _sessions[loop] = session
+    return session
+
+
+async def close_session():
+    """
+    Close the current loop's session. Needed before any loop that ends
+    before the process does (scripts, asyncio.run, and async views served
+    under WSGI, see async_views.closes_session); under ASGI the session
+    lives as long as the process.
+    """
+    session = _sessions.pop(asyncio.get_running_loop(), None)
+    if session is not None:
+        await session.close()
+
+
+async def _get_json(url, params):
+    """
+    GET a Google Books URL and return the decoded JSON.
+
+    Retries, timeouts and the circuit breaker work as in the sync
+    client's google_books._get.
+
+    Raises:
+        aiohttp.ClientError: If the request failed
+        CircuitOpenError: If the breaker is open
+    """
+    config = google_books.get_client_settings()
+    timeout = aiohttp.ClientTimeout(
+        sock_connect=config["CONNECT_TIMEOUT"], sock_read=config["READ_TIMEOUT"]
+    )
+    breaker = google_books.breaker
+    retry_after = None
+    with request_metrics.timed("google"):
+        for attempt in range(config["RETRIES"] + 1):
+            if attempt:
+                await asyncio.sleep(
+                    google_books.backoff_delay(attempt - 1, config, retry_after)
+                )
+            breaker.before_call()
+            if google_books.rate_limiter is not None:
+                await google_books.rate_limiter.aacquire()
+            retry_after = None
+            try:
+                async with get_session().get(
+                    url, params=params, timeout=timeout
+                ) as response:
+                    if response.status in google_books.RETRY_STATUSES:
+                        retry_after = google_books.retry_after_header(response.headers)
+                        response.raise_for_status()
+                    breaker.record_success()
+                    if response.ok:
+                        return await response.json()
+                    failed = response
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                breaker.record_failure()
+                error = e
+                logger.warning(
+                    "Google Books request failed (attempt %d): %s", attempt + 1, e
+                )
+                continue
+            # Other error statuses: retrying won't help
+            failed.raise_for_status()
+        raise error
+
+
+async def afetch_book_data(isbn, api_url=None, api_key=None, use_cache=True):
+    """
+    Async version of google_books.fetch_book_data.
+
+    Concurrent calls on one event loop are coalesced like the sync
+    version's; the cross-process lock is not used here. The local ISBN
+    store is read on the event loop thread, since a lookup takes well
+    under a millisecond.
+
+    Returns:
+        dict: Detailed book information from Google Books API or empty dict if not found
+
+    Raises:
+        GoogleBooksUnavailable: If the lookup failed and nothing is cached
+    """
+    isbn = normalize_isbn(isbn)
+    if not isbn:
+        return {}
+
+    if use_cache:
+        stored = isbn_store.get(isbn)
+        if stored is not None:
+            return stored
+        cached = await metadata_cache.aget(isbn)
+        if cached is not None:
+            return cached
+
+    api_url, api_key = google_books.get_api_settings(api_url, api_key)
+
+    # Imported here because the providers module builds on this one
+    from .metadata_providers import chain
+
+    async def lookup():
+        data = await chain.afetch(isbn, api_url=api_url, api_key=api_key)
+        if use_cache:
+            await metadata_cache.aset(isbn, data)
+        return data
+
+    # Concurrent lookups of the same ISBN on this event loop share one fetch
+    try:
+        return await google_books.lookups.ado(
+            (isbn, api_url, api_key, use_cache), lookup
+        )
+    except (aiohttp.ClientError, asyncio.TimeoutError, CircuitOpenError) as e:
+        stale = await metadata_cache.aget_stale(isbn) if use_cache else None
+        if stale is not None:
+            return stale
+        raise google_books.GoogleBooksUnavailable(str(e)) from e
+
+
+async def afetch_volume_info(isbn, api_url=None, api_key=None):
+    """
+    Async version of google_books.fetch_volume_info (search, then volume
+    detail, or just the search with LAZY_DETAILS on).
+
+    Returns:
+        dict: Detailed book information from Google Books API or empty dict if not found
+
+    Raises:
+        aiohttp.ClientError: If either request fails
+        CircuitOpenError: If the circuit breaker is open
+    """
+    api_url, api_key = google_books.get_api_settings(api_url, api_key)
+    key_params = {"key": api_key} if api_key else {}
+
+    search_data = await _get_json(api_url, {"q": f"isbn:{isbn}", **key_params})
+
+    if not search_data.get("items"):
+        return {}
+    if google_books.get_client_settings()["LAZY_DETAILS"]:
+        return google_books.partial_volume_info(search_data["items"][0])
+    volume_id = search_data["items"][0]["id"]
+
+    detail_data = await _get_json(f"{api_url}/{volume_id}", key_params)
+
+    return detail_data.get("volumeInfo", {})
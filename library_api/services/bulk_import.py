@@ -0,0 +1,148 @@
+"""
+Bulk ISBN import service.
+
+Looks up metadata for a whole batch of ISBNs concurrently (see
+google_books.fetch_many) and inserts the resulting books with
+batched bulk_create calls.
+"""
+
+import csv
+import io
+import re
+
+from django.conf import settings
+from django.db import transaction
+
+from ..models import Book
+from .enrichment import enqueue
+from .google_books import book_fields_from_data, fetch_many
+from .library_version import bump_version
+from .metadata_cache import normalize_isbn
+from .metadata_snapshots import snapshot_fields
+
+DEFAULT_BATCH_SIZE = 500
+
+_ISBN_PATTERN = re.compile(r"^(\d{9}[\dX]|\d{13})$")
+_ISBN_SEPARATORS = re.compile(r"[\s,;]+")
+
+
+def is_valid_isbn(isbn):
+    """Return True if a normalized ISBN has the shape of an ISBN-10 or ISBN-13."""
+    return bool(_ISBN_PATTERN.match(isbn))
+
+
+def split_isbns(text):
+    """Split a comma, semicolon or whitespace separated string of ISBNs."""
+    return [isbn for isbn in _ISBN_SEPARATORS.split(text) if isbn]
+
+
+def parse_isbn_csv(text):
+    """
+    Read ISBNs from CSV text.
+
+    Uses the "isbn" column if the file has a header naming one, otherwise
+    the first column. Blank rows are skipped.
+    """
+    rows = [row for row in csv.reader(io.StringIO(text)) if row and row[0].strip()]
+    if not rows:
+        return []
+
+    header = [cell.strip().lower() for cell in rows[0]]
+    column = 0
+    if "isbn" in header:
+        column = header.index("isbn")
+        rows = rows[1:]
+
+    return [row[column].strip() for row in rows if len(row) > column]
+
+
+def import_isbns(user, bookshelf, isbns, skip_existing=True, max_workers=None):
+    """
+    Create books on a bookshelf for a list of ISBNs.
+
+    Args:
+        user (User): Owner of the new books
+        bookshelf (Bookshelf): Shelf the books are added to
+        isbns (list): Raw ISBN strings, in the order to report them
+        skip_existing (bool): Don't add ISBNs already in the user's library
+        max_workers (int, optional): Size of the metadata fetch pool
+
+    Returns:
+        dict: "created" count and a per-ISBN "results" list. Each result has
+        the ISBN and a status of "created", "invalid", "duplicate" or
+        "exists"; created entries also carry the book_id and whether
+        metadata was "found", "not_found" or hit an "error". Books whose
+        lookup failed are queued for enrichment so the worker retries them.
+    """
+    results = []
+    to_create = []
+    seen = set()
+    for raw in isbns:
+        isbn = normalize_isbn(raw)
+        if not is_valid_isbn(isbn):
+            results.append({"isbn": raw, "status": "invalid"})
+        elif isbn in seen:
+            results.append({"isbn": isbn, "status": "duplicate"})
+        else:
+            seen.add(isbn)
+            result = {"isbn": isbn, "status": "created"}
+            results.append(result)
+            to_create.append(result)
+
+    if skip_existing and to_create:
+        existing = set(
+            Book.objects.filter(
+                user=user, isbn__in=[result["isbn"] for result in to_create]
+            ).values_list("isbn", flat=True)
+        )
+        for result in to_create:
+            if result["isbn"] in existing:
+                result["status"] = "exists"
+        to_create = [result for result in to_create if result["status"] == "created"]
+
+    metadata = fetch_many(
+        [result["isbn"] for result in to_create], max_workers=max_workers
+    )
+
+    books = []
+    for result in to_create:
+        book_data = metadata.get(result["isbn"])
+        if book_data is None:
+            result["metadata"] = "error"
+        else:
+            result["metadata"] = "found" if book_data else "not_found"
+
+        book = Book(
+            isbn=result["isbn"],
+            bookshelf=bookshelf,
+            user=user,
+            **book_fields_from_data(book_data or {}),
+            # Stored like enrichment does, so opening the book's details
+            # doesn't fetch it again
+            **snapshot_fields(book_data),
+        )
+        if book_data is None:
+            book.enrichment_status = Book.EnrichmentStatus.PENDING
+        # bulk_create skips save(), so fill in the materialized sort key here
+        book.refresh_sort_key()
+        books.append(book)
+
+    batch_size = getattr(settings, "BULK_IMPORT_BATCH_SIZE", DEFAULT_BATCH_SIZE)
+    with transaction.atomic():
+        for start in range(0, len(books), batch_size):
+            Book.objects.bulk_create(books[start : start + batch_size])
+        enqueue(
+            [
+                book
+                for book in books
+                if book.enrichment_status == Book.EnrichmentStatus.PENDING
+            ]
+        )
+        # bulk_create doesn't send post_save
+        if books:
+            bump_version(user.id)
+
+    for result, book in zip(to_create, books):
+        result["book_id"] = book.id
+
+    return {"created": len(books), "results": results}
@@ -0,0 +1,108 @@
+"""
+Circuit breaker for calls to an upstream service.
+"""
+
+import threading
+from time import monotonic
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling the upstream while the breaker is open."""
+
+    def __init__(self, retry_after):
+        super().__init__(f"Circuit open; retry in {retry_after:.0f}s.")
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """
+    Thread-safe circuit breaker.
+
+    After `failure_threshold` consecutive failures the breaker opens, and
+    before_call() raises CircuitOpenError for `reset_timeout` seconds so
+    callers fail fast instead of tying up workers on a dead upstream. It
+    then lets a single trial call through ("half open"): success closes
+    the breaker, failure opens it for another `reset_timeout`. A trial
+    call that never reports back is given up on after `reset_timeout`.
+
+    Callers call before_call() before each attempt and then exactly one
+    of record_success() or record_failure().
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold, reset_timeout):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """Close the breaker and forget past failures."""
+        with self._lock:
+            self._state = self.CLOSED
+            self._failures = 0
+            self._opened_at = 0.0
+            self._trial_started_at = None
+            self.times_opened = 0
+            self.rejected = 0
+
+    @property
+    def state(self):
+        with self._lock:
+            if self._state == self.OPEN and self._retry_after() <= 0:
+                return self.HALF_OPEN
+            return self._state
+
+    def stats(self):
+        return {
+            "state": self.state,
+            "consecutive_failures": self._failures,
+            "times_opened": self.times_opened,
+            "rejected": self.rejected,
+        }
+
+    def _retry_after(self):
+        return self._opened_at + self.reset_timeout - monotonic()
+
+    def before_call(self):
+        """
+        Raise CircuitOpenError if a call isn't allowed right now.
+
+        Returns normally while the breaker is closed, and for the one trial
+        call once it has been open for reset_timeout.
+        """
+        with self._lock:
+            if self._state == self.CLOSED:
+                return
+            now = monotonic()
+            trial_running = (
+                self._trial_started_at is not None
+                and now - self._trial_started_at < self.reset_timeout
+            )
+            if self._retry_after() <= 0 and not trial_running:
+                self._state = self.HALF_OPEN
+                self._trial_started_at = now
+                return
+            self.rejected += 1
+            raise CircuitOpenError(max(self._retry_after(), 0.0))
+
+    def record_success(self):
+        with self._lock:
+            self._state = self.CLOSED
+            self._failures = 0
+            self._trial_started_at = None
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._state == self.HALF_OPEN or (
+                self._state == self.CLOSED
+                and self._failures >= self.failure_threshold
+            ):
+                self._state = self.OPEN
+                self._opened_at = monotonic()
+                self._trial_started_at = None
+                self.times_opened += 1
@@ -0,0 +1,252 @@
+"""
+Local cover image cache.
+
+Cover images are downloaded once and kept in a content-addressed store:
+each file is named after the SHA-256 of its bytes, so the same image is
+stored once however many books, users or URLs refer to it. CoverImage
+rows map source URLs to digests. The covers endpoint serves from the
+store, so rendering a shelf doesn't wait on Google's image servers.
+"""
+
+import hashlib
+import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from pathlib import Path
+from urllib.parse import urlencode, urljoin, urlsplit
+
+import requests
+from django.conf import settings
+from django.urls import reverse
+from django.utils import timezone
+
+from ..models import CoverImage
+from .single_flight import SingleFlight
+
+# Default configuration, overridable via settings.BOOK_COVERS
+DEFAULT_COVER_SETTINGS = {
+    "STORE_DIR": None,  # defaults to BASE_DIR / "covers"
+    # Hosts covers may be fetched from; the proxy won't fetch anything else
+    "ALLOWED_HOSTS": [
+        "books.google.com",
+        "books.googleusercontent.com",
+        "covers.openlibrary.org",  # covers of books from the local ISBN store
+    ],
+    "MAX_BYTES": 5 * 1024 * 1024,
+    "TIMEOUT": 10,  # seconds
+    "MAX_REDIRECTS": 3,
+    "NEGATIVE_TTL": 24 * 60 * 60,  # seconds before a missing cover is retried
+    "MAX_WORKERS": 8,  # concurrent downloads when pre-warming
+}
+
+# Stored images never change, so clients may cache them for a year
+CACHE_MAX_AGE = 365 * 24 * 60 * 60
+
+# Coalesces concurrent requests for the same uncached cover
+downloads = SingleFlight()
+session = requests.Session()
+
+
+class CoverError(Exception):
+    """Raised when a cover can't be downloaded."""
+
+
+def get_cover_settings():
+    """Return the cover configuration merged over the defaults."""
+    config = {**DEFAULT_COVER_SETTINGS, **getattr(settings, "BOOK_COVERS", {})}
+    if not config["STORE_DIR"]:
+        config["STORE_DIR"] = Path(settings.BASE_DIR) / "covers"
+    return config
+
+
+def is_allowed_url(url, config=None):
+    """Return True if url is an http(s) URL on one of the allowed hosts."""
+    config = config or get_cover_settings()
+    try:
+        parts = urlsplit(url or "")
+    except ValueError:
+        return False
+    return parts.scheme in ("http", "https") and parts.hostname in config["ALLOWED_HOSTS"]
+
+
+def cover_url(url):
+    """
+    Return the local covers endpoint URL for a source image URL, or None if
+    the source isn't one the endpoint will fetch.
+    """
+    return cover_url_builder()(url)
+
+
+def cover_url_builder():
+    """
+    Return a function equivalent to cover_url that looks up the settings
+    and the endpoint path once, for building many URLs.
+    """
+    config = get_cover_settings()
+    prefix = f"{reverse('book_cover')}?"
+
+    def build(url):
+        if not is_allowed_url(url, config):
+            return None
+        return prefix + urlencode({"url": url})
+
+    return build
+
+
+def store_path(digest, config=None):
+    """Path of the stored file for a digest (fanned out by its first two characters)."""
+    config = config or get_cover_settings()
+    return Path(config["STORE_DIR"]) / digest[:2] / digest
+
+
+def _get(url, config):
+    """
+    GET url, following redirects only to allowed hosts.
+
+    requests would follow a redirect anywhere, including to internal
+    addresses, so each hop is checked against ALLOWED_HOSTS first.
+    """
+    for _ in range(config["MAX_REDIRECTS"] + 1):
+        response = session.get(
+            url, stream=True, timeout=config["TIMEOUT"], allow_redirects=False
+        )
+        if not response.is_redirect:
+            return response
+        url = urljoin(url, response.headers["Location"])
+        response.close()
+        if not is_allowed_url(url, config):
+            raise CoverError("Redirected to a host that isn't allowed.")
+    raise CoverError("Too many redirects.")
+
+
+def download(url, config=None):
+    """
+    Download an image.
+
+    Returns:
+        tuple: (bytes, content type), or None if the source has no image
+
+    Raises:
+        CoverError: If the download fails or isn't an acceptable image
+    """
+    config = config or get_cover_settings()
+    try:
+        with _get(url, config) as response:
+            if response.status_code == 404:
+                return None
+            response.raise_for_status()
+            content_type = response.headers.get("Content-Type", "").split(";")[0]
+            if not content_type.startswith("image/"):
+                raise CoverError(f"Not an image ({content_type or 'no content type'}).")
+
+            content = bytearray()
+            for chunk in response.iter_content(64 * 1024):
+                content += chunk
+                if len(content) > config["MAX_BYTES"]:
+                    raise CoverError("Image is too large.")
+    except requests.RequestException as e:
+        raise CoverError(str(e)) from e
+    return bytes(content), content_type
+
+
+def store(content, config=None):
+    """Write image bytes to the store (if not already there) and return their digest."""
+    digest = hashlib.sha256(content).hexdigest()
+    path = store_path(digest, config)
+    if not path.exists():
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # Write to a temporary file and rename, so readers never see a
+        # partial image
+        fd, tmp_path = tempfile.mkstemp(dir=path.parent)
+        with os.fdopen(fd, "wb") as f:
+            f.write(content)
+        os.replace(tmp_path, path)
+    return digest
+
+
+def _is_fresh(cover, config):
+    if cover.found:
+        return store_path(cover.digest, config).exists()
+    expires_at = cover.fetched_at + timedelta(seconds=config["NEGATIVE_TTL"])
+    return expires_at > timezone.now()
+
+
+def _save(url, result, config):
+    """Record a download result (see download) and return the CoverImage."""
+    if result is None:
+        fields = {"digest": "", "content_type": "", "size": 0, "found": False}
+    else:
+        content, content_type = result
+        fields = {
+            "digest": store(content, config),
+            "content_type": content_type,
+            "size": len(content),
+            "found": True,
+        }
+    cover, _ = CoverImage.objects.update_or_create(
+        url=url, defaults={**fields, "fetched_at": timezone.now()}
+    )
+    return cover
+
+
+def get_cover(url):
+    """
+    Return the CoverImage for a source URL, downloading it if needed.
+
+    Concurrent calls for the same URL share one download. Check
+    cover.found before serving it.
+
+    Raises:
+        CoverError: If the image had to be downloaded and that failed
+    """
+    config = get_cover_settings()
+    cover = CoverImage.objects.filter(url=url).first()
+    if cover is not None and _is_fresh(cover, config):
+        return cover
+    return downloads.do(url, lambda: _save(url, download(url, config), config))
+
+
+def prewarm(urls, max_workers=None):
+    """
+    Download every cover in urls that isn't stored yet.
+
+    Downloads run on a pool of threads; the database is only touched from
+    the calling thread.
+
+    Returns:
+        dict: Counts of covers "stored", "missing" (no image upstream),
+        "failed" and "cached" (already stored)
+    """
+    config = get_cover_settings()
+    urls = [url for url in dict.fromkeys(urls) if is_allowed_url(url, config)]
+    known = {
+        cover.url: cover for cover in CoverImage.objects.filter(url__in=urls)
+    }
+    to_fetch = [
+        url for url in urls if url not in known or not _is_fresh(known[url], config)
+    ]
+    counts = {
+        "stored": 0,
+        "missing": 0,
+        "failed": 0,
+        "cached": len(urls) - len(to_fetch),
+    }
+    if not to_fetch:
+        return counts
+
+    def fetch(url):
+        try:
+            return download(url, config)
+        except CoverError as e:
+            return e
+
+    max_workers = max_workers or config["MAX_WORKERS"]
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(to_fetch))) as pool:
+        for url, result in zip(to_fetch, pool.map(fetch, to_fetch)):
+            if isinstance(result, CoverError):
+                counts["failed"] += 1
+                continue
+            _save(url, result, config)
+            counts["stored" if result else "missing"] += 1
+    return counts
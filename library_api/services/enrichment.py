@@ -0,0 +1,202 @@
+"""
+Background metadata enrichment.
+
+Books are saved straight away with enrichment_status "pending" and an
+EnrichmentJob row; a worker (manage.py process_enrichment_queue) claims
+due jobs, looks their ISBNs up with fetch_many and fills in the books.
+Lookups that fail are retried with exponential backoff until MAX_ATTEMPTS,
+after which the book is marked "failed".
+"""
+
+import random
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from ..models import Book, EnrichmentJob
+from .google_books import book_fields_from_data, fetch_many
+from .isbn_store import isbn_store
+from .library_version import bump_version
+from .metadata_cache import metadata_cache, normalize_isbn
+from .metadata_snapshots import SNAPSHOT_FIELDS, snapshot_fields
+
+# Default queue configuration, overridable via settings.BOOK_ENRICHMENT
+DEFAULT_ENRICHMENT_SETTINGS = {
+    "BATCH_SIZE": 20,  # jobs claimed per worker iteration
+    "MAX_ATTEMPTS": 5,
+    "BACKOFF": 30,  # seconds before the first retry, doubled for each later one
+    "MAX_BACKOFF": 60 * 60,
+    "LEASE": 5 * 60,  # seconds a claimed job is hidden from other workers
+}
+
+# Book fields written by enrichment (sort_key_text follows from author/title)
+ENRICHED_FIELDS = [
+    "title",
+    "subtitle",
+    "author",
+    "small_thumbnail",
+    "large_thumbnail",
+    "details",
+    "enrichment_status",
+    "sort_key_text",
+    *SNAPSHOT_FIELDS,
+]
+
+
+def get_enrichment_settings():
+    """Return the queue configuration merged over the defaults."""
+    return {**DEFAULT_ENRICHMENT_SETTINGS, **getattr(settings, "BOOK_ENRICHMENT", {})}
+
+
+def apply_book_data(book, book_data):
+    """Copy Google Books data onto a book and mark it enriched (does not save)."""
+    fields = {**book_fields_from_data(book_data), **snapshot_fields(book_data)}
+    for field, value in fields.items():
+        setattr(book, field, value)
+    book.enrichment_status = Book.EnrichmentStatus.DONE
+    book.refresh_sort_key()
+
+
+def initial_book_fields(isbn):
+    """
+    Return the enrichment fields to save a new book with.
+
+    If the ISBN is in the local ISBN store or the metadata cache the book
+    is filled in right away; otherwise it is saved as pending and needs a
+    job (see enqueue). Only local data is consulted, never the API.
+    """
+    isbn = normalize_isbn(isbn)
+    cached = None
+    if isbn:
+        cached = isbn_store.get(isbn)
+        if cached is None:
+            cached = metadata_cache.get(isbn)
+    if cached is None:
+        return {"enrichment_status": Book.EnrichmentStatus.PENDING}
+    return {
+        **book_fields_from_data(cached),
+        **snapshot_fields(cached),
+        "enrichment_status": Book.EnrichmentStatus.DONE,
+    }
+
+
+def enqueue(books):
+    """
+    Queue saved books for enrichment, resetting any earlier failed job.
+
+    Marks the books pending and makes their jobs due immediately.
+    """
+    book_ids = [book.id for book in books]
+    if not book_ids:
+        return
+    now = timezone.now()
+    with transaction.atomic():
+        Book.objects.filter(id__in=book_ids).update(
+            enrichment_status=Book.EnrichmentStatus.PENDING
+        )
+        EnrichmentJob.objects.filter(book_id__in=book_ids).delete()
+        EnrichmentJob.objects.bulk_create(
+            [EnrichmentJob(book_id=book_id, run_after=now) for book_id in book_ids]
+        )
+        bump_version(*(book.user_id for book in books))
+    for book in books:
+        book.enrichment_status = Book.EnrichmentStatus.PENDING
+
+
+def retry_delay(attempts, config=None):
+    """Seconds to wait before retrying a job that has failed `attempts` times."""
+    config = config or get_enrichment_settings()
+    delay = min(config["MAX_BACKOFF"], config["BACKOFF"] * 2 ** (attempts - 1))
+    # Jitter so jobs that failed together don't all retry together
+    return delay * random.uniform(0.5, 1.0)
+
+
+def claim_jobs(batch_size=None, config=None):
+    """
+    Claim up to batch_size due jobs for this worker.
+
+    Uses SELECT ... FOR UPDATE SKIP LOCKED, so several workers can drain
+    the queue at once without picking the same jobs. Claimed jobs have
+    their attempt counted and run_after moved forward by the lease.
+    """
+    config = config or get_enrichment_settings()
+    batch_size = batch_size or config["BATCH_SIZE"]
+    now = timezone.now()
+    with transaction.atomic():
+        jobs = list(
+            EnrichmentJob.objects.select_for_update(skip_locked=True)
+            .filter(status=EnrichmentJob.Status.PENDING, run_after__lte=now)
+            .order_by("run_after", "id")[:batch_size]
+        )
+        for job in jobs:
+            job.attempts += 1
+            job.run_after = now + timedelta(seconds=config["LEASE"])
+        EnrichmentJob.objects.bulk_update(jobs, ["attempts", "run_after"])
+    return jobs
+
+
+def process_jobs(jobs, max_workers=None, config=None):
+    """
+    Look up metadata for claimed jobs and update their books.
+
+    Returns:
+        dict: Counts of jobs that finished ("done"), were rescheduled
+        ("retried") or ran out of attempts ("failed").
+    """
+    config = config or get_enrichment_settings()
+    counts = {"done": 0, "retried": 0, "failed": 0}
+    if not jobs:
+        return counts
+
+    books = Book.objects.select_related("category", "series").in_bulk(
+        [job.book_id for job in jobs]
+    )
+    metadata = fetch_many(
+        [book.isbn for book in books.values()], max_workers=max_workers
+    )
+
+    to_update = []
+    finished = []
+    now = timezone.now()
+    for job in jobs:
+        book = books.get(job.book_id)
+        if book is None:
+            # Deleted since the job was claimed; the job went with it
+            continue
+
+        book_data = metadata.get(normalize_isbn(book.isbn), {})
+        if book_data is not None:
+            apply_book_data(book, book_data)
+            to_update.append(book)
+            finished.append(job.id)
+            counts["done"] += 1
+            continue
+
+        job.last_error = "Google Books lookup failed"
+        if job.attempts >= config["MAX_ATTEMPTS"]:
+            job.status = EnrichmentJob.Status.FAILED
+            book.enrichment_status = Book.EnrichmentStatus.FAILED
+            to_update.append(book)
+            counts["failed"] += 1
+        else:
+            job.run_after = now + timedelta(seconds=retry_delay(job.attempts, config))
+            counts["retried"] += 1
+
+    with transaction.atomic():
+        Book.objects.bulk_update(to_update, ENRICHED_FIELDS)
+        bump_version(*(book.user_id for book in to_update))
+        EnrichmentJob.objects.filter(id__in=finished).delete()
+        EnrichmentJob.objects.bulk_update(
+            [job for job in jobs if job.id not in finished and job.book_id in books],
+            ["status", "run_after", "last_error"],
+        )
+    return counts
+
+
+def run_once(batch_size=None, max_workers=None):
+    """Claim and process one batch of jobs. Returns the counts, plus "claimed"."""
+    config = get_enrichment_settings()
+    jobs = claim_jobs(batch_size, config)
+    return {"claimed": len(jobs), **process_jobs(jobs, max_workers, config)}
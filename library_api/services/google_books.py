@@ -3,20 +3,531 @@ Google Books API service module.
 Provides functionality to fetch book data from Google Books API.
 """
 
+import logging
+import random
 import requests
 import os
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from time import sleep
+
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+
+from .metadata_cache import metadata_cache, normalize_isbn
+from . import request_metrics
+from .circuit_breaker import CircuitBreaker, CircuitOpenError
+from .isbn_store import isbn13_key, isbn_store
+from .rate_limit import TokenBucket
+from .single_flight import SingleFlight, advisory_lock
 
 # Default API configuration
 DEFAULT_API_URL = "https://www.googleapis.com/books/v1/volumes"
 DEFAULT_API_KEY = os.environ.get("GOOGLE_BOOKS_API_KEY", "")
+DEFAULT_MAX_WORKERS = 8
+# Timeouts, retries and circuit breaker, overridable via settings.GOOGLE_BOOKS_CLIENT
+DEFAULT_CLIENT_SETTINGS = {
+    "CONNECT_TIMEOUT": 3.05,  # seconds
+    "READ_TIMEOUT": 10,  # seconds
+    "RETRIES": 2,  # extra attempts after a transient failure
+    "BACKOFF": 0.25,  # seconds; the cap on the first retry's delay, doubled each time
+    "MAX_BACKOFF": 4,
+    "FAILURE_THRESHOLD": 5,  # consecutive failed attempts that open the breaker
+    "RESET_TIMEOUT": 30,  # seconds the breaker stays open
+    "BATCH_SIZE": 20,  # ISBNs combined into one search by fetch_volume_infos
+    # Answer lookups from the search results alone, one request instead of
+    # two; details only the volume has are fetched when first needed
+    "LAZY_DETAILS": False,
+}
+# Most results Google Books returns for one search request
+MAX_RESULTS = 40
+# Statuses worth retrying: rate limited, or the upstream is struggling
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+# Search-only results (see LAZY_DETAILS) carry the volume ID under this key,
+# and the PARTIAL_KEY flag until they're replaced by the volume's details
+VOLUME_ID_KEY = "volumeId"
+PARTIAL_KEY = "partial"
 
+logger = logging.getLogger(__name__)
 
-def fetch_book_data(isbn, api_url=None, api_key=None):
+
+class GoogleBooksUnavailable(Exception):
+    """
+    Raised when a lookup failed (after retries, or because the circuit
+    breaker is open) and there is no cached copy, stale or not, to serve.
+    """
+
+
+def get_client_settings():
+    """Return the client configuration merged over the defaults."""
+    return {**DEFAULT_CLIENT_SETTINGS, **getattr(settings, "GOOGLE_BOOKS_CLIENT", {})}
+
+
+def _build_rate_limiter():
+    config = getattr(settings, "GOOGLE_BOOKS_RATE_LIMIT", None)
+    if not config:
+        return None
+    return TokenBucket(config["RATE"], config.get("BURST"))
+
+
+def _build_session():
+    # Keep-alive connections are reused across calls instead of paying for a
+    # new TCP/TLS handshake on every request
+    pool_size = getattr(settings, "GOOGLE_BOOKS_MAX_WORKERS", DEFAULT_MAX_WORKERS)
+    session = requests.Session()
+    session.mount("https://", HTTPAdapter(pool_maxsize=pool_size))
+    session.mount("http://", HTTPAdapter(pool_maxsize=pool_size))
+    return session
+
+
+def _build_breaker():
+    config = get_client_settings()
+    return CircuitBreaker(config["FAILURE_THRESHOLD"], config["RESET_TIMEOUT"])
+
+
+# Shared by every thread in the process so the limit applies to the total
+# number of upstream requests, not per caller
+rate_limiter = _build_rate_limiter()
+session = _build_session()
+# Shared by the sync and async clients, so a dead upstream fails fast for both
+breaker = _build_breaker()
+# Coalesces concurrent lookups of the same ISBN (see fetch_book_data)
+lookups = SingleFlight()
+
+
+def get_api_settings(api_url=None, api_key=None):
+    """Resolve the API URL and key: explicit values, then settings, then defaults."""
+    return (
+        api_url or getattr(settings, "GOOGLE_BOOKS_API_URL", DEFAULT_API_URL),
+        api_key or getattr(settings, "GOOGLE_BOOKS_API_KEY", DEFAULT_API_KEY),
+    )
+
+
+def fetch_book_data(isbn, api_url=None, api_key=None, use_cache=True, full=False):
+    """
+    Fetch book data for an ISBN, going through the local ISBN store and
+    the metadata cache.
+
+    ISBNs in the local store (see services.isbn_store) are answered from
+    it without touching the network. Other results (including "not found")
+    are served from the in-process or database cache when available;
+    otherwise they are fetched from the metadata providers (Google Books,
+    unless BOOK_METADATA_PROVIDERS configures others) and cached. Request
+    errors are not cached: if the lookup fails, an expired cached result
+    is returned if there is one. Concurrent calls for the same ISBN share
+    a single API lookup.
+
+    With LAZY_DETAILS on, lookups return the search result's volumeInfo
+    (see is_partial); pass full=True where the volume's own details, such
+    as the untruncated description and large cover images, are needed.
+    A partial result is then upgraded, and the cache updated, with one
+    more request.
+
+    Args:
+        isbn (str): The ISBN of the book to search for
+        api_url (str, optional): Google Books API URL. Defaults to environment variable or hardcoded value.
+        api_key (str, optional): Google Books API key. Defaults to environment variable or empty string.
+        use_cache (bool, optional): Set to False to bypass the store and cache.
+        full (bool, optional): Return the volume's details, never a partial result.
+
+    Returns:
+        dict: Detailed book information from Google Books API or empty dict if not found
+
+    Raises:
+        GoogleBooksUnavailable: If the lookup failed and nothing is cached
+    """
+    isbn = normalize_isbn(isbn)
+    if not isbn:
+        return {}
+
+    if use_cache:
+        stored = isbn_store.get(isbn)
+        if stored is not None:
+            return stored
+        cached = metadata_cache.get(isbn)
+        if cached is not None:
+            if full and is_partial(cached):
+                return upgrade_details(isbn, cached, api_url, api_key, use_cache)
+            return cached
+
+    api_url, api_key = get_api_settings(api_url, api_key)
+    try:
+        data = lookups.do(
+            (isbn, api_url, api_key, use_cache),
+            lambda: _lookup(isbn, api_url, api_key, use_cache),
+        )
+    except (requests.RequestException, CircuitOpenError) as e:
+        stale = metadata_cache.get_stale(isbn) if use_cache else None
+        if stale is not None:
+            return stale
+        raise GoogleBooksUnavailable(str(e)) from e
+    if full and is_partial(data):
+        return upgrade_details(isbn, data, api_url, api_key, use_cache)
+    return data
+
+
+def is_partial(data):
+    """True for a search-only result that lacks the volume's own details."""
+    return bool(data) and data.get(PARTIAL_KEY, False)
+
+
+def upgrade_details(isbn, data, api_url=None, api_key=None, use_cache=True):
+    """
+    Replace a partial result with the volume's details, and cache them.
+
+    Concurrent upgrades of one ISBN share a request. If the details can't
+    be fetched, the partial result is returned as it is.
+    """
+    api_url, api_key = get_api_settings(api_url, api_key)
+
+    def upgrade():
+        try:
+            detail = fetch_volume_detail(data[VOLUME_ID_KEY], api_url, api_key)
+        except (requests.RequestException, CircuitOpenError):
+            return data
+        if not detail:
+            return data
+        if use_cache:
+            metadata_cache.set(isbn, detail)
+        return detail
+
+    return lookups.do(("details", isbn, api_url, api_key, use_cache), upgrade)
+
+
+def _lookup(isbn, api_url, api_key, use_cache):
+    """
+    Fetch and cache one ISBN; the body of a coalesced fetch_book_data call.
+
+    With GOOGLE_BOOKS_CROSS_PROCESS_LOCK enabled, the fetch also holds a
+    database advisory lock for the ISBN, so other processes wait for it
+    and then read the result from the shared cache instead of fetching.
+    """
+    if not use_cache:
+        return fetch_from_providers(isbn, api_url, api_key)
+
+    cross_process = getattr(settings, "GOOGLE_BOOKS_CROSS_PROCESS_LOCK", False)
+    with advisory_lock(f"isbn:{isbn}") if cross_process else nullcontext():
+        # Another caller may have finished the same lookup since we missed
+        cached = metadata_cache.get(isbn)
+        if cached is not None:
+            return cached
+        data = fetch_from_providers(isbn, api_url, api_key)
+        metadata_cache.set(isbn, data)
+    return data
+
+
+def fetch_many(isbns, max_workers=None, api_url=None, api_key=None):
+    """
+    Fetch book data for many ISBNs, in as few upstream requests as possible.
+
+    Results from the local ISBN store or the cache are served directly;
+    misses are looked up together (see fetch_many_from_providers), with
+    Google Books searching for many ISBNs per request and fetching volume
+    details concurrently (still subject to the shared rate limit). Failed
+    lookups fall back to expired cached results. Cache reads and writes
+    stay in the calling thread, so the workers never touch the database.
+
+    Args:
+        isbns (iterable): ISBNs to look up. They are normalized and de-duplicated.
+        max_workers (int, optional): Size of the worker pool.
+        api_url (str, optional): Google Books API URL.
+        api_key (str, optional): Google Books API key.
+
+    Returns:
+        dict: Maps each normalized ISBN to its book data, an empty dict if
+        not found, or None if the lookup failed and nothing is cached.
+    """
+    results = {}
+    to_fetch = []
+    for isbn in dict.fromkeys(normalize_isbn(isbn) for isbn in isbns):
+        if not isbn:
+            continue
+        cached = isbn_store.get(isbn)
+        if cached is None:
+            cached = metadata_cache.get(isbn)
+        if cached is not None:
+            results[isbn] = cached
+        else:
+            to_fetch.append(isbn)
+
+    if not to_fetch:
+        return results
+
+    fetched = fetch_many_from_providers(to_fetch, max_workers, api_url, api_key)
+    for isbn in to_fetch:
+        data = fetched.get(isbn)
+        if data is not None:
+            metadata_cache.set(isbn, data)
+        else:
+            data = metadata_cache.get_stale(isbn)
+        results[isbn] = data
+
+    return results
+
+
+def fetch_volume_infos(isbns, api_url=None, api_key=None, max_workers=None):
+    """
+    Batched fetch_volume_info: look many ISBNs up with few requests.
+
+    ISBNs are combined into searches for up to BATCH_SIZE of them each
+    ("isbn:A OR isbn:B ..."), which run concurrently; then the details of
+    every volume found are fetched concurrently. A batch therefore takes
+    about as long as a single lookup. ISBNs whose search results were cut
+    short are looked up one by one, alongside the details. With
+    LAZY_DETAILS on, the search results are returned as partial results
+    instead of fetching details.
+
+    Returns:
+        dict: Maps each ISBN to its volumeInfo, or an empty dict if not
+        found. ISBNs whose lookup failed are left out.
+    """
+    api_url, api_key = get_api_settings(api_url, api_key)
+    key_params = {"key": api_key} if api_key else {}
+    batch_size = get_client_settings()["BATCH_SIZE"]
+    batches = [isbns[i : i + batch_size] for i in range(0, len(isbns), batch_size)]
+    max_workers = max_workers or getattr(
+        settings, "GOOGLE_BOOKS_MAX_WORKERS", DEFAULT_MAX_WORKERS
+    )
+
+    def search(batch):
+        params = {
+            "q": " OR ".join(f"isbn:{isbn}" for isbn in batch),
+            "maxResults": MAX_RESULTS,
+            **key_params,
+        }
+        try:
+            return _get(api_url, params).json()
+        except (requests.RequestException, CircuitOpenError):
+            return None
+
+    def detail(volume_id):
+        try:
+            data = _get(f"{api_url}/{volume_id}", key_params).json()
+        except (requests.RequestException, CircuitOpenError):
+            return None
+        return data.get("volumeInfo", {})
+
+    def lookup(isbn):
+        try:
+            return fetch_volume_info(isbn, api_url, api_key)
+        except (requests.RequestException, CircuitOpenError):
+            return None
+
+    lazy = get_client_settings()["LAZY_DETAILS"]
+    results = {}
+    volume_ids = {}
+    items_by_id = {}
+    unmatched = []
+    # Worker threads don't see the request's timings, so time the whole batch
+    with request_metrics.timed("google"):
+        if not batches:
+            return results
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(batches))) as pool:
+            searches = list(pool.map(search, batches))
+
+        for batch, data in zip(batches, searches):
+            if data is None:
+                continue
+            items = data.get("items", [])
+            items_by_id.update((item["id"], item) for item in items)
+            if len(batch) == 1:
+                # Same as fetch_volume_info: the first result is the book
+                if items:
+                    volume_ids[batch[0]] = items[0]["id"]
+                else:
+                    results[batch[0]] = {}
+                continue
+            matches = {}
+            for item in items:
+                for identifier in item.get("volumeInfo", {}).get(
+                    "industryIdentifiers", []
+                ):
+                    key = isbn13_key(identifier.get("identifier"))
+                    if key is not None:
+                        matches.setdefault(key, item["id"])
+            complete = data.get("totalItems", 0) <= len(items)
+            for isbn in batch:
+                volume_id = matches.get(isbn13_key(isbn))
+                if volume_id is not None:
+                    volume_ids[isbn] = volume_id
+                elif complete:
+                    results[isbn] = {}
+                else:
+                    unmatched.append(isbn)
+
+        if lazy:
+            for isbn, volume_id in volume_ids.items():
+                results[isbn] = partial_volume_info(items_by_id[volume_id])
+            volume_ids = {}
+
+        # Two ISBNs (an ISBN-10 and its ISBN-13, say) can find one volume
+        unique_ids = list(dict.fromkeys(volume_ids.values()))
+        if not unique_ids and not unmatched:
+            return results
+        workers = min(max_workers, len(unique_ids) + len(unmatched))
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            # map() submits everything up front, so both sets run together
+            detail_results = pool.map(detail, unique_ids)
+            single_results = pool.map(lookup, unmatched)
+            details = dict(zip(unique_ids, detail_results))
+            singles = dict(zip(unmatched, single_results))
+
+    for isbn, volume_id in volume_ids.items():
+        if details[volume_id] is not None:
+            results[isbn] = details[volume_id]
+    for isbn, data in singles.items():
+        if data is not None:
+            results[isbn] = data
+    return results
+
+
+def fetch_from_providers(isbn, api_url=None, api_key=None):
+    """
+    Look an ISBN up with the metadata provider chain (see
+    services.metadata_providers), bypassing the store and cache.
+
+    Raises:
+        requests.RequestException: If every provider failed
+        CircuitOpenError: If every provider failed and the last one's
+            breaker is open
+    """
+    # Imported here because the providers module builds on this one
+    from .metadata_providers import chain
+
+    return chain.fetch(isbn, api_url=api_url, api_key=api_key)
+
+
+def fetch_many_from_providers(isbns, max_workers=None, api_url=None, api_key=None):
+    """
+    Look many ISBNs up with the metadata provider chain, bypassing the
+    store and cache.
+
+    Returns:
+        dict: Maps ISBNs to their volumeInfo, or an empty dict if not
+        found. ISBNs that no provider found and any provider failed on are
+        left out.
+    """
+    from .metadata_providers import chain
+
+    return chain.fetch_many(
+        isbns, max_workers=max_workers, api_url=api_url, api_key=api_key
+    )
+
+
+def book_fields_from_data(book_data):
+    """
+    Map Google Books volumeInfo onto Book model fields.
+
+    Args:
+        book_data (dict): volumeInfo as returned by fetch_book_data (may be empty)
+
+    Returns:
+        dict: title, subtitle, author, small_thumbnail, large_thumbnail and details
+    """
+    # Extract title, subtitle and author
+    title = book_data.get("title", "Unknown Title")
+    subtitle = book_data.get("subtitle", "")
+
+    # Get primary author if available
+    authors = book_data.get("authors", ["Unknown Author"])
+    original_author = authors[0] if authors else "Unknown Author"
+
+    # Convert author name to "LastName, FirstName" format for better sorting
+    # This handles simple cases like "Stephen King" -> "King, Stephen"
+    name_parts = original_author.split()
+    if len(name_parts) > 1:
+        last_name = name_parts[-1]
+        first_names = " ".join(name_parts[:-1])
+        author = f"{last_name}, {first_names}"
+    else:
+        author = original_author  # Single name or already formatted
+
+    # Get thumbnail images
+    image_links = book_data.get("imageLinks", {})
+
+    return {
+        "title": title,
+        "subtitle": subtitle,
+        "author": author,
+        "small_thumbnail": image_links.get("smallThumbnail", None),
+        "large_thumbnail": image_links.get("thumbnail", None),
+        "details": book_data.get("description", None),
+    }
+
+
+def backoff_delay(attempt, config, retry_after=None):
+    """
+    Seconds to wait before retry number `attempt` (from 0).
+
+    "Full jitter": a random delay up to an exponentially growing cap, so
+    callers that failed together don't retry together. A Retry-After from
+    the server is honoured up to MAX_BACKOFF.
+    """
+    if retry_after is not None:
+        return min(retry_after, config["MAX_BACKOFF"])
+    cap = min(config["MAX_BACKOFF"], config["BACKOFF"] * 2**attempt)
+    return random.uniform(0, cap)
+
+
+def retry_after_header(headers):
+    """Seconds from a Retry-After header, or None (HTTP dates aren't supported)."""
+    try:
+        return float(headers.get("Retry-After"))
+    except (TypeError, ValueError):
+        return None
+
+
+def _get(url, params):
+    """
+    GET a Google Books URL.
+
+    Each attempt waits for the shared rate limiter and goes through the
+    circuit breaker. Connection errors, timeouts and RETRY_STATUSES are
+    retried with backoff; other error statuses are raised at once, since
+    retrying won't change them.
+
+    Raises:
+        requests.RequestException: If the request failed
+        CircuitOpenError: If the breaker is open
+    """
+    config = get_client_settings()
+    timeout = (config["CONNECT_TIMEOUT"], config["READ_TIMEOUT"])
+    retry_after = None
+    with request_metrics.timed("google"):
+        for attempt in range(config["RETRIES"] + 1):
+            if attempt:
+                sleep(backoff_delay(attempt - 1, config, retry_after))
+            breaker.before_call()
+            if rate_limiter is not None:
+                rate_limiter.acquire()
+            retry_after = None
+            try:
+                response = session.get(url, params=params, timeout=timeout)
+                if response.status_code in RETRY_STATUSES:
+                    retry_after = retry_after_header(response.headers)
+                    response.raise_for_status()
+            except requests.RequestException as e:
+                breaker.record_failure()
+                error = e
+                logger.warning(
+                    "Google Books request failed (attempt %d): %s", attempt + 1, e
+                )
+                continue
+            breaker.record_success()
+            response.raise_for_status()
+            return response
+        raise error
+
+
+def fetch_volume_info(isbn, api_url=None, api_key=None, full=False):
     """
     Fetch book data from Google Books API using a two-step process.
 
     First performs an ISBN search to get the volume ID, then makes a
-    second request to get detailed information about the book.
+    second request to get detailed information about the book. With
+    LAZY_DETAILS on (and full not set), the second request is skipped and
+    the search result's partial volumeInfo returned instead.
 
     Args:
         isbn (str): The ISBN of the book to search for
@@ -25,10 +536,13 @@ def fetch_book_data(isbn, api_url=None, api_key=None):
 
     Returns:
         dict: Detailed book information from Google Books API or empty dict if not found
+
+    Raises:
+        requests.RequestException: If either request fails
+        CircuitOpenError: If the circuit breaker is open
     """
-    # Use provided values or defaults
-    api_url = api_url or DEFAULT_API_URL
-    api_key = api_key or DEFAULT_API_KEY
+    # Use provided values, then settings, then defaults
+    api_url, api_key = get_api_settings(api_url, api_key)
 
     # Step 1: Search by ISBN to get the volume ID
     search_params = {
@@ -39,23 +553,41 @@ def fetch_book_data(isbn, api_url=None, api_key=None):
     if api_key:
         search_params["key"] = api_key
 
-    try:
-        search_response = requests.get(api_url, params=search_params)
-        search_response.raise_for_status()
-        search_data = search_response.json()
-
-    except requests.RequestException as e:
-        print(f"Error during ISBN search: {e}")
-        return {}
+    search_data = _get(api_url, search_params).json()
 
     # Check if any items were found
     if "items" not in search_data or len(search_data["items"]) == 0:
         return {}
 
+    # In lazy mode, the search result is the answer
+    if get_client_settings()["LAZY_DETAILS"] and not full:
+        return partial_volume_info(search_data["items"][0])
+
     # Get the volume ID from the first result
     volume_id = search_data["items"][0]["id"]
 
     # Step 2: Get detailed information using the volume ID
+    return fetch_volume_detail(volume_id, api_url, api_key)
+
+
+def partial_volume_info(item):
+    """A search result's volumeInfo, marked partial and with its volume ID."""
+    return {
+        **item.get("volumeInfo", {}),
+        VOLUME_ID_KEY: item["id"],
+        PARTIAL_KEY: True,
+    }
+
+
+def fetch_volume_detail(volume_id, api_url=None, api_key=None):
+    """
+    Fetch a volume's volumeInfo by its Google Books ID.
+
+    Raises:
+        requests.RequestException: If the request fails
+        CircuitOpenError: If the circuit breaker is open
+    """
+    api_url, api_key = get_api_settings(api_url, api_key)
     detail_url = f"{api_url}/{volume_id}"
     detail_params = {}
 
@@ -63,14 +595,7 @@ def fetch_book_data(isbn, api_url=None, api_key=None):
     if api_key:
         detail_params["key"] = api_key
 
-    try:
-        detail_response = requests.get(detail_url, params=detail_params)
-        detail_response.raise_for_status()
-        detail_data = detail_response.json()
-
-    except requests.RequestException as e:
-        print(f"Error fetching detailed volume info: {e}")
-        return {}
+    detail_data = _get(detail_url, detail_params).json()
 
     # Return the volumeInfo section which contains all the book details
     return detail_data.get("volumeInfo", {})
@@ -0,0 +1,367 @@
+"""
+Local ISBN store built from bulk bibliographic dumps.
+
+build() streams Open Library-style records into a SQLite file keyed by
+ISBN-13 (as an integer), so a lookup is one primary key probe and never
+touches the network. Each edition is stored once, as JSON already shaped
+like Google Books' volumeInfo (zlib-compressed if it's large); ISBN-10s
+are stored under their ISBN-13. Editions name their authors by Open
+Library key, and author records (from the same dump or a separate one) are kept in their
+own table and resolved when an edition is read.
+
+The store is a single file that is rebuilt next to the live one and
+swapped in when complete, so lookups keep working during an import.
+"""
+
+import gzip
+import json
+import logging
+import os
+import sqlite3
+import threading
+import zlib
+from itertools import islice
+from pathlib import Path
+
+from django.conf import settings
+
+from .metadata_cache import normalize_isbn
+
+# Default configuration, overridable via settings.BOOK_ISBN_STORE
+DEFAULT_STORE_SETTINGS = {
+    "PATH": None,  # SQLite file; no store is consulted while unset
+    # Answer "not found" for ISBNs missing from the store instead of asking
+    # Google Books, for machines without network access
+    "OFFLINE_ONLY": False,
+    "BATCH_SIZE": 10000,  # records per transaction while importing
+    "CACHE_KIB": 64 * 1024,  # SQLite page cache while importing
+}
+# Records are stored as plain JSON up to this many bytes and compressed
+# above it, where compression starts to pay for its cost
+COMPRESS_OVER = 256
+# Subjects kept per edition (as volumeInfo "categories")
+MAX_CATEGORIES = 5
+COVER_URL = "https://covers.openlibrary.org/b/id/{}-{}.jpg"
+AUTHOR_KEY_PREFIX = "/authors/"
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS editions (isbn INTEGER PRIMARY KEY, data BLOB NOT NULL);
+CREATE TABLE IF NOT EXISTS authors (key TEXT PRIMARY KEY, name TEXT NOT NULL)
+    WITHOUT ROWID;
+"""
+
+
+def get_store_settings():
+    """Return the store configuration merged over the defaults."""
+    return {**DEFAULT_STORE_SETTINGS, **getattr(settings, "BOOK_ISBN_STORE", {})}
+
+
+def isbn13_key(isbn):
+    """
+    The store key for an ISBN: its ISBN-13 as an int, or None if invalid.
+
+    ISBN-10s are converted to the equivalent 978- ISBN-13.
+    """
+    isbn = normalize_isbn(isbn)
+    if len(isbn) == 10 and isbn[:9].isdigit():
+        isbn = "978" + isbn[:9]
+        weighted = sum(int(d) * (3 if i % 2 else 1) for i, d in enumerate(isbn))
+        isbn += str(-weighted % 10)
+    if len(isbn) == 13 and isbn.isdigit():
+        return int(isbn)
+    return None
+
+
+def _text(value):
+    # Open Library wraps some text fields as {"type": "/type/text", "value": ...}
+    if isinstance(value, dict):
+        value = value.get("value")
+    return value if isinstance(value, str) and value else None
+
+
+def _author(entry):
+    """An author's name, their Open Library key, or None."""
+    if isinstance(entry, str):
+        return entry or None
+    if not isinstance(entry, dict):
+        return None
+    if isinstance(entry.get("author"), dict):  # works list {"author": {"key": ...}}
+        entry = entry["author"]
+    return _text(entry.get("name")) or _text(entry.get("key"))
+
+
+def volume_info(record):
+    """
+    Map an Open Library edition record onto Google Books volumeInfo fields.
+
+    Authors given by key are left as "/authors/..." keys for lookup() to
+    resolve.
+    """
+    info = {}
+    for source, target in [
+        ("title", "title"),
+        ("subtitle", "subtitle"),
+        ("publish_date", "publishedDate"),
+        ("description", "description"),
+    ]:
+        value = _text(record.get(source))
+        if value:
+            info[target] = value
+
+    authors = [name for name in map(_author, record.get("authors") or []) if name]
+    if authors:
+        info["authors"] = authors
+    publishers = [p for p in record.get("publishers") or [] if isinstance(p, str)]
+    if publishers:
+        info["publisher"] = publishers[0]
+    if isinstance(record.get("number_of_pages"), int):
+        info["pageCount"] = record["number_of_pages"]
+    subjects = [s for s in record.get("subjects") or [] if isinstance(s, str)]
+    if subjects:
+        info["categories"] = subjects[:MAX_CATEGORIES]
+
+    covers = [c for c in record.get("covers") or [] if isinstance(c, int) and c > 0]
+    if covers:
+        info["imageLinks"] = {
+            "smallThumbnail": COVER_URL.format(covers[0], "S"),
+            "thumbnail": COVER_URL.format(covers[0], "M"),
+        }
+
+    identifiers = []
+    for field, kind in [("isbn_13", "ISBN_13"), ("isbn_10", "ISBN_10")]:
+        for isbn in record.get(field) or []:
+            isbn = normalize_isbn(isbn)
+            if isbn:
+                identifiers.append({"type": kind, "identifier": isbn})
+    if identifiers:
+        info["industryIdentifiers"] = identifiers
+    return info
+
+
+def parse_records(lines):
+    """
+    Parse dump lines into ("edition", keys, volumeInfo) and
+    ("author", key, name) tuples.
+
+    Accepts JSON lines and Open Library's tab-separated dumps, whose last
+    column is the JSON record. Lines that can't be parsed, and records that
+    are neither authors nor editions with an ISBN, yield None so callers
+    can count them.
+    """
+    for line in lines:
+        if isinstance(line, bytes):
+            line = line.decode("utf-8", "replace")
+        line = line.strip()
+        if not line:
+            continue
+        if not line.startswith("{"):
+            line = line.rpartition("\t")[2]
+        try:
+            record = json.loads(line)
+        except ValueError:
+            yield None
+            continue
+        if not isinstance(record, dict):
+            yield None
+            continue
+
+        key = _text(record.get("key")) or ""
+        record_type = record.get("type")
+        if isinstance(record_type, dict):
+            record_type = record_type.get("key")
+        if record_type == "/type/author" or key.startswith(AUTHOR_KEY_PREFIX):
+            name = _text(record.get("name"))
+            yield ("author", key, name) if key and name else None
+            continue
+
+        isbns = [*(record.get("isbn_13") or []), *(record.get("isbn_10") or [])]
+        keys = list(dict.fromkeys(filter(None, map(isbn13_key, isbns))))
+        yield ("edition", keys, volume_info(record)) if keys else None
+
+
+def encode(info):
+    data = json.dumps(info, separators=(",", ":")).encode()
+    return zlib.compress(data) if len(data) > COMPRESS_OVER else data
+
+
+def decode(data):
+    # Plain JSON starts with "{"; zlib streams never do
+    return json.loads(data if data[:1] == b"{" else zlib.decompress(data))
+
+
+def open_dump(path):
+    """Open a dump file for reading as binary lines, gunzipping *.gz files."""
+    if str(path).endswith(".gz"):
+        return gzip.open(path, "rb")
+    return open(path, "rb")
+
+
+def build(lines, path=None, batch_size=None, append=False):
+    """
+    Import dump lines into the store.
+
+    Records are written in batches, so memory use doesn't grow with the
+    size of the dump. Unless `append` is set, a new store is built next to
+    `path` and replaces it once the import is complete. When several
+    editions share an ISBN, the first one wins.
+
+    Args:
+        lines (iterable): Lines of one or more dumps (str or bytes)
+        path (str, optional): Store file. Defaults to BOOK_ISBN_STORE["PATH"].
+        batch_size (int, optional): Records per transaction
+        append (bool): Add to the existing store instead of replacing it
+
+    Returns:
+        dict: Counts of editions, ISBNs and authors imported, and of
+        skipped lines
+    """
+    config = get_store_settings()
+    target = Path(path or config["PATH"])
+    batch_size = batch_size or config["BATCH_SIZE"]
+    work = target if append else target.with_name(target.name + ".tmp")
+    if not append:
+        work.unlink(missing_ok=True)
+
+    report = {"editions": 0, "isbns": 0, "authors": 0, "skipped": 0}
+    connection = sqlite3.connect(work, isolation_level=None)
+    try:
+        if not append:
+            # The file isn't live until it's renamed, so a crash only
+            # loses the partial build
+            connection.execute("PRAGMA journal_mode=OFF")
+            connection.execute("PRAGMA synchronous=OFF")
+        connection.execute(f"PRAGMA cache_size=-{int(config['CACHE_KIB'])}")
+        connection.executescript(SCHEMA)
+
+        records = parse_records(lines)
+        while batch := list(islice(records, batch_size)):
+            editions = []
+            authors = []
+            for record in batch:
+                if record is None:
+                    report["skipped"] += 1
+                elif record[0] == "author":
+                    authors.append(record[1:])
+                else:
+                    _, keys, info = record
+                    data = encode(info)
+                    editions += [(key, data) for key in keys]
+                    report["editions"] += 1
+
+            connection.execute("BEGIN")
+            before = connection.total_changes
+            connection.executemany(
+                "INSERT OR IGNORE INTO editions (isbn, data) VALUES (?, ?)", editions
+            )
+            report["isbns"] += connection.total_changes - before
+            connection.executemany(
+                "INSERT OR REPLACE INTO authors (key, name) VALUES (?, ?)", authors
+            )
+            report["authors"] += len(authors)
+            connection.execute("COMMIT")
+    finally:
+        connection.close()
+
+    if not append:
+        os.replace(work, target)
+    return report
+
+
+class ISBNStore:
+    """
+    Read side of the store, shared by all threads.
+
+    get() follows metadata_cache's convention: None when the store has no
+    answer, {} for "not found" (only in OFFLINE_ONLY mode) and a
+    volumeInfo dict otherwise. Each thread keeps its own read-only SQLite
+    connection, reopened when the file is replaced by a new build.
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self._local = threading.local()
+        self._counter_lock = threading.Lock()
+        self.reset_stats()
+
+    def reset_stats(self):
+        with self._counter_lock:
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses}
+
+    def _count(self, counter):
+        with self._counter_lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def _connection(self, path):
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        version = (path, stat.st_dev, stat.st_ino)
+        cached = getattr(self._local, "connection", None)
+        if cached is not None:
+            if cached[0] == version:
+                return cached[1]
+            cached[1].close()
+        connection = sqlite3.connect(
+            f"{Path(path).resolve().as_uri()}?mode=ro", uri=True
+        )
+        self._local.connection = (version, connection)
+        return connection
+
+    def lookup(self, isbn):
+        """Return the stored volumeInfo for an ISBN, or None if it isn't stored."""
+        path = self.path or get_store_settings()["PATH"]
+        key = isbn13_key(isbn)
+        if not path or key is None:
+            return None
+        connection = self._connection(path)
+        if connection is None:
+            return None
+        try:
+            row = connection.execute(
+                "SELECT data FROM editions WHERE isbn = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            info = decode(row[0])
+            keys = [
+                a for a in info.get("authors", []) if a.startswith(AUTHOR_KEY_PREFIX)
+            ]
+            if keys:
+                names = dict(
+                    connection.execute(
+                        "SELECT key, name FROM authors WHERE key IN "
+                        f"({', '.join('?' * len(keys))})",
+                        keys,
+                    )
+                )
+                authors = [names.get(a, a) for a in info["authors"]]
+                # Authors missing from the dump are dropped, not shown as keys
+                authors = [a for a in authors if not a.startswith(AUTHOR_KEY_PREFIX)]
+                if authors:
+                    info["authors"] = authors
+                else:
+                    del info["authors"]
+        except (sqlite3.Error, zlib.error, ValueError) as e:
+            logger.warning("ISBN store lookup failed for %s: %s", isbn, e)
+            return None
+        return info
+
+    def get(self, isbn):
+        info = self.lookup(isbn)
+        if info is not None:
+            self._count("hits")
+            return info
+        self._count("misses")
+        if get_store_settings()["OFFLINE_ONLY"]:
+            return {}
+        return None
+
+
+isbn_store = ISBNStore()
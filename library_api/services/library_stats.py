@@ -0,0 +1,199 @@
+"""
+Per-user library statistics.
+
+LibraryStat rows are maintained by triggers on the book table (see
+migration 0011_librarystat), so reading a user's statistics costs a few
+small queries however many books they have. compute_stats and recompute
+rebuild the same numbers from the books, to check the triggers' work.
+"""
+
+from collections import Counter
+
+from django.db import connection, transaction
+from django.db.models import Count
+
+from ..models import Book, Bookshelf, Category, LibraryStat, Series
+
+Dimension = LibraryStat.Dimension
+# Mismatched keys listed in a recompute report, at most
+MAX_REPORTED_MISMATCHES = 20
+
+
+def get_stats(user):
+    """
+    Return the user's library statistics.
+
+    Returns:
+        dict: "total" books, and book counts per "category", "author" and
+        "bookshelf", plus each of the user's "series" with the volume
+        numbers present, those missing below the highest one, and how
+        many books in it have no volume number
+    """
+    counts = {dimension: {} for dimension in Dimension.values}
+    for dimension, key, count in LibraryStat.objects.filter(user=user).values_list(
+        "dimension", "key", "count"
+    ):
+        counts[dimension][key] = count
+
+    categories = dict(Category.objects.filter(user=user).values_list("id", "name"))
+    bookshelves = dict(Bookshelf.objects.filter(user=user).values_list("id", "name"))
+    series_titles = dict(Series.objects.filter(user=user).values_list("id", "title"))
+
+    volumes = {}
+    for key in counts[Dimension.VOLUME]:
+        series_id, volume_number = key.split(":")
+        volumes.setdefault(series_id, []).append(int(volume_number))
+
+    series = []
+    for series_id, count in counts[Dimension.SERIES].items():
+        present = sorted(volumes.get(series_id, []))
+        numbered = sum(
+            counts[Dimension.VOLUME][f"{series_id}:{number}"] for number in present
+        )
+        highest = present[-1] if present else 0
+        series.append(
+            {
+                "id": int(series_id),
+                "title": series_titles.get(int(series_id)),
+                "count": count,
+                "volumes": present,
+                "missing_volumes": sorted(set(range(1, highest + 1)) - set(present)),
+                "unnumbered": count - numbered,
+            }
+        )
+
+    return {
+        "total": counts[Dimension.TOTAL].get("", 0),
+        "categories": _by_count(
+            {
+                "id": int(key) if key else None,
+                "name": categories.get(int(key)) if key else None,
+                "count": count,
+            }
+            for key, count in counts[Dimension.CATEGORY].items()
+        ),
+        "authors": _by_count(
+            {"name": key, "count": count}
+            for key, count in counts[Dimension.AUTHOR].items()
+        ),
+        "bookshelves": _by_count(
+            {"id": int(key), "name": bookshelves.get(int(key)), "count": count}
+            for key, count in counts[Dimension.BOOKSHELF].items()
+        ),
+        "series": sorted(series, key=lambda entry: (entry["title"] or "", entry["id"])),
+    }
+
+
+def _by_count(entries):
+    """Sort stat entries by descending count, then name."""
+    return sorted(entries, key=lambda entry: (-entry["count"], entry["name"] or ""))
+
+
+def compute_stats(user_ids=None):
+    """
+    Count books from scratch, the way the triggers do incrementally.
+
+    Args:
+        user_ids (list, optional): Only count these users' books
+
+    Returns:
+        dict: Maps (user_id, dimension, key) to the number of books
+    """
+    books = Book.objects.order_by()
+    if user_ids is not None:
+        books = books.filter(user_id__in=user_ids)
+
+    stats = Counter()
+
+    def add(dimension, fields, key, filters=None):
+        rows = books.filter(**(filters or {})).values("user_id", *fields)
+        for row in rows.annotate(count=Count("id")).iterator():
+            stats[(row["user_id"], dimension, key(row))] += row["count"]
+
+    add(Dimension.TOTAL, [], lambda row: "")
+    add(
+        Dimension.CATEGORY,
+        ["category_id"],
+        lambda row: str(row["category_id"]) if row["category_id"] else "",
+    )
+    add(Dimension.AUTHOR, ["author"], lambda row: row["author"])
+    add(Dimension.BOOKSHELF, ["bookshelf_id"], lambda row: str(row["bookshelf_id"]))
+    add(
+        Dimension.SERIES,
+        ["series_id"],
+        lambda row: str(row["series_id"]),
+        {"series__isnull": False},
+    )
+    add(
+        Dimension.VOLUME,
+        ["series_id", "volume_number"],
+        lambda row: f"{row['series_id']}:{row['volume_number']}",
+        {"series__isnull": False, "volume_number__isnull": False},
+    )
+    return dict(stats)
+
+
+def recompute(user_ids=None, dry_run=False):
+    """
+    Rebuild LibraryStat rows from the books and report any that were wrong.
+
+    Writes to the book table wait until the rebuild commits, so the counts
+    can't change between being computed and stored.
+
+    Args:
+        user_ids (list, optional): Only rebuild these users' statistics
+        dry_run (bool): Only report mismatches; leave the rows alone
+
+    Returns:
+        dict: Number of "rows" computed and of "mismatched" keys, with
+        the first few mismatches as {"user_id", "dimension", "key",
+        "stored", "expected"}
+    """
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"LOCK TABLE {connection.ops.quote_name(Book._meta.db_table)} "
+                "IN SHARE MODE"
+            )
+        expected = compute_stats(user_ids)
+        stored_rows = LibraryStat.objects.all()
+        if user_ids is not None:
+            stored_rows = stored_rows.filter(user_id__in=user_ids)
+        stored = {
+            (user_id, dimension, key): count
+            for user_id, dimension, key, count in stored_rows.values_list(
+                "user_id", "dimension", "key", "count"
+            ).iterator()
+        }
+
+        mismatched = sorted(
+            key
+            for key in expected.keys() | stored.keys()
+            if expected.get(key) != stored.get(key)
+        )
+        if mismatched and not dry_run:
+            stored_rows.delete()
+            LibraryStat.objects.bulk_create(
+                (
+                    LibraryStat(
+                        user_id=user_id, dimension=dimension, key=key, count=count
+                    )
+                    for (user_id, dimension, key), count in expected.items()
+                ),
+                batch_size=2000,
+            )
+
+    return {
+        "rows": len(expected),
+        "mismatched": len(mismatched),
+        "mismatches": [
+            {
+                "user_id": user_id,
+                "dimension": dimension,
+                "key": key,
+                "stored": stored.get((user_id, dimension, key), 0),
+                "expected": expected.get((user_id, dimension, key), 0),
+            }
+            for user_id, dimension, key in mismatched[:MAX_REPORTED_MISMATCHES]
+        ],
+    }
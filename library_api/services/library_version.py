@@ -0,0 +1,40 @@
+"""
+Per-user library version stamps.
+
+Every write to a user's books, bookshelves, categories or series bumps
+their LibraryVersion. Model saves and deletes, and QuerySet deletes, are
+covered by LibraryModel and LibraryQuerySet; code that writes with
+bulk_create, bulk_update, QuerySet.update or COPY must call bump_version
+itself.
+"""
+
+from django.db import connection
+
+from ..models import LibraryVersion
+
+
+def get_version(user_id):
+    """Return the user's current library version (0 if never written)."""
+    return (
+        LibraryVersion.objects.filter(user_id=user_id)
+        .values_list("version", flat=True)
+        .first()
+        or 0
+    )
+
+
+def bump_version(*user_ids):
+    """Increment the library version of each given user."""
+    user_ids = sorted({user_id for user_id in user_ids if user_id is not None})
+    if not user_ids:
+        return
+    table = connection.ops.quote_name(LibraryVersion._meta.db_table)
+    # One upsert, so concurrent first writes can't lose an increment.
+    # Sorted ids keep the row locks in a consistent order.
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"INSERT INTO {table} (user_id, version) "
+            "SELECT unnest(%s::bigint[]), 1 "
+            f"ON CONFLICT (user_id) DO UPDATE SET version = {table}.version + 1",
+            [user_ids],
+        )
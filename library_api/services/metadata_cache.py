@@ -0,0 +1,223 @@
+"""
+Two-tier cache for Google Books metadata.
+
+Lookups check a small in-process LRU first, then the shared BookMetadata
+table, and only fall through to the network when both miss. "Not found"
+answers are cached too, with their own (shorter) TTLs.
+"""
+
+import re
+import threading
+from collections import OrderedDict
+from datetime import timedelta
+from time import monotonic
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.utils import timezone
+
+# Default cache configuration, overridable via settings.BOOK_METADATA_CACHE
+DEFAULT_CACHE_SETTINGS = {
+    "MAX_ENTRIES": 1024,  # in-process LRU size
+    "TTL": 60 * 60,  # seconds a found result stays in the LRU
+    "NEGATIVE_TTL": 5 * 60,  # seconds a "not found" result stays in the LRU
+    "DB_TTL": 30 * 24 * 60 * 60,  # seconds before a stored result is refetched
+    "DB_NEGATIVE_TTL": 24 * 60 * 60,  # same, for stored "not found" results
+    "USE_DB": True,
+}
+
+_NON_ISBN_CHARS = re.compile(r"[^0-9X]")
+
+
+def normalize_isbn(isbn):
+    """
+    Normalize an ISBN for use as a cache key.
+
+    Strips hyphens, spaces and anything else that isn't a digit or the
+    ISBN-10 check character "X", so "978-0-14-044913-6" and "9780140449136"
+    share one entry.
+    """
+    return _NON_ISBN_CHARS.sub("", str(isbn or "").upper())
+
+
+def get_cache_settings():
+    """Return the cache configuration merged over the defaults."""
+    return {**DEFAULT_CACHE_SETTINGS, **getattr(settings, "BOOK_METADATA_CACHE", {})}
+
+
+class LRUCache:
+    """
+    Thread-safe LRU cache where every entry carries its own expiry time.
+
+    Entries are evicted least-recently-used first once max_entries is
+    reached; expired entries are dropped lazily when read.
+    """
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.evictions = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Return the cached value for key, or None if missing or expired."""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at <= monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl):
+        """Store value under key for ttl seconds, evicting old entries if full."""
+        if self.max_entries <= 0 or ttl <= 0:
+            return
+        with self._lock:
+            self._data[key] = (value, monotonic() + ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class MetadataCache:
+    """
+    In-process LRU in front of the BookMetadata table.
+
+    get() returns None on a miss, {} for a cached "not found" and the
+    volumeInfo dict otherwise. Cached dicts are shared between callers
+    and must not be mutated.
+    """
+
+    def __init__(self, config=None):
+        self.config = config or get_cache_settings()
+        self.memory = LRUCache(self.config["MAX_ENTRIES"])
+        self._counter_lock = threading.Lock()
+        self.reset_stats()
+
+    def reset_stats(self):
+        with self._counter_lock:
+            self.memory_hits = 0
+            self.db_hits = 0
+            self.misses = 0
+
+    def stats(self):
+        """Return hit/miss counters for both tiers."""
+        return {
+            "memory_hits": self.memory_hits,
+            "db_hits": self.db_hits,
+            "misses": self.misses,
+            "evictions": self.memory.evictions,
+            "memory_entries": len(self.memory),
+        }
+
+    def _count(self, counter):
+        with self._counter_lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def _memory_ttl(self, data):
+        return self.config["TTL"] if data else self.config["NEGATIVE_TTL"]
+
+    def get(self, isbn):
+        data = self.memory.get(isbn)
+        if data is not None:
+            self._count("memory_hits")
+            return data
+
+        if self.config["USE_DB"]:
+            data = self._get_from_db(isbn)
+            if data is not None:
+                self._count("db_hits")
+                self.memory.set(isbn, data, self._memory_ttl(data))
+                return data
+
+        self._count("misses")
+        return None
+
+    async def aget(self, isbn):
+        """Async get(). Only the database tier leaves the event loop thread."""
+        data = self.memory.get(isbn)
+        if data is not None:
+            self._count("memory_hits")
+            return data
+        return await sync_to_async(self.get)(isbn)
+
+    async def aset(self, isbn, data):
+        await sync_to_async(self.set)(isbn, data)
+
+    def set(self, isbn, data):
+        """Cache a fetched result; pass an empty dict to record "not found"."""
+        data = data or {}
+        self.memory.set(isbn, data, self._memory_ttl(data))
+        if self.config["USE_DB"]:
+            self._save_to_db(isbn, data)
+
+    def get_stale(self, isbn):
+        """
+        Like get(), but also returns stored results past their TTL. For
+        when the API can't be reached: an old answer beats none.
+        """
+        data = self.memory.get(isbn)
+        if data is None and self.config["USE_DB"]:
+            data = self._get_from_db(isbn, ignore_ttl=True)
+        return data
+
+    async def aget_stale(self, isbn):
+        return await sync_to_async(self.get_stale)(isbn)
+
+    def invalidate(self, isbn):
+        self.memory.delete(isbn)
+        if self.config["USE_DB"]:
+            self._delete_from_db(isbn)
+
+    def clear(self):
+        """Empty the in-process tier. The DB tier is left untouched."""
+        self.memory.clear()
+
+    def _get_from_db(self, isbn, ignore_ttl=False):
+        from ..models import BookMetadata
+
+        row = BookMetadata.objects.filter(isbn=isbn).first()
+        if row is None:
+            return None
+
+        ttl = self.config["DB_TTL"] if row.found else self.config["DB_NEGATIVE_TTL"]
+        if not ignore_ttl and row.fetched_at + timedelta(seconds=ttl) <= timezone.now():
+            return None
+        return row.data if row.found else {}
+
+    def _save_to_db(self, isbn, data):
+        from ..models import BookMetadata
+
+        BookMetadata.objects.update_or_create(
+            isbn=isbn,
+            defaults={
+                "data": data,
+                "found": bool(data),
+                "fetched_at": timezone.now(),
+            },
+        )
+
+    def _delete_from_db(self, isbn):
+        from ..models import BookMetadata
+
+        BookMetadata.objects.filter(isbn=isbn).delete()
+
+
+# Shared per-process cache used by fetch_book_data
+metadata_cache = MetadataCache()
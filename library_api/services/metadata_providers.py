@@ -0,0 +1,565 @@
+"""
+Chain of metadata providers for ISBN lookups.
+
+A provider turns an ISBN into a volumeInfo dict ({} if it doesn't know
+the book). The chain asks the providers configured in
+settings.BOOK_METADATA_PROVIDERS in order, moving on when one fails or
+doesn't know the book, and returns the first book found.
+
+With HEDGE_AFTER set, a provider that hasn't answered within that many
+seconds gets a backup: the next provider is asked too and whichever finds
+the book first wins, so one slow provider doesn't set the latency of
+every lookup. Each provider's latency is tracked, and with REORDER on the
+fastest healthy providers are asked first.
+
+The local ISBN store and the metadata cache are consulted before the
+chain (see google_books.fetch_book_data), so only lookups that need the
+network get here.
+"""
+
+import asyncio
+import contextvars
+import threading
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from time import perf_counter
+
+import aiohttp
+import requests
+from django.conf import settings
+
+from . import async_google_books, google_books, request_metrics
+from .circuit_breaker import CircuitBreaker, CircuitOpenError
+
+# Default configuration, overridable via settings.BOOK_METADATA_PROVIDERS
+DEFAULT_PROVIDER_SETTINGS = {
+    "PROVIDERS": ["google_books"],  # keys of PROVIDER_CLASSES, in order
+    # Seconds to wait for a provider before also asking the next one; None
+    # only asks the next one after a failure or "not found"
+    "HEDGE_AFTER": None,
+    "REORDER": False,  # ask the fastest healthy providers first
+    "LATENCY_WEIGHT": 0.2,  # weight of the newest sample in the moving average
+    "MAX_WORKERS": 16,  # threads running hedged requests
+    "OPEN_LIBRARY_URL": "https://openlibrary.org/api/books",
+}
+# Subjects kept per book (as volumeInfo "categories")
+MAX_CATEGORIES = 5
+
+# What a failed lookup raises, for the sync and async clients
+ERRORS = (requests.RequestException, CircuitOpenError)
+ASYNC_ERRORS = (aiohttp.ClientError, asyncio.TimeoutError, CircuitOpenError)
+
+
+def get_provider_settings():
+    """Return the provider configuration merged over the defaults."""
+    return {
+        **DEFAULT_PROVIDER_SETTINGS,
+        **getattr(settings, "BOOK_METADATA_PROVIDERS", {}),
+    }
+
+
+class Provider:
+    """
+    A source of book metadata, with its own latency and outcome counters.
+
+    Subclasses set `name` and `breaker` and implement fetch() and afetch(),
+    which return a volumeInfo dict, or {} if the book isn't known, and
+    raise one of ERRORS (ASYNC_ERRORS) if the lookup failed. Options a
+    provider doesn't use are ignored.
+    """
+
+    name = None
+    breaker = None
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset_stats()
+
+    def reset_stats(self):
+        with self._lock:
+            self.latency = None  # moving average of answered lookups, seconds
+            self.found = 0
+            self.not_found = 0
+            self.errors = 0
+
+    def stats(self):
+        latency = self.latency
+        return {
+            "latency_ms": None if latency is None else round(latency * 1000, 2),
+            "found": self.found,
+            "not_found": self.not_found,
+            "errors": self.errors,
+            "state": self.breaker.state,
+        }
+
+    @property
+    def healthy(self):
+        return self.breaker.state != CircuitBreaker.OPEN
+
+    def record(self, seconds, found, weight):
+        with self._lock:
+            if self.latency is None:
+                self.latency = seconds
+            else:
+                self.latency += weight * (seconds - self.latency)
+            if found:
+                self.found += 1
+            else:
+                self.not_found += 1
+
+    def record_error(self):
+        with self._lock:
+            self.errors += 1
+
+    # Batched lookups are counted, but their latency isn't comparable with
+    # single lookups' and is left out of the average
+    def record_found(self):
+        with self._lock:
+            self.found += 1
+
+    def record_not_found(self):
+        with self._lock:
+            self.not_found += 1
+
+    def fetch(self, isbn, **options):
+        raise NotImplementedError
+
+    async def afetch(self, isbn, **options):
+        raise NotImplementedError
+
+    def fetch_many(self, isbns, max_workers=None, **options):
+        """
+        Look many ISBNs up. Providers that can answer several ISBNs per
+        request override this; by default they're fetched concurrently.
+
+        Returns:
+            dict: Maps ISBNs to their volumeInfo, or {} if not found. ISBNs
+            whose lookup failed are left out.
+        """
+
+        def fetch(isbn):
+            try:
+                return self.fetch(isbn, **options)
+            except ERRORS:
+                return None
+
+        max_workers = max_workers or getattr(
+            settings, "GOOGLE_BOOKS_MAX_WORKERS", google_books.DEFAULT_MAX_WORKERS
+        )
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(isbns))) as pool:
+            results = dict(zip(isbns, pool.map(fetch, isbns)))
+        return {isbn: data for isbn, data in results.items() if data is not None}
+
+
+class GoogleBooksProvider(Provider):
+    """Google Books, through the retrying, rate-limited google_books client."""
+
+    name = "google_books"
+
+    @property
+    def breaker(self):
+        return google_books.breaker
+
+    def fetch(self, isbn, api_url=None, api_key=None, **options):
+        return google_books.fetch_volume_info(isbn, api_url, api_key)
+
+    async def afetch(self, isbn, api_url=None, api_key=None, **options):
+        return await async_google_books.afetch_volume_info(isbn, api_url, api_key)
+
+    def fetch_many(
+        self, isbns, max_workers=None, api_url=None, api_key=None, **options
+    ):
+        return google_books.fetch_volume_infos(isbns, api_url, api_key, max_workers)
+
+
+class OpenLibraryProvider(Provider):
+    """
+    Open Library's Books API (one request per lookup, not retried).
+
+    Shares the Google Books client's HTTP sessions and timeouts, but has a
+    circuit breaker of its own.
+    """
+
+    name = "open_library"
+
+    def __init__(self):
+        super().__init__()
+        config = google_books.get_client_settings()
+        self.breaker = CircuitBreaker(
+            config["FAILURE_THRESHOLD"], config["RESET_TIMEOUT"]
+        )
+
+    @staticmethod
+    def _request(isbns):
+        url = get_provider_settings()["OPEN_LIBRARY_URL"]
+        bibkeys = ",".join(f"ISBN:{isbn}" for isbn in isbns)
+        return url, {"bibkeys": bibkeys, "format": "json", "jscmd": "data"}
+
+    def _get_records(self, isbns):
+        """Fetch the records for some ISBNs in one request, keyed by ISBN."""
+        url, params = self._request(isbns)
+        config = google_books.get_client_settings()
+        with request_metrics.timed("openlibrary"):
+            self.breaker.before_call()
+            try:
+                response = google_books.session.get(
+                    url,
+                    params=params,
+                    timeout=(config["CONNECT_TIMEOUT"], config["READ_TIMEOUT"]),
+                )
+                response.raise_for_status()
+                data = response.json()
+            except requests.RequestException:
+                self.breaker.record_failure()
+                raise
+            self.breaker.record_success()
+        return {isbn: data.get(f"ISBN:{isbn}") for isbn in isbns}
+
+    def fetch(self, isbn, **options):
+        return open_library_volume_info(self._get_records([isbn])[isbn])
+
+    def fetch_many(self, isbns, max_workers=None, **options):
+        batch_size = google_books.get_client_settings()["BATCH_SIZE"]
+        batches = [isbns[i : i + batch_size] for i in range(0, len(isbns), batch_size)]
+
+        def fetch(batch):
+            try:
+                return self._get_records(batch)
+            except ERRORS:
+                return {}
+
+        max_workers = max_workers or getattr(
+            settings, "GOOGLE_BOOKS_MAX_WORKERS", google_books.DEFAULT_MAX_WORKERS
+        )
+        results = {}
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(batches))) as pool:
+            for records in pool.map(fetch, batches):
+                for isbn, record in records.items():
+                    results[isbn] = open_library_volume_info(record)
+        return results
+
+    async def afetch(self, isbn, **options):
+        url, params = self._request([isbn])
+        config = google_books.get_client_settings()
+        timeout = aiohttp.ClientTimeout(
+            sock_connect=config["CONNECT_TIMEOUT"], sock_read=config["READ_TIMEOUT"]
+        )
+        with request_metrics.timed("openlibrary"):
+            self.breaker.before_call()
+            try:
+                async with async_google_books.get_session().get(
+                    url, params=params, timeout=timeout
+                ) as response:
+                    response.raise_for_status()
+                    data = await response.json()
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                self.breaker.record_failure()
+                raise
+            self.breaker.record_success()
+        return open_library_volume_info(data.get(params["bibkeys"]) or {})
+
+
+def open_library_volume_info(record):
+    """Map an Open Library Books API record onto Google Books volumeInfo fields."""
+    if not record:
+        return {}
+    info = {"title": record.get("title", "")}
+    for source, target in [
+        ("subtitle", "subtitle"),
+        ("publish_date", "publishedDate"),
+        ("number_of_pages", "pageCount"),
+    ]:
+        if record.get(source):
+            info[target] = record[source]
+
+    authors = [author.get("name") for author in record.get("authors", [])]
+    authors = [name for name in authors if name]
+    if authors:
+        info["authors"] = authors
+    if record.get("publishers"):
+        info["publisher"] = record["publishers"][0].get("name")
+    subjects = [subject.get("name") for subject in record.get("subjects", [])]
+    if subjects:
+        info["categories"] = subjects[:MAX_CATEGORIES]
+
+    cover = record.get("cover") or {}
+    if cover.get("small") or cover.get("medium"):
+        info["imageLinks"] = {
+            "smallThumbnail": cover.get("small") or cover.get("medium"),
+            "thumbnail": cover.get("medium") or cover.get("small"),
+        }
+    identifiers = record.get("identifiers") or {}
+    info["industryIdentifiers"] = [
+        {"type": kind, "identifier": isbn}
+        for field, kind in [("isbn_13", "ISBN_13"), ("isbn_10", "ISBN_10")]
+        for isbn in identifiers.get(field, [])
+    ]
+    if not info["industryIdentifiers"]:
+        del info["industryIdentifiers"]
+    return info
+
+
+PROVIDER_CLASSES = {
+    GoogleBooksProvider.name: GoogleBooksProvider,
+    OpenLibraryProvider.name: OpenLibraryProvider,
+}
+
+
+class ProviderChain:
+    """
+    The configured providers, asked in order (or hedged) for each lookup.
+
+    Provider instances, and so their latency figures and breakers, live
+    as long as the chain; the configuration is read on every lookup.
+    """
+
+    def __init__(self):
+        self._providers = {}
+        self._lock = threading.Lock()
+        self._executor = None
+        self.hedges = 0
+
+    def provider(self, name):
+        with self._lock:
+            if name not in self._providers:
+                self._providers[name] = PROVIDER_CLASSES[name]()
+            return self._providers[name]
+
+    def ordered(self, config=None):
+        """The providers in the order they'll be asked."""
+        config = config or get_provider_settings()
+        providers = [self.provider(name) for name in config["PROVIDERS"]]
+        if config["REORDER"]:
+            # Providers with no answers yet keep their place behind measured ones
+            providers.sort(
+                key=lambda provider: (
+                    not provider.healthy,
+                    float("inf") if provider.latency is None else provider.latency,
+                )
+            )
+        return providers
+
+    def stats(self):
+        with self._lock:
+            providers = dict(self._providers)
+        return {
+            "hedges": self.hedges,
+            "providers": {name: p.stats() for name, p in providers.items()},
+        }
+
+    def reset_stats(self):
+        with self._lock:
+            self.hedges = 0
+            providers = list(self._providers.values())
+        for provider in providers:
+            provider.reset_stats()
+
+    def _hedge_executor(self, config):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=config["MAX_WORKERS"],
+                    thread_name_prefix="metadata-hedge",
+                )
+            return self._executor
+
+    def _count_hedge(self):
+        with self._lock:
+            self.hedges += 1
+
+    def _call(self, provider, isbn, options, config):
+        start = perf_counter()
+        try:
+            data = provider.fetch(isbn, **options)
+        except ERRORS:
+            provider.record_error()
+            raise
+        provider.record(perf_counter() - start, bool(data), config["LATENCY_WEIGHT"])
+        return data
+
+    async def _acall(self, provider, isbn, options, config):
+        start = perf_counter()
+        try:
+            data = await provider.afetch(isbn, **options)
+        except ASYNC_ERRORS:
+            provider.record_error()
+            raise
+        provider.record(perf_counter() - start, bool(data), config["LATENCY_WEIGHT"])
+        return data
+
+    def fetch(self, isbn, **options):
+        """
+        Look an ISBN up with the configured providers.
+
+        Args:
+            isbn (str): Normalized ISBN
+            **options: Passed to every provider; the Google Books provider
+                takes api_url and api_key
+
+        Returns:
+            dict: The first volumeInfo found, or {} if no provider knows the
+            book
+
+        Raises:
+            requests.RequestException, CircuitOpenError: The last error, if
+            no provider found the book and any of them failed
+        """
+        config = get_provider_settings()
+        providers = self.ordered(config)
+        if config["HEDGE_AFTER"] is None:
+            return self._fetch_in_turn(providers, isbn, options, config)
+        return self._fetch_hedged(providers, isbn, options, config)
+
+    def fetch_many(self, isbns, **options):
+        """
+        Look many ISBNs up, each provider in turn taking the ISBNs the ones
+        before it failed on or didn't know. Batches aren't hedged.
+
+        Args:
+            isbns (list): Normalized ISBNs
+            **options: Passed to every provider's fetch_many (max_workers,
+                and api_url and api_key for Google Books)
+
+        Returns:
+            dict: Maps ISBNs to the first volumeInfo found, or {} if no
+            provider knows the book. ISBNs that no provider found and any
+            provider failed on are left out.
+        """
+        results = {}
+        failed = set()
+        remaining = list(isbns)
+        for provider in self.ordered():
+            if not remaining:
+                break
+            answered = provider.fetch_many(remaining, **options)
+            for isbn in remaining:
+                data = answered.get(isbn)
+                if data is None:
+                    provider.record_error()
+                    failed.add(isbn)
+                elif data:
+                    provider.record_found()
+                    results[isbn] = data
+                else:
+                    provider.record_not_found()
+                    results[isbn] = {}
+            remaining = [isbn for isbn in remaining if not results.get(isbn)]
+        return {
+            isbn: data for isbn, data in results.items() if data or isbn not in failed
+        }
+
+    def _fetch_in_turn(self, providers, isbn, options, config):
+        error = None
+        for provider in providers:
+            try:
+                data = self._call(provider, isbn, options, config)
+            except ERRORS as e:
+                error = e
+                continue
+            if data:
+                return data
+        # A miss is only final if every provider answered; otherwise the
+        # caller mustn't remember it
+        if error is None:
+            return {}
+        raise error
+
+    def _fetch_hedged(self, providers, isbn, options, config):
+        executor = self._hedge_executor(config)
+        waiting = list(providers)
+        running = set()
+        error = None
+
+        def launch():
+            # Each thread gets its own copy of the context, so the request's
+            # Server-Timing still sees the provider calls
+            context = contextvars.copy_context()
+            running.add(
+                executor.submit(
+                    context.run, self._call, waiting.pop(0), isbn, options, config
+                )
+            )
+
+        launch()
+        while running:
+            done, _ = wait(
+                running,
+                timeout=config["HEDGE_AFTER"] if waiting else None,
+                return_when=FIRST_COMPLETED,
+            )
+            if not done:
+                self._count_hedge()
+                launch()
+                continue
+            for future in done:
+                running.discard(future)
+                try:
+                    data = future.result()
+                except ERRORS as e:
+                    error = e
+                else:
+                    if data:
+                        # Slower providers still running finish in the background
+                        return data
+                if waiting:
+                    launch()
+        # A miss is only final if every provider answered; otherwise the
+        # caller mustn't remember it
+        if error is None:
+            return {}
+        raise error
+
+    async def afetch(self, isbn, **options):
+        """
+        Async version of fetch(). Requests still in flight once a book is
+        found are cancelled.
+
+        Raises:
+            aiohttp.ClientError, asyncio.TimeoutError, CircuitOpenError: The
+            last error, if no provider found the book and any of them failed
+        """
+        config = get_provider_settings()
+        waiting = self.ordered(config)
+        running = set()
+        error = None
+
+        def launch():
+            running.add(
+                asyncio.ensure_future(
+                    self._acall(waiting.pop(0), isbn, options, config)
+                )
+            )
+
+        launch()
+        try:
+            while running:
+                done, _ = await asyncio.wait(
+                    running,
+                    timeout=config["HEDGE_AFTER"] if waiting else None,
+                    return_when=asyncio.FIRST_COMPLETED,
+                )
+                if not done:
+                    self._count_hedge()
+                    launch()
+                    continue
+                for task in done:
+                    running.discard(task)
+                    try:
+                        data = task.result()
+                    except ASYNC_ERRORS as e:
+                        error = e
+                    else:
+                        if data:
+                            return data
+                    if waiting:
+                        launch()
+        finally:
+            for task in running:
+                task.cancel()
+        # A miss is only final if every provider answered; otherwise the
+        # caller mustn't remember it
+        if error is None:
+            return {}
+        raise error
+
+
+chain = ProviderChain()
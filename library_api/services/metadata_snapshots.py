@@ -0,0 +1,204 @@
+"""
+Google Books metadata snapshots stored on books.
+
+A book's details show the full Google Books data for its ISBN. Instead of
+looking it up every time they're opened, it is kept on the book itself
+(Book.metadata_snapshot, as compact JSON, zlib-compressed when large)
+together with the time it was fetched, so showing the details is a
+single primary key read. Snapshots are taken when a book is enriched
+from full data, or the first time its details are shown; refresh()
+(manage.py refresh_metadata_snapshots) fetches them again from the
+providers, not the metadata cache, once they're older than MAX_AGE.
+
+Only full data is stored: partial search results (see
+google_books.is_partial) are upgraded first, or left for later.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+import requests
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from ..models import Book
+from . import isbn_store
+from .circuit_breaker import CircuitOpenError
+from .google_books import (
+    DEFAULT_MAX_WORKERS,
+    VOLUME_ID_KEY,
+    fetch_many,
+    fetch_many_from_providers,
+    fetch_volume_detail,
+    is_partial,
+)
+from .library_version import bump_version
+from .metadata_cache import metadata_cache, normalize_isbn
+
+# Default configuration, overridable via settings.BOOK_METADATA_SNAPSHOTS
+DEFAULT_SNAPSHOT_SETTINGS = {
+    "MAX_AGE": 30 * 24 * 60 * 60,  # seconds before a snapshot is refreshed
+    "BATCH_SIZE": 200,  # books looked up and updated together
+}
+
+# Book fields holding the snapshot
+SNAPSHOT_FIELDS = ["metadata_snapshot", "metadata_fetched_at"]
+
+
+def get_snapshot_settings():
+    """Return the snapshot configuration merged over the defaults."""
+    return {
+        **DEFAULT_SNAPSHOT_SETTINGS,
+        **getattr(settings, "BOOK_METADATA_SNAPSHOTS", {}),
+    }
+
+
+def encode(data):
+    return isbn_store.encode(data)
+
+
+def decode(value):
+    # Postgres hands bytea back as a memoryview, which json can't read
+    return isbn_store.decode(bytes(value))
+
+
+def snapshot_fields(book_data, fetched_at=None):
+    """
+    Return the Book fields storing `book_data` as the book's snapshot.
+
+    Empty if there is nothing to store: the lookup failed (None) or only
+    returned a partial result.
+    """
+    if book_data is None or is_partial(book_data):
+        return {}
+    return {
+        "metadata_snapshot": encode(book_data),
+        "metadata_fetched_at": fetched_at or timezone.now(),
+    }
+
+
+def store(book, book_data):
+    """Save `book_data` as the book's snapshot, if it's full data."""
+    fields = snapshot_fields(book_data)
+    if fields:
+        # A plain UPDATE: the snapshot is what the book was just shown with,
+        # so the library version (and the response's ETag) stays as it is
+        Book.objects.filter(pk=book.pk).update(**fields)
+        for field, value in fields.items():
+            setattr(book, field, value)
+
+
+def fetch_full(isbns, max_workers=None, use_cache=True):
+    """
+    fetch_many, with partial results upgraded to the volumes' details.
+
+    The detail requests run concurrently; cache writes stay in the calling
+    thread. Results whose details can't be fetched stay partial.
+
+    With use_cache=False every ISBN is looked up with the providers again
+    rather than read from the store or cache, and the fresh results are
+    written back to the cache. ISBNs whose lookup failed map to None.
+    """
+    if use_cache:
+        results = fetch_many(isbns, max_workers=max_workers)
+    else:
+        isbns = [isbn for isbn in dict.fromkeys(map(normalize_isbn, isbns)) if isbn]
+        fetched = fetch_many_from_providers(isbns, max_workers)
+        results = {isbn: fetched.get(isbn) for isbn in isbns}
+        for isbn, data in results.items():
+            if data is not None:
+                metadata_cache.set(isbn, data)
+    partial = [isbn for isbn, data in results.items() if is_partial(data)]
+    if not partial:
+        return results
+
+    def detail(isbn):
+        try:
+            return fetch_volume_detail(results[isbn][VOLUME_ID_KEY])
+        except (requests.RequestException, CircuitOpenError):
+            return None
+
+    max_workers = max_workers or getattr(
+        settings, "GOOGLE_BOOKS_MAX_WORKERS", DEFAULT_MAX_WORKERS
+    )
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(partial))) as pool:
+        details = list(pool.map(detail, partial))
+    for isbn, data in zip(partial, details):
+        if data:
+            metadata_cache.set(isbn, data)
+            results[isbn] = data
+    return results
+
+
+def stale_books(max_age=None, books=None):
+    """Books (default: all) whose snapshot is missing or older than max_age seconds."""
+    if max_age is None:
+        max_age = get_snapshot_settings()["MAX_AGE"]
+    cutoff = timezone.now() - timedelta(seconds=max_age)
+    books = Book.objects.all() if books is None else books
+    return books.filter(
+        Q(metadata_fetched_at__isnull=True) | Q(metadata_fetched_at__lt=cutoff)
+    )
+
+
+def refresh(max_age=None, batch_size=None, max_workers=None, books=None):
+    """
+    Fetch the snapshots of stale books again.
+
+    Books are walked in id order, batch_size at a time, so memory use
+    doesn't grow with the library. Each batch's ISBNs are looked up
+    together with the providers, bypassing the metadata cache (whose
+    entries can be as old as the snapshots), and its snapshots written in
+    one UPDATE. Books Google Books doesn't know get an empty snapshot, so
+    they aren't looked up again until it's stale. Books whose lookup fails
+    keep their old snapshot and are tried again on the next run.
+
+    Args:
+        max_age (int, optional): Refresh snapshots older than this many
+            seconds. Defaults to MAX_AGE; 0 refreshes every snapshot.
+        batch_size (int, optional): Books per batch. Defaults to BATCH_SIZE.
+        max_workers (int, optional): Concurrent lookups per batch.
+        books (QuerySet, optional): Limit the refresh to these books.
+
+    Returns:
+        dict: Counts of books looked at, snapshots "refreshed", books
+        "not_found", lookups that "failed", and batches
+    """
+    batch_size = batch_size or get_snapshot_settings()["BATCH_SIZE"]
+    stale = stale_books(max_age, books).order_by("id")
+    report = {"books": 0, "refreshed": 0, "not_found": 0, "failed": 0, "batches": 0}
+
+    last_id = 0
+    while batch := list(
+        stale.filter(id__gt=last_id).values_list("id", "user_id", "isbn")[
+            :batch_size
+        ]
+    ):
+        last_id = batch[-1][0]
+        metadata = fetch_full(
+            [isbn for _, _, isbn in batch], max_workers, use_cache=False
+        )
+        fetched_at = timezone.now()
+
+        to_update = []
+        not_found = 0
+        for book_id, user_id, isbn in batch:
+            data = metadata.get(normalize_isbn(isbn))
+            fields = snapshot_fields(data, fetched_at)
+            if fields:
+                to_update.append(Book(id=book_id, user_id=user_id, **fields))
+                not_found += not data
+
+        with transaction.atomic():
+            Book.objects.bulk_update(to_update, SNAPSHOT_FIELDS)
+            # The books' details change, so their ETags have to
+            bump_version(*(book.user_id for book in to_update))
+
+        report["books"] += len(batch)
+        report["refreshed"] += len(to_update) - not_found
+        report["not_found"] += not_found
+        report["failed"] += len(batch) - len(to_update)
+        report["batches"] += 1
+    return report
@@ -0,0 +1,53 @@
+"""
+Token-bucket rate limiting for outgoing API calls.
+"""
+
+import asyncio
+import threading
+from time import monotonic, sleep
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket.
+
+    Tokens refill continuously at `rate` per second up to `capacity`; each
+    acquire() takes one token, blocking until one is available.
+    """
+
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity or rate)
+        self._tokens = self.capacity
+        self._updated_at = monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = monotonic()
+        self._tokens = min(
+            self.capacity, self._tokens + (now - self._updated_at) * self.rate
+        )
+        self._updated_at = now
+
+    def try_acquire(self):
+        """Take a token if one is available. Returns True on success."""
+        return self._take_or_wait() == 0
+
+    def _take_or_wait(self):
+        """Take a token and return 0, or return the seconds until one is free."""
+        with self._lock:
+            self._refill()
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return 0
+            return (1 - self._tokens) / self.rate
+
+    def acquire(self):
+        """Take a token, sleeping until one is available."""
+        while wait := self._take_or_wait():
+            sleep(wait)
+
+    async def aacquire(self):
+        """Async version of acquire() that yields to the event loop while waiting."""
+        while wait := self._take_or_wait():
+            await asyncio.sleep(wait)
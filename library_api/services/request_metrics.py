@@ -0,0 +1,237 @@
+"""
+Per-request timings and latency histograms.
+
+RequestMetricsMiddleware gives each request a RequestTimings and makes it
+current while the request runs. Code that does something worth timing
+(SQL, Google Books and Open Library calls, serialization, JWT
+validation) wraps it in timed(name); with no current request, as when
+the middleware is off, that costs one context variable lookup. Phases can overlap: a queryset
+evaluated while serializing counts towards both "db" and "serialize".
+
+Finished requests are folded into histograms per view name, kept per
+process and rendered in the Prometheus text format by the metrics
+endpoint. Each worker process keeps its own histograms, so scrape each
+worker (or run one) to get complete numbers.
+"""
+
+import threading
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from time import perf_counter
+
+from django.conf import settings
+
+# Default configuration, overridable via settings.REQUEST_METRICS
+DEFAULT_REQUEST_METRICS_SETTINGS = {
+    # Off by default: the middleware removes itself and timed() is a no-op
+    "ENABLED": False,
+    "SERVER_TIMING": True,  # add a Server-Timing header to each response
+    # If set, the metrics endpoint requires "Authorization: Bearer <TOKEN>"
+    "TOKEN": None,
+    "LATENCY_BUCKETS": [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10],
+    "QUERY_BUCKETS": [0, 1, 2, 5, 10, 20, 50, 100],
+}
+
+# Timings reported for every request, in Server-Timing order
+PHASES = ["auth", "db", "google", "openlibrary", "serialize", "render"]
+
+_current = ContextVar("request_timings", default=None)
+
+
+def get_request_metrics_settings():
+    """Return the request metrics configuration merged over the defaults."""
+    return {
+        **DEFAULT_REQUEST_METRICS_SETTINGS,
+        **getattr(settings, "REQUEST_METRICS", {}),
+    }
+
+
+class RequestTimings:
+    """
+    Seconds spent and calls made per phase of one request.
+
+    Shared with the threads a request hands work to (sync_to_async, the
+    provider hedging and batch lookup pools), so updates take a lock.
+    """
+
+    def __init__(self):
+        self.seconds = dict.fromkeys(PHASES, 0.0)
+        self.counts = dict.fromkeys(PHASES, 0)
+        self.total = 0.0
+        # Phases being timed right now; nested calls only count once
+        self.active = set()
+        self._lock = threading.Lock()
+
+    def add(self, name, seconds, count=1):
+        with self._lock:
+            self.seconds[name] = self.seconds.get(name, 0.0) + seconds
+            self.counts[name] = self.counts.get(name, 0) + count
+
+    def begin(self, name):
+        """Mark `name` as being timed; False if it already is."""
+        with self._lock:
+            if name in self.active:
+                return False
+            self.active.add(name)
+            return True
+
+    def end(self, name, seconds):
+        """Finish timing `name` (see begin) and add the time spent."""
+        with self._lock:
+            self.active.discard(name)
+            self.seconds[name] = self.seconds.get(name, 0.0) + seconds
+            self.counts[name] = self.counts.get(name, 0) + 1
+
+    def server_timing(self):
+        """The Server-Timing header value (durations in milliseconds)."""
+        entries = []
+        with self._lock:
+            seconds_by_phase = dict(self.seconds)
+        for name, seconds in seconds_by_phase.items():
+            if not self.counts[name]:
+                continue
+            entry = f"{name};dur={seconds * 1000:.1f}"
+            if name == "db":
+                entry += f';desc="{self.counts[name]} queries"'
+            entries.append(entry)
+        entries.append(f"total;dur={self.total * 1000:.1f}")
+        return ", ".join(entries)
+
+
+def current():
+    """The RequestTimings of the request being handled, or None."""
+    return _current.get()
+
+
+@contextmanager
+def collect():
+    """Make a new RequestTimings current for the duration of the block."""
+    timings = RequestTimings()
+    token = _current.set(timings)
+    try:
+        yield timings
+    finally:
+        _current.reset(token)
+
+
+@contextmanager
+def timed(name):
+    """
+    Add the time spent in the block to the current request's `name` phase.
+
+    Nested blocks for the same phase count once, so a serializer that
+    contains another isn't timed twice.
+    """
+    timings = _current.get()
+    if timings is None or not timings.begin(name):
+        yield
+        return
+    start = perf_counter()
+    try:
+        yield
+    finally:
+        timings.end(name, perf_counter() - start)
+
+
+class Histogram:
+    """A Prometheus histogram: cumulative bucket counts, a sum and a count."""
+
+    def __init__(self, buckets):
+        self.buckets = list(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # the last one is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def lines(self, name, labels):
+        cumulative = 0
+        bounds = [*(f"{bound:g}" for bound in self.buckets), "+Inf"]
+        for bound, count in zip(bounds, self.counts):
+            cumulative += count
+            yield f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}'
+        yield f"{name}_sum{{{labels}}} {self.sum:.6f}"
+        yield f"{name}_count{{{labels}}} {self.count}"
+
+
+class MetricsRegistry:
+    """Request histograms per view name (and phase), shared by all threads."""
+
+    def __init__(self, config=None):
+        self.config = config or get_request_metrics_settings()
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.durations = {}
+            self.phases = {}
+            self.queries = {}
+
+    def _histogram(self, histograms, key, buckets):
+        histogram = histograms.get(key)
+        if histogram is None:
+            histogram = histograms[key] = Histogram(buckets)
+        return histogram
+
+    def observe(self, view, method, status_code, timings):
+        """Fold one finished request into the histograms."""
+        latency_buckets = self.config["LATENCY_BUCKETS"]
+        with self._lock:
+            self._histogram(
+                self.durations, (view, method, str(status_code)), latency_buckets
+            ).observe(timings.total)
+            for phase in PHASES:
+                self._histogram(self.phases, (view, phase), latency_buckets).observe(
+                    timings.seconds[phase]
+                )
+            self._histogram(
+                self.queries, view, self.config["QUERY_BUCKETS"]
+            ).observe(timings.counts["db"])
+
+    def render(self):
+        """All histograms in the Prometheus text exposition format."""
+        lines = []
+        with self._lock:
+            lines += [
+                "# HELP library_request_duration_seconds Time to handle a request.",
+                "# TYPE library_request_duration_seconds histogram",
+            ]
+            for (view, method, status_code), histogram in sorted(
+                self.durations.items()
+            ):
+                labels = (
+                    f'view="{_escape(view)}",method="{method}",'
+                    f'status="{status_code}"'
+                )
+                lines += histogram.lines("library_request_duration_seconds", labels)
+
+            lines += [
+                "# HELP library_request_phase_seconds Time spent per request in "
+                "SQL, metadata provider calls, serialization, rendering and auth.",
+                "# TYPE library_request_phase_seconds histogram",
+            ]
+            for (view, phase), histogram in sorted(self.phases.items()):
+                labels = f'view="{_escape(view)}",phase="{phase}"'
+                lines += histogram.lines("library_request_phase_seconds", labels)
+
+            lines += [
+                "# HELP library_request_queries SQL queries per request.",
+                "# TYPE library_request_queries histogram",
+            ]
+            for view, histogram in sorted(self.queries.items()):
+                lines += histogram.lines(
+                    "library_request_queries", f'view="{_escape(view)}"'
+                )
+        return "\n".join(lines) + "\n"
+
+
+def _escape(value):
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+registry = MetricsRegistry()
@@ -0,0 +1,272 @@
+"""
+Streaming restore of a library export (see services/export.py).
+
+Rows are parsed from the file one at a time and written in batches with
+COPY, a transaction per batch. Bookshelves, categories and series are
+looked up by name in maps loaded once up front (missing ones are created
+as they come up), and the exported metadata is trusted, so a restore
+makes no Google Books calls.
+
+Rows go straight from the file to COPY as plain values. Building Book
+instances and compiling bulk_create INSERTs took more time than Postgres
+spent storing the rows.
+"""
+
+import csv
+import io
+import json
+
+from django.conf import settings
+from django.db import connection, transaction
+
+from ..models import Book, Bookshelf, Category, Series
+from .bulk_import import is_valid_isbn
+from .library_version import bump_version
+from .metadata_cache import normalize_isbn
+
+DEFAULT_BATCH_SIZE = 2000
+DEFAULT_BOOKSHELF = "Restored"
+# Errors reported back, at most; the rest are only counted
+MAX_REPORTED_ERRORS = 100
+
+_TEXT_FIELDS = [
+    "title",
+    "subtitle",
+    "author",
+    "small_thumbnail",
+    "large_thumbnail",
+    "details",
+]
+_NULLABLE_FIELDS = ["subtitle", "small_thumbnail", "large_thumbnail", "details"]
+# Book columns written by COPY, in the order _book_row returns them
+_COPY_FIELDS = [
+    "isbn",
+    *_TEXT_FIELDS,
+    "bookshelf_id",
+    "user_id",
+    "category_id",
+    "series_id",
+    "volume_number",
+    "sort_key_text",
+    "enrichment_status",
+]
+
+_MAX_LENGTHS = {
+    field: Book._meta.get_field(field).max_length or float("inf")
+    for field in _TEXT_FIELDS
+}
+_DEFAULTS = {field: Book._meta.get_field(field).default for field in ["title", "author"]}
+
+
+class RestoreError(ValueError):
+    """Raised for a row that can't be restored."""
+
+
+def ndjson_rows(lines):
+    """
+    Parse NDJSON lines (bytes or str) into dicts.
+
+    Blank lines come through as None, so row numbers match line numbers.
+    """
+    for line in lines:
+        line = line.strip()
+        if not line:
+            yield None
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError:
+            row = RestoreError("Invalid JSON.")
+        if not isinstance(row, (dict, RestoreError)):
+            row = RestoreError("Each line must be a JSON object.")
+        yield row
+
+
+def csv_rows(lines):
+    """Parse CSV lines (bytes or str) with a header row into dicts."""
+    decoded = (
+        line.decode("utf-8-sig") if isinstance(line, bytes) else line for line in lines
+    )
+    yield from csv.DictReader(decoded)
+
+
+class _NameMap:
+    """Name -> instance map for one of the user's related models, loaded once."""
+
+    def __init__(self, user, model, name_field):
+        self.user = user
+        self.model = model
+        self.name_field = name_field
+        self.created = 0
+        self.by_name = {}
+        # Newest first, so for duplicate names the oldest row wins
+        for instance in model.objects.filter(user=user).order_by("-id"):
+            self.by_name[getattr(instance, name_field)] = instance
+
+    def get(self, name):
+        name = str(name or "").strip()
+        if not name:
+            return None
+        instance = self.by_name.get(name)
+        if instance is None:
+            max_length = self.model._meta.get_field(self.name_field).max_length
+            if len(name) > max_length:
+                raise RestoreError(
+                    f"{self.model._meta.verbose_name} {self.name_field} is longer "
+                    f"than {max_length} characters."
+                )
+            instance = self.model.objects.create(user=self.user, **{self.name_field: name})
+            self.by_name[name] = instance
+            self.created += 1
+        return instance
+
+
+def restore_library(user, rows, skip_existing=True, batch_size=None):
+    """
+    Restore exported books into a user's library.
+
+    Args:
+        user (User): Owner of the restored books
+        rows (iterable): Row dicts keyed by export.EXPORT_FIELDS (e.g.
+            from ndjson_rows or csv_rows). None entries (blank lines) are
+            skipped; RestoreError entries are reported as errors.
+        skip_existing (bool): Skip ISBNs already in the library before the
+            restore started. Repeats within the file are all restored.
+        batch_size (int, optional): Books per COPY and transaction
+
+    Returns:
+        dict: Counts of "created" and "skipped" books and of "errors",
+        the first few errors with their row numbers, and how many
+        bookshelves, categories and series had to be created.
+    """
+    batch_size = batch_size or getattr(
+        settings, "RESTORE_BATCH_SIZE", DEFAULT_BATCH_SIZE
+    )
+    bookshelves = _NameMap(user, Bookshelf, "name")
+    categories = _NameMap(user, Category, "name")
+    series = _NameMap(user, Series, "title")
+    existing = (
+        set(Book.objects.filter(user=user).values_list("isbn", flat=True))
+        if skip_existing
+        else set()
+    )
+
+    report = {"created": 0, "skipped": 0, "errors": 0, "error_details": []}
+    batch = []
+
+    def flush():
+        with transaction.atomic():
+            _copy_books(batch)
+            # COPY doesn't send post_save
+            bump_version(user.id)
+        report["created"] += len(batch)
+        batch.clear()
+
+    for number, row in enumerate(rows, start=1):
+        if row is None:
+            continue
+        try:
+            if isinstance(row, RestoreError):
+                raise row
+            values = _book_row(user, row, bookshelves, categories, series)
+        except RestoreError as e:
+            report["errors"] += 1
+            if len(report["error_details"]) < MAX_REPORTED_ERRORS:
+                report["error_details"].append({"row": number, "error": str(e)})
+            continue
+
+        if values[0] in existing:
+            report["skipped"] += 1
+            continue
+        batch.append(values)
+        if len(batch) >= batch_size:
+            flush()
+
+    if batch:
+        flush()
+
+    report["bookshelves_created"] = bookshelves.created
+    report["categories_created"] = categories.created
+    report["series_created"] = series.created
+    return report
+
+
+def _book_row(user, row, bookshelves, categories, series):
+    """Validate an export row and return its Book column values (see _COPY_FIELDS)."""
+    isbn = normalize_isbn(row.get("isbn"))
+    if not is_valid_isbn(isbn):
+        raise RestoreError(f"Invalid ISBN {row.get('isbn')!r}.")
+
+    volume_number = row.get("volume_number")
+    if volume_number in (None, ""):
+        volume_number = None
+    else:
+        try:
+            volume_number = int(volume_number)
+        except (TypeError, ValueError):
+            raise RestoreError(f"Invalid volume number {volume_number!r}.")
+        if volume_number < 0:
+            raise RestoreError(f"Invalid volume number {volume_number!r}.")
+
+    text = {}
+    for field in _TEXT_FIELDS:
+        value = row.get(field)
+        value = str(value) if value is not None else ""
+        if "\x00" in value:
+            raise RestoreError(f"{field} contains a NUL character.")
+        if len(value) > _MAX_LENGTHS[field]:
+            raise RestoreError(
+                f"{field} is longer than {_MAX_LENGTHS[field]} characters."
+            )
+        if value.strip():
+            text[field] = value
+        elif field in _NULLABLE_FIELDS:
+            text[field] = None
+        else:
+            text[field] = _DEFAULTS[field]
+
+    bookshelf = bookshelves.get(row.get("bookshelf")) or bookshelves.get(
+        DEFAULT_BOOKSHELF
+    )
+    category = categories.get(row.get("category"))
+    series_row = series.get(row.get("series"))
+    sort_key = Book.build_sort_key(
+        category.name if category else None,
+        text["author"],
+        series_row.title if series_row else None,
+        volume_number,
+        text["title"],
+    )
+    return (
+        isbn,
+        *(text[field] for field in _TEXT_FIELDS),
+        bookshelf.id,
+        user.id,
+        category.id if category else None,
+        series_row.id if series_row else None,
+        volume_number,
+        Book.encode_sort_key(sort_key),
+        Book.EnrichmentStatus.DONE.value,
+    )
+
+
+def _copy_books(rows):
+    """
+    Insert Book rows with COPY.
+
+    Uses COPY's CSV format, where an unquoted empty field is NULL. That's
+    how csv.writer writes None, and _book_row never returns an empty string.
+    """
+    data = io.StringIO()
+    csv.writer(data).writerows(rows)
+    data.seek(0)
+    columns = ", ".join(
+        connection.ops.quote_name(Book._meta.get_field(field).column)
+        for field in _COPY_FIELDS
+    )
+    table = connection.ops.quote_name(Book._meta.db_table)
+    with connection.cursor() as cursor:
+        # psycopg2's COPY API, on the raw cursor Django wraps
+        cursor.cursor.copy_expert(
+            f"COPY {table} ({columns}) FROM STDIN WITH (FORMAT csv)", data
+        )
@@ -0,0 +1,73 @@
+"""
+Catalogue search over a user's books.
+
+Combines Postgres full-text search on the generated Book.search_vector
+column with pg_trgm word similarity on title and author, so both exact
+terms ("dune messiah") and typos ("tolkein") find matches. Every condition
+can use a GIN index.
+"""
+
+from django.conf import settings
+from django.contrib.postgres.search import (
+    SearchQuery,
+    SearchRank,
+    TrigramWordSimilarity,
+)
+from django.db import connection, transaction
+from django.db.models import F, Q
+from django.db.models.functions import Greatest
+
+# Default search configuration, overridable via settings.BOOK_SEARCH
+DEFAULT_SEARCH_SETTINGS = {
+    "MAX_RESULTS": 100,
+    # pg_trgm's default (0.6) misses single-typo author and title matches
+    "WORD_SIMILARITY_THRESHOLD": 0.4,
+}
+
+
+def get_search_settings():
+    return {**DEFAULT_SEARCH_SETTINGS, **getattr(settings, "BOOK_SEARCH", {})}
+
+
+def search_books(queryset, query, limit=None):
+    """
+    Return books from queryset matching query, best matches first.
+
+    Args:
+        queryset (QuerySet): Books to search, e.g. the current user's library
+        query (str): Free text, in web search syntax ("quoted phrases", -exclusions)
+        limit (int, optional): Maximum number of results
+
+    Returns:
+        list: Matching Book instances, annotated with `rank` (full-text) and
+        `similarity` (trigram)
+    """
+    config = get_search_settings()
+    limit = min(limit or config["MAX_RESULTS"], config["MAX_RESULTS"])
+
+    search_query = SearchQuery(query, config="english", search_type="websearch")
+    results = (
+        queryset.filter(
+            Q(search_vector=search_query)
+            | Q(title__trigram_word_similar=query)
+            | Q(author__trigram_word_similar=query)
+        )
+        .annotate(
+            rank=SearchRank(F("search_vector"), search_query),
+            similarity=Greatest(
+                TrigramWordSimilarity(query, "title"),
+                TrigramWordSimilarity(query, "author"),
+            ),
+        )
+        .order_by("-rank", "-similarity", "sort_key_text", "id")[:limit]
+    )
+
+    # The threshold for the index-backed %> operator is a session setting;
+    # SET LOCAL scopes it to this transaction
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SET LOCAL pg_trgm.word_similarity_threshold = %s",
+                [config["WORD_SIMILARITY_THRESHOLD"]],
+            )
+        return list(results)
@@ -0,0 +1,93 @@
+"""
+Request coalescing ("single flight") for duplicate concurrent calls.
+
+When several callers ask for the same key at once, only the first runs the
+function; the others wait for and share its result (or exception).
+"""
+
+import asyncio
+import threading
+import weakref
+from contextlib import contextmanager
+
+from django.db import connection
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls that share a key.
+
+    do() works across the threads of a process; ado() across the tasks of
+    an event loop. Nothing is remembered once a call finishes, so this is
+    not a cache: a caller arriving after the first call returned starts a
+    new one.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        # In-flight tasks, per event loop
+        self._tasks = weakref.WeakKeyDictionary()
+
+    def do(self, key, fn):
+        """Run fn() for key, or wait for the call already running for it."""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    async def ado(self, key, fn):
+        """Async do(): await fn() for key, or the call already running for it."""
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            tasks = self._tasks.setdefault(loop, {})
+        task = tasks.get(key)
+        if task is None:
+            task = tasks[key] = asyncio.ensure_future(fn())
+            task.add_done_callback(lambda _: tasks.pop(key, None))
+        # A cancelled caller mustn't cancel the call the others are waiting on
+        return await asyncio.shield(task)
+
+
+@contextmanager
+def advisory_lock(name):
+    """
+    Hold a PostgreSQL session-level advisory lock for the duration of the block.
+
+    Lets processes that share the database coalesce work too: whoever gets
+    the lock does the work, the rest wait and then find its result.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT pg_advisory_lock(hashtextextended(%s, 0))", [name])
+    try:
+        yield
+    finally:
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT pg_advisory_unlock(hashtextextended(%s, 0))", [name]
+            )
@@ -0,0 +1,113 @@
+"""
+Per-process cache of authenticated users.
+
+CookieJWTAuthentication would otherwise load the User row on every
+request. Entries are keyed by user ID and token ID and live for a few
+seconds. Saving or deleting a user drops their entries in this process at
+once, so a password change or deactivation takes effect on the next
+request. Other processes notice within the TTL, as do writes that bypass
+save() (QuerySet.update).
+"""
+
+import copy
+import threading
+from collections import defaultdict
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db.models.signals import post_delete, post_save
+
+from .metadata_cache import LRUCache
+
+# Default configuration, overridable via settings.AUTH_USER_CACHE
+DEFAULT_USER_CACHE_SETTINGS = {
+    "MAX_ENTRIES": 1024,
+    "TTL": 30,  # seconds; 0 disables the cache
+}
+
+
+def get_user_cache_settings():
+    """Return the user cache configuration merged over the defaults."""
+    return {**DEFAULT_USER_CACHE_SETTINGS, **getattr(settings, "AUTH_USER_CACHE", {})}
+
+
+class UserCache:
+    """
+    LRU of authenticated users keyed by (user ID, token ID).
+
+    Each user has a generation number, bumped by invalidate(). Entries
+    remember the generation they were loaded under and are ignored once
+    it moves on, so invalidating a user is O(1) however many of their
+    tokens are cached.
+    """
+
+    def __init__(self, config=None):
+        self.config = config or get_user_cache_settings()
+        self.entries = LRUCache(self.config["MAX_ENTRIES"])
+        self._generations = defaultdict(int)
+        self._lock = threading.Lock()
+        self.reset_stats()
+
+    def reset_stats(self):
+        with self._lock:
+            self.hits = 0
+            self.misses = 0
+            self.invalidations = 0
+
+    def stats(self):
+        """Return hit/miss counters."""
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "invalidations": self.invalidations,
+            "evictions": self.entries.evictions,
+            "entries": len(self.entries),
+        }
+
+    def get_user(self, user_id, token_id, load):
+        """
+        Return the user for a validated token, calling load() on a miss.
+
+        load() must do the full user checks (exists, is active, ...) and
+        raise if they fail; failures aren't cached. Each caller gets its
+        own copy of the user, so request code can't change a cached one.
+        """
+        # Token claims may carry the ID as a string
+        user_id = str(user_id)
+        key = (user_id, token_id)
+        # Read before loading: if the user is invalidated while load() runs,
+        # the entry is stored under the old generation and never served
+        generation = self._generations.get(user_id, 0)
+        entry = self.entries.get(key)
+        if entry is not None and entry[0] == generation:
+            with self._lock:
+                self.hits += 1
+            return copy.copy(entry[1])
+
+        with self._lock:
+            self.misses += 1
+        user = load()
+        self.entries.set(key, (generation, user), self.config["TTL"])
+        return copy.copy(user)
+
+    def invalidate(self, user_id):
+        """Forget every cached token of a user."""
+        with self._lock:
+            self._generations[str(user_id)] += 1
+            self.invalidations += 1
+
+    def clear(self):
+        self.entries.clear()
+
+
+user_cache = UserCache()
+
+
+def _invalidate_user(sender, instance, **kwargs):
+    user_cache.invalidate(instance.pk)
+
+
+# Connected when the cache is first imported, which is before it can hold
+# any entries
+post_save.connect(_invalidate_user, sender=get_user_model())
+post_delete.connect(_invalidate_user, sender=get_user_model())
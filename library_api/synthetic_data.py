@@ -0,0 +1,154 @@
+"""
+Synthetic libraries for load tests and benchmarks.
+
+Generates users whose libraries look like real ones: a few shelves, a
+handful of categories, series with consecutive volumes, authors with a
+long-tail distribution (a few with dozens of books, most with one or
+two), descriptions of varying length and Google Books thumbnail URLs.
+Books are written through services.restore (COPY), so millions of rows
+take minutes rather than hours. Output is deterministic for a given seed.
+"""
+
+import random
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+
+from .services.restore import restore_library
+
+FIRST_NAMES = (
+    "Ada, Alan, Ann, Arthur, Beatrix, Carl, Clarice, Daniel, Doris, Edith, "
+    "Frank, George, Grace, Harper, Isaac, Jane, Jorge, Kazuo, Leo, "
+    "Margaret, Mary, Neil, Octavia, Philip, Rachel, Ray, Sally, Terry, "
+    "Toni, Ursula, Virginia, Zadie"
+).split(", ")
+LAST_NAMES = (
+    "Adams, Asimov, Atwood, Austen, Bradbury, Butler, Carver, Christie, "
+    "Dickens, Eliot, Gaiman, Herbert, Hurston, Ishiguro, Jemisin, Le Guin, "
+    "Lessing, Morrison, Munro, Nabokov, Orwell, Pratchett, Rooney, "
+    "Rushdie, Shelley, Smith, Tolkien, Twain, Vonnegut, Walker, Woolf, "
+    "Zafón"
+).split(", ")
+TITLE_WORDS = (
+    "Ancient, Autumn, Blue, Broken, City, Dark, Dream, Empire, Fire, "
+    "Garden, Glass, Gods, House, Iron, Kingdom, Last, Light, Lost, "
+    "Machine, Moon, Night, Ocean, Quiet, River, Road, Salt, Shadow, "
+    "Silent, Stars, Stone, Storm, Summer, Time, Tower, Water, Wind, "
+    "Winter, Wolf, World, Years"
+).split(", ")
+CATEGORY_NAMES = (
+    "Fiction, Science Fiction, Fantasy, Mystery, History, Biography, "
+    "Science, Poetry, Philosophy, Travel, Cooking, Art, Children, Horror, "
+    "Romance"
+).split(", ")
+SHELF_NAMES = (
+    "Living Room, Bedroom, Office, Hallway, Attic, Kids' Room, Study, "
+    "Basement, To Read, Lent Out"
+).split(", ")
+LOREM = (
+    "A sweeping story of ambition and loss across three generations, told "
+    "with wit and unflinching honesty. Critics have called it a landmark of "
+    "the form, and readers return to it again and again. "
+)
+
+
+def isbn13(number):
+    """Return a valid ISBN-13 (978 prefix) for a number below 10**9."""
+    digits = f"978{number:09d}"
+    total = sum(int(d) * (3 if i % 2 else 1) for i, d in enumerate(digits))
+    return digits + str((10 - total % 10) % 10)
+
+
+def _title(rng):
+    words = rng.sample(TITLE_WORDS, rng.randint(1, 4))
+    title = " ".join(words)
+    return f"The {title}" if rng.random() < 0.3 else title
+
+
+def library_rows(rng, size, first_isbn=0):
+    """
+    Yield `size` export rows (see services.export.EXPORT_FIELDS) for one
+    synthetic library.
+
+    Args:
+        rng (random.Random): Source of randomness
+        size (int): Number of books
+        first_isbn (int): Number the library's ISBNs start from, so
+            libraries don't share ISBNs unless they should
+    """
+    shelves = SHELF_NAMES[: rng.randint(3, len(SHELF_NAMES))]
+    categories = CATEGORY_NAMES[: rng.randint(5, len(CATEGORY_NAMES))]
+    authors = [
+        f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}"
+        for _ in range(max(size // 3, 1))
+    ]
+    series = [
+        {"title": f"The {_title(rng)} Saga", "next_volume": 1}
+        for _ in range(max(size // 40, 1))
+    ]
+
+    for i in range(size):
+        # Pareto-distributed index: a few prolific authors, a long tail
+        author = authors[min(int(rng.paretovariate(1.2)) - 1, len(authors) - 1)]
+        book_series = rng.choice(series) if rng.random() < 0.25 else None
+        volume_number = None
+        if book_series is not None:
+            volume_number = book_series["next_volume"]
+            book_series["next_volume"] += 1
+        isbn = isbn13(first_isbn + i)
+        volume_id = f"{first_isbn + i:x}"
+        yield {
+            "isbn": isbn,
+            "title": _title(rng),
+            "subtitle": "A Novel" if rng.random() < 0.2 else None,
+            "author": author,
+            "small_thumbnail": (
+                f"http://books.google.com/books/content?id={volume_id}"
+                "&printsec=frontcover&img=1&zoom=5&source=gbs_api"
+            ),
+            "large_thumbnail": (
+                f"http://books.google.com/books/content?id={volume_id}"
+                "&printsec=frontcover&img=1&zoom=1&source=gbs_api"
+            ),
+            "details": LOREM * rng.randint(1, 12),
+            "bookshelf": rng.choice(shelves),
+            "category": rng.choice(categories) if rng.random() < 0.8 else None,
+            "series": book_series["title"] if book_series else None,
+            "volume_number": volume_number,
+        }
+
+
+def generate_libraries(
+    users, books_per_user, prefix="loadtest", password="loadtest", seed=0
+):
+    """
+    Create (or top up) `users` synthetic users with a library each.
+
+    Users are named "<prefix>-<n>". Library sizes vary around
+    books_per_user (from half to one and a half times it). Re-running
+    with the same arguments creates nothing new: existing ISBNs are
+    skipped.
+
+    Returns:
+        dict: Users and books created, keyed "users_created" and
+        "books_created", plus "usernames"
+    """
+    rng = random.Random(seed)
+    password_hash = make_password(password)
+    report = {"users_created": 0, "books_created": 0, "usernames": []}
+
+    for n in range(users):
+        username = f"{prefix}-{n}"
+        user, created = User.objects.get_or_create(
+            username=username, defaults={"password": password_hash}
+        )
+        report["users_created"] += created
+        report["usernames"].append(username)
+
+        size = rng.randint(books_per_user // 2, books_per_user * 3 // 2)
+        # Each user's ISBNs come from a separate range
+        first_isbn = n * books_per_user * 2
+        library_rng = random.Random(f"{seed}-{n}")
+        result = restore_library(user, library_rows(library_rng, size, first_isbn))
+        report["books_created"] += result["created"]
+    return report
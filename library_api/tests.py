@@ -1,3 +1,2606 @@
-from django.test import TestCase
+import asyncio
+import contextvars
+import csv
+import gc
+import gzip
+import io
+import json
+import re
+import tempfile
+import threading
+import time
+import warnings
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import async_to_sync, sync_to_async
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+
+from . import synthetic_data
+from .books_api_stub import BooksAPIStub
+from .models import (
+    Book,
+    BookMetadata,
+    Bookshelf,
+    Category,
+    CoverImage,
+    EnrichmentJob,
+    LibraryStat,
+    Series,
+)
+from .serializers import (
+    BookDetailSerializer,
+    BookListSerializer,
+    BookRowSerializer,
+    BookSerializer,
+)
+from .services import (
+    async_google_books,
+    covers,
+    enrichment,
+    export,
+    google_books,
+    library_stats,
+    metadata_providers,
+    metadata_snapshots,
+    request_metrics,
+    restore,
+)
+from .services.async_google_books import (
+    afetch_book_data,
+    close_session,
+    get_session,
+)
+from .services.circuit_breaker import CircuitBreaker, CircuitOpenError
+from .services.isbn_store import isbn_store
+from .services.metadata_cache import (
+    DEFAULT_CACHE_SETTINGS,
+    LRUCache,
+    MetadataCache,
+    metadata_cache,
+    normalize_isbn,
+)
+from .services.user_cache import user_cache
+from .views import BookViewSet
+
+
+def create_library(user, size):
+    """Create `size` books for user, spread over a few shelves, categories and series."""
+    bookshelves = [
+        Bookshelf.objects.create(name=f"Shelf {i}", user=user) for i in range(3)
+    ]
+    categories = [
+        Category.objects.create(name=f"Category {i}", user=user) for i in range(3)
+    ]
+    series = [Series.objects.create(title=f"Series {i}", user=user) for i in range(3)]
+
+    for i in range(size):
+        Book.objects.create(
+            isbn=f"{9780000000000 + i}",
+            title=f"Book {i}",
+            author=f"Author {i % 7}",
+            bookshelf=bookshelves[i % 3],
+            user=user,
+            # Leave some books without a category or series to cover the null joins
+            category=categories[i % 3] if i % 4 else None,
+            series=series[i % 3] if i % 2 else None,
+            volume_number=i if i % 2 else None,
+        )
+    return bookshelves
+
+
+class MetadataCacheTests(TestCase):
+    def cache(self, **config):
+        return MetadataCache({**DEFAULT_CACHE_SETTINGS, **config})
+
+    def test_normalize_isbn(self):
+        self.assertEqual(normalize_isbn("978-0-14-044913-6"), "9780140449136")
+        self.assertEqual(normalize_isbn(" 0 306 40615 x "), "030640615X")
+        self.assertEqual(normalize_isbn(None), "")
+
+    def test_lru_evicts_least_recently_used_first(self):
+        lru = LRUCache(2)
+        lru.set("a", 1, ttl=60)
+        lru.set("b", 2, ttl=60)
+        lru.get("a")  # "b" is now the least recently used
+        lru.set("c", 3, ttl=60)
+
+        self.assertEqual((lru.get("a"), lru.get("b"), lru.get("c")), (1, None, 3))
+        self.assertEqual((len(lru), lru.evictions), (2, 1))
+
+    def test_memory_entries_expire(self):
+        cache = self.cache(USE_DB=False, TTL=60, NEGATIVE_TTL=5)
+        cache.set("9780441172719", {"title": "Dune"})
+        cache.set("9781111111111", {})
+        now = time.monotonic()
+        with mock.patch(
+            "library_api.services.metadata_cache.monotonic", return_value=now + 10
+        ):
+            # "Not found" expires sooner than a found result
+            self.assertEqual(cache.get("9780441172719"), {"title": "Dune"})
+            self.assertIsNone(cache.get("9781111111111"))
+        with mock.patch(
+            "library_api.services.metadata_cache.monotonic", return_value=now + 61
+        ):
+            self.assertIsNone(cache.get("9780441172719"))
+
+    def test_database_tier_outlives_memory_and_expires(self):
+        cache = self.cache(DB_TTL=60, DB_NEGATIVE_TTL=60)
+        cache.set("9780441172719", {"title": "Dune"})
+        cache.set("9781111111111", {})
+        cache.clear()
+
+        self.assertEqual(cache.get("9780441172719"), {"title": "Dune"})
+        # Not found is cached as an empty dict, not a miss
+        self.assertEqual(cache.get("9781111111111"), {})
+
+        cache.clear()
+        BookMetadata.objects.update(fetched_at=timezone.now() - timedelta(minutes=2))
+        self.assertIsNone(cache.get("9780441172719"))
+        self.assertIsNone(cache.get("9781111111111"))
+        # Expired rows are still served when the API can't be reached
+        self.assertEqual(cache.get_stale("9780441172719"), {"title": "Dune"})
+
+    def test_counters(self):
+        cache = self.cache()
+        cache.get("9780441172719")
+        cache.set("9780441172719", {"title": "Dune"})
+        cache.get("9780441172719")
+        cache.clear()
+        cache.get("9780441172719")
+        cache.get("9780441172719")
+
+        stats = cache.stats()
+        self.assertEqual(
+            (stats["memory_hits"], stats["db_hits"], stats["misses"]), (2, 1, 1)
+        )
+        cache.reset_stats()
+        self.assertEqual(cache.stats()["misses"], 0)
+
+
+class QueryCountTests(TestCase):
+    """
+    Listing and retrieving must cost a constant number of queries however
+    large the library is. Authentication is forced so only the endpoint's
+    own queries are counted: the library version (for the ETag), then the
+    data itself.
+    """
+
+    library_sizes = [0, 1, 10, 50]
+
+    def setUp(self):
+        self.user = User.objects.create_user(username="reader", password="pw")
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+
+    def assertQueriesForSizes(self, url_for_library, expected):
+        for size in self.library_sizes:
+            with self.subTest(size=size):
+                Book.objects.all().delete()
+                Bookshelf.objects.all().delete()
+                Category.objects.all().delete()
+                Series.objects.all().delete()
+                bookshelves = create_library(self.user, size)
+
+                url = url_for_library(bookshelves)
+                with self.assertNumQueries(expected):
+                    response = self.client.get(url)
+                self.assertEqual(response.status_code, 200)
+
+    def test_book_list(self):
+        self.assertQueriesForSizes(lambda shelves: "/api/books/", 2)
+
+    def test_book_list_filtered_by_bookshelf(self):
+        self.assertQueriesForSizes(
+            lambda shelves: f"/api/books/?bookshelf={shelves[0].id}", 2
+        )
+
+    def test_book_list_sort_key_uses_no_extra_queries(self):
+        create_library(self.user, 20)
+        with self.assertNumQueries(2):
+            response = self.client.get("/api/books/?fields=id,sort_key")
+        self.assertEqual(len(response.data), 20)
+        self.assertTrue(all(book["sort_key"] for book in response.data))
+
+    def test_book_retrieve(self):
+        def book_url(shelves):
+            book = Book.objects.filter(user=self.user).first()
+            if book is None:
+                book = Book.objects.create(
+                    isbn="9780000000000", bookshelf=shelves[0], user=self.user
+                )
+            # google_data comes from the stored snapshot, not a lookup
+            Book.objects.filter(id=book.id).update(
+                **metadata_snapshots.snapshot_fields({})
+            )
+            return f"/api/books/{book.id}/"
+
+        self.assertQueriesForSizes(book_url, 2)
+
+    def test_bookshelf_list(self):
+        self.assertQueriesForSizes(lambda shelves: "/api/bookshelves/", 2)
+
+    def test_category_list(self):
+        self.assertQueriesForSizes(lambda shelves: "/api/categories/", 2)
+
+    def test_series_list(self):
+        self.assertQueriesForSizes(lambda shelves: "/api/series/", 2)
+
+    def test_bookshelf_retrieve(self):
+        self.assertQueriesForSizes(
+            lambda shelves: f"/api/bookshelves/{shelves[0].id}/", 2
+        )
+
+
+class SortKeyTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="reader", password="pw")
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+        create_library(self.user, 30)
+
+    def assertListedInSortKeyOrder(self):
+        response = self.client.get("/api/books/")
+        listed = [book["id"] for book in response.data]
+        books = Book.objects.filter(user=self.user).select_related("category", "series")
+        expected = [book.id for book in sorted(books, key=lambda b: (b.sort_key, b.id))]
+        self.assertEqual(listed, expected)
+
+    def test_list_is_ordered_by_sort_key(self):
+        self.assertListedInSortKeyOrder()
+
+    def test_renaming_category_and_series_updates_order(self):
+        category = Category.objects.get(name="Category 0")
+        category.name = "ZZZ last"
+        category.save()
+        series = Series.objects.get(title="Series 2")
+        series.title = "AAA first"
+        series.save()
+        self.assertListedInSortKeyOrder()
+
+    def test_deleting_category_updates_order(self):
+        Category.objects.get(name="Category 2").delete()
+        self.assertListedInSortKeyOrder()
+
+    def test_cursor_pagination_walks_whole_list_in_order(self):
+        everything = [book["id"] for book in self.client.get("/api/books/").data]
+
+        paged = []
+        url = "/api/books/?page_size=7"
+        while url:
+            # Library version, then the page
+            with self.assertNumQueries(2):
+                response = self.client.get(url)
+            self.assertLessEqual(len(response.data["results"]), 7)
+            paged += [book["id"] for book in response.data["results"]]
+            url = response.data["next"]
+        self.assertEqual(paged, everything)
+
+
+    def test_cursor_pagination_through_equal_sort_keys_uses_no_offset(self):
+        # Books with no metadata yet all share one sort key
+        shelf = Bookshelf.objects.filter(user=self.user).first()
+        for i in range(10):
+            Book.objects.create(
+                isbn=f"{9781000000000 + i}", bookshelf=shelf, user=self.user
+            )
+        everything = [book["id"] for book in self.client.get("/api/books/").data]
+
+        pages = []
+        url = "/api/books/?page_size=3"
+        while url:
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(url)
+            self.assertFalse(any("OFFSET" in q["sql"] for q in queries), url)
+            pages.append([book["id"] for book in response.data["results"]])
+            url = response.data["next"]
+        self.assertEqual(sum(pages, []), everything)
+
+        # And back again from the last page
+        url = response.data["previous"]
+        for page in reversed(pages[:-1]):
+            response = self.client.get(url)
+            self.assertEqual([book["id"] for book in response.data["results"]], page)
+            url = response.data["previous"]
+        self.assertIsNone(url)
+
+class BookSearchTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="reader", password="pw")
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+        self.bookshelf = Bookshelf.objects.create(name="Living room", user=self.user)
+
+    def create_book(self, title, author="", details="", user=None):
+        user = user or self.user
+        bookshelf = (
+            self.bookshelf
+            if user == self.user
+            else Bookshelf.objects.create(name="Shelf", user=user)
+        )
+        return Book.objects.create(
+            isbn="9780441172719",
+            title=title,
+            author=author,
+            details=details,
+            bookshelf=bookshelf,
+            user=user,
+        )
+
+    def find(self, **params):
+        return self.client.get("/api/books/find/", params)
+
+    def found(self, **params):
+        response = self.find(**params)
+        self.assertEqual(response.status_code, 200)
+        return [book["id"] for book in response.data]
+
+    def test_title_matches_rank_above_description_matches(self):
+        mention = self.create_book("Arrakis", details="A guide to the world of Dune.")
+        title = self.create_book("Dune", author="Frank Herbert")
+        self.create_book("Neuromancer", author="William Gibson")
+
+        self.assertEqual(self.found(q="dune"), [title.id, mention.id])
+
+    def test_typos_match_through_trigram_similarity(self):
+        hobbit = self.create_book("The Hobbit", author="J. R. R. Tolkien")
+        self.create_book("Dune", author="Frank Herbert")
+
+        self.assertEqual(self.found(q="tolkein"), [hobbit.id])
+        self.assertEqual(self.found(q="hobit"), [hobbit.id])
+
+    def test_only_searches_the_users_books(self):
+        other = User.objects.create_user(username="other", password="pw")
+        self.create_book("Dune", user=other)
+        own = self.create_book("Dune Messiah")
+
+        self.assertEqual(self.found(q="dune"), [own.id])
+
+    def test_query_is_required(self):
+        for params in [{}, {"q": ""}, {"q": "   "}]:
+            self.assertEqual(self.find(**params).status_code, 400, params)
+
+    def test_limit(self):
+        for i in range(3):
+            self.create_book(f"Dune {i}")
+
+        self.assertEqual(len(self.found(q="dune")), 3)
+        self.assertEqual(len(self.found(q="dune", limit=2)), 2)
+        for limit in ["0", "-1", "two"]:
+            self.assertEqual(self.find(q="dune", limit=limit).status_code, 400, limit)
+
+
+class BulkImportTests(TestCase):
+    def setUp(self):
+        metadata_cache.clear()
+        google_books.breaker.reset()
+        self.user = User.objects.create_user(username="reader", password="pw")
+        self.bookshelf = Bookshelf.objects.create(name="Living room", user=self.user)
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+
+        self.stub = BooksAPIStub(
+            volumes={
+                "9780140449136": {"title": "Crime and Punishment", "authors": ["Fyodor Dostoevsky"]},
+                "9780441172719": {"title": "Dune", "authors": ["Frank Herbert"]},
+            }
+        ).start()
+        self.addCleanup(self.stub.stop)
+        settings_override = override_settings(GOOGLE_BOOKS_API_URL=self.stub.url)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def test_import_reports_each_isbn(self):
+        Book.objects.create(isbn="9780441172719", bookshelf=self.bookshelf, user=self.user)
+
+        response = self.client.post(
+            "/api/books/import/",
+            {
+                "bookshelf": self.bookshelf.id,
+                "isbns": ["978-0-14-044913-6", "9780140449136", "9780441172719", "9781111111111", "nope"],
+            },
+            format="json",
+        )
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data["created"], 2)
+        statuses = [(r["isbn"], r["status"], r.get("metadata")) for r in response.data["results"]]
+        self.assertEqual(
+            statuses,
+            [
+                ("9780140449136", "created", "found"),
+                ("9780140449136", "duplicate", None),
+                ("9780441172719", "exists", None),
+                ("9781111111111", "created", "not_found"),
+                ("nope", "invalid", None),
+            ],
+        )
+
+        book = Book.objects.get(id=response.data["results"][0]["book_id"])
+        self.assertEqual(book.author, "Dostoevsky, Fyodor")
+        self.assertEqual(book.bookshelf, self.bookshelf)
+        self.assertTrue(book.sort_key_text)
+
+        # The details are served from the snapshot taken on import
+        self.assertIsNotNone(book.metadata_fetched_at)
+        requests_made = self.stub.request_count
+        metadata_cache.clear()
+        BookMetadata.objects.all().delete()
+        response = self.client.get(f"/api/books/{book.id}/")
+        self.assertEqual(response.data["google_data"]["title"], "Crime and Punishment")
+        self.assertEqual(self.stub.request_count, requests_made)
+
+    def test_import_from_csv(self):
+        upload = SimpleUploadedFile(
+            "books.csv", b"title,isbn\nDune,9780441172719\nUnknown,9781111111111\n"
+        )
+        response = self.client.post(
+            "/api/books/import/",
+            {"bookshelf": self.bookshelf.id, "file": upload},
+            format="multipart",
+        )
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(
+            [r["isbn"] for r in response.data["results"]], ["9780441172719", "9781111111111"]
+        )
+
+    def test_cached_isbns_skip_the_api(self):
+        payload = {"bookshelf": self.bookshelf.id, "isbns": ["9780140449136"]}
+        self.client.post("/api/books/import/", payload, format="json")
+        requests_made = self.stub.request_count
+
+        Book.objects.all().delete()
+        self.client.post("/api/books/import/", payload, format="json")
+        self.assertEqual(self.stub.request_count, requests_made)
+
+    def test_rejects_other_users_bookshelf(self):
+        other = User.objects.create_user(username="other", password="pw")
+        shelf = Bookshelf.objects.create(name="Theirs", user=other)
+        response = self.client.post(
+            "/api/books/import/",
+            {"bookshelf": shelf.id, "isbns": ["9780140449136"]},
+            format="json",
+        )
+        self.assertEqual(response.status_code, 400)
+
+
+class EnrichmentQueueTests(TestCase):
+    def setUp(self):
+        metadata_cache.clear()
+        google_books.breaker.reset()
+        self.user = User.objects.create_user(username="reader", password="pw")
+        self.bookshelf = Bookshelf.objects.create(name="Living room", user=self.user)
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+
+        self.stub = BooksAPIStub(
+            volumes={"9780441172719": {"title": "Dune", "authors": ["Frank Herbert"]}}
+        ).start()
+        self.addCleanup(self.stub.stop)
+        settings_override = override_settings(GOOGLE_BOOKS_API_URL=self.stub.url)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def create_book(self, isbn):
+        response = self.client.post(
+            "/api/books/", {"isbn": isbn, "bookshelf": self.bookshelf.id}, format="json"
+        )
+        self.assertEqual(response.status_code, 201)
+        return response.data
+
+    def test_create_returns_pending_without_calling_the_api(self):
+        data = self.create_book("9780441172719")
+
+        self.assertEqual(data["enrichment_status"], "pending")
+        self.assertEqual(self.stub.request_count, 0)
+        self.assertTrue(EnrichmentJob.objects.filter(book_id=data["id"]).exists())
+
+    def test_worker_fills_in_pending_books(self):
+        found = self.create_book("9780441172719")["id"]
+        missing = self.create_book("9781111111111")["id"]
+
+        call_command("process_enrichment_queue", once=True, stdout=io.StringIO())
+
+        book = Book.objects.get(id=found)
+        self.assertEqual(book.enrichment_status, "done")
+        self.assertEqual((book.title, book.author), ("Dune", "Herbert, Frank"))
+        self.assertIn("Herbert, Frank", book.sort_key_text)
+        self.assertEqual(Book.objects.get(id=missing).enrichment_status, "done")
+        self.assertFalse(EnrichmentJob.objects.exists())
+
+    def test_cached_isbn_is_filled_in_on_create(self):
+        metadata_cache.set("9780441172719", {"title": "Dune", "authors": ["Frank Herbert"]})
+
+        data = self.create_book("9780441172719")
+
+        self.assertEqual(data["enrichment_status"], "done")
+        self.assertEqual(data["title"], "Dune")
+        self.assertFalse(EnrichmentJob.objects.exists())
+
+    @override_settings(BOOK_ENRICHMENT={"MAX_ATTEMPTS": 2, "BACKOFF": 60})
+    def test_failed_lookups_back_off_then_fail(self):
+        book_id = self.create_book("9780441172719")["id"]
+        self.stub.error_rate = 1.0
+
+        counts = enrichment.run_once()
+        self.assertEqual(counts["retried"], 1)
+        job = EnrichmentJob.objects.get(book_id=book_id)
+        self.assertEqual(job.attempts, 1)
+        self.assertGreater(job.run_after, timezone.now() + timedelta(seconds=29))
+        # Not due yet, so a second pass doesn't touch it
+        self.assertEqual(enrichment.run_once()["claimed"], 0)
+
+        EnrichmentJob.objects.update(run_after=timezone.now())
+        self.assertEqual(enrichment.run_once()["failed"], 1)
+        self.assertEqual(Book.objects.get(id=book_id).enrichment_status, "failed")
+
+        # Six failed attempts in a row opened the circuit breaker. Once the
+        # API is back and the breaker closed, re-queueing starts over
+        self.assertEqual(google_books.breaker.state, "open")
+        self.stub.error_rate = 0.0
+        google_books.breaker.reset()
+        response = self.client.post(f"/api/books/{book_id}/enrich/")
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.data["enrichment_status"], "pending")
+        self.assertEqual(enrichment.run_once()["done"], 1)
+        self.assertEqual(Book.objects.get(id=book_id).title, "Dune")
+
+
+class SingleFlightTests(TransactionTestCase):
+    """
+    Concurrent lookups of one ISBN must reach Google Books once. Each
+    lookup is two API requests (ISBN search, then volume detail).
+    """
+
+    callers = 10
+
+    def setUp(self):
+        metadata_cache.clear()
+        google_books.breaker.reset()
+        # Latency keeps the first lookup in flight while the others arrive
+        self.stub = BooksAPIStub(generate_missing=True, latency=0.2).start()
+        self.addCleanup(self.stub.stop)
+        settings_override = override_settings(GOOGLE_BOOKS_API_URL=self.stub.url)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def run_in_threads(self, fn, *args):
+        barrier = threading.Barrier(self.callers)
+
+        def call():
+            barrier.wait()
+            try:
+                return fn(*args)
+            finally:
+                connection.close()
+
+        with ThreadPoolExecutor(max_workers=self.callers) as pool:
+            futures = [pool.submit(call) for _ in range(self.callers)]
+            return [future.result() for future in futures]
+
+    def test_concurrent_threads_share_one_lookup(self):
+        results = self.run_in_threads(google_books.fetch_book_data, "9780441172719")
+
+        self.assertEqual(self.stub.request_count, 2)
+        self.assertEqual({result["title"] for result in results}, {"Book 9780441172719"})
+        self.assertEqual(BookMetadata.objects.filter(isbn="9780441172719").count(), 1)
+
+    @override_settings(GOOGLE_BOOKS_CLIENT={"RETRIES": 0})
+    def test_errors_are_shared_and_not_remembered(self):
+        self.stub.error_rate = 1.0
+
+        def lookup(isbn):
+            try:
+                return google_books.fetch_book_data(isbn)
+            except google_books.GoogleBooksUnavailable as e:
+                return e
+
+        results = self.run_in_threads(lookup, "9780441172719")
+        self.assertTrue(
+            all(isinstance(r, google_books.GoogleBooksUnavailable) for r in results)
+        )
+        self.assertEqual(self.stub.request_count, 1)
+
+        self.stub.error_rate = 0.0
+        self.assertTrue(google_books.fetch_book_data("9780441172719"))
+
+    def test_concurrent_tasks_share_one_lookup(self):
+        async def lookup_all():
+            try:
+                return await asyncio.gather(
+                    *(afetch_book_data("9780441172719") for _ in range(self.callers))
+                )
+            finally:
+                await close_session()
+
+        # async_to_sync rather than asyncio.run, so the cache's database
+        # access runs on this thread's connection
+        results = async_to_sync(lookup_all)()
+
+        self.assertEqual(self.stub.request_count, 2)
+        self.assertEqual(len({result["title"] for result in results}), 1)
+
+    @override_settings(GOOGLE_BOOKS_CROSS_PROCESS_LOCK=True)
+    def test_advisory_lock_coalesces_across_processes(self):
+        # Call the per-process lookup directly, so only the database lock
+        # (and not the in-process coalescing) keeps the callers apart
+        api_url, api_key = google_books.get_api_settings()
+
+        def lookup(isbn):
+            # Each caller stands in for a separate process with a cold LRU
+            metadata_cache.clear()
+            return google_books._lookup(isbn, api_url, api_key, True)
+
+        results = self.run_in_threads(lookup, "9780441172719")
+
+        self.assertEqual(self.stub.request_count, 2)
+        self.assertEqual(len({result["title"] for result in results}), 1)
+
+
+class AsyncViewTests(TestCase):
+    def setUp(self):
+        metadata_cache.clear()
+        google_books.breaker.reset()
+        self.user = User.objects.create_user(username="reader", password="pw")
+        self.bookshelf = Bookshelf.objects.create(name="Living room", user=self.user)
+        self.client.cookies["access_token"] = str(AccessToken.for_user(self.user))
+
+        self.stub = BooksAPIStub(
+            volumes={"9780441172719": {"title": "Dune", "authors": ["Frank Herbert"]}}
+        ).start()
+        self.addCleanup(self.stub.stop)
+        settings_override = override_settings(GOOGLE_BOOKS_API_URL=self.stub.url)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def create_book(self, isbn):
+        return self.client.post(
+            "/api/books/async/",
+            {"isbn": isbn, "bookshelf": self.bookshelf.id},
+            content_type="application/json",
+        )
+
+    def test_session_is_reused_until_closed(self):
+        async def sessions():
+            first = get_session()
+            second = get_session()
+            await close_session()
+            third = get_session()
+            await close_session()
+            return first, second, third
+
+        first, second, third = async_to_sync(sessions)()
+
+        self.assertIs(first, second)
+        self.assertTrue(first.closed)
+        self.assertIsNot(third, first)
+        self.assertTrue(third.closed)
+
+    def test_search(self):
+        response = self.client.get(
+            "/api/books/search/async/", {"isbn": "978-0-441-17271-9"}
+        )
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["title"], "Dune")
+
+    def test_sessions_are_closed_outside_asgi(self):
+        # Under WSGI (and this test client) every async view runs on an event
+        # loop of its own; a session left open on it leaks its connections
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter("always", ResourceWarning)
+            self.client.get("/api/books/search/async/", {"isbn": "9780441172719"})
+            self.assertEqual(self.create_book("9780441172719").status_code, 201)
+            # Finished loops can outlive the request; drop their sessions
+            # now rather than at some later collection
+            async_google_books._sessions.clear()
+            gc.collect()
+
+        leaked = [w for w in caught if issubclass(w.category, ResourceWarning)]
+        self.assertEqual(leaked, [])
+
+    def test_search_rejects_a_bad_isbn(self):
+        response = self.client.get("/api/books/search/async/", {"isbn": "12345"})
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.stub.request_count, 0)
+
+    def test_create(self):
+        response = self.create_book("9780441172719")
+
+        self.assertEqual(response.status_code, 201)
+        book = Book.objects.get(id=response.json()["id"])
+        self.assertEqual(book.user, self.user)
+        self.assertEqual(book.title, "Dune")
+        self.assertEqual(book.enrichment_status, Book.EnrichmentStatus.DONE)
+        self.assertIsNotNone(book.metadata_fetched_at)
+        self.assertEqual(
+            metadata_snapshots.decode(book.metadata_snapshot)["title"], "Dune"
+        )
+
+    def test_create_requires_a_token(self):
+        del self.client.cookies["access_token"]
+
+        response = self.create_book("9780441172719")
+
+        self.assertEqual(response.status_code, 401)
+        self.assertFalse(Book.objects.exists())
+
+    def test_create_rejects_a_bad_isbn(self):
+        response = self.create_book("not-an-isbn")
+
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("isbn", response.json())
+        self.assertEqual(self.stub.request_count, 0)
+
+    def test_create_is_pending_while_google_books_is_unavailable(self):
+        with mock.patch(
+            "library_api.async_views.afetch_book_data",
+            side_effect=google_books.GoogleBooksUnavailable("down"),
+        ):
+            response = self.create_book("9780441172719")
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()["enrichment_status"], "pending")
+        self.assertTrue(
+            EnrichmentJob.objects.filter(book_id=response.json()["id"]).exists()
+        )
+
+
+class LibraryVersionETagTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="reader", password="pw")
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+        self.bookshelves = create_library(self.user, 10)
+
+    def assertNotModified(self, url, etag, queries=1):
+        # Only the version lookup (and, for details, an existence check)
+        # runs; the books aren't loaded or serialized
+        with self.assertNumQueries(queries):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response["ETag"], etag)
+        self.assertFalse(response.content)
+
+    def test_unchanged_lists_and_details_answer_304(self):
+        book = Book.objects.first()
+        for url in [
+            "/api/books/",
+            f"/api/books/?bookshelf={self.bookshelves[0].id}",
+            "/api/bookshelves/",
+            "/api/categories/",
+            "/api/series/",
+        ]:
+            with self.subTest(url=url):
+                response = self.client.get(url)
+                self.assertEqual(response.status_code, 200)
+                self.assertNotModified(url, response["ETag"])
+
+        url = f"/api/bookshelves/{self.bookshelves[0].id}/"
+        self.assertNotModified(url, self.client.get(url)["ETag"], queries=2)
+        with mock.patch(
+            "library_api.services.google_books.fetch_book_data", return_value={}
+        ):
+            response = self.client.get(f"/api/books/{book.id}/")
+        self.assertNotModified(f"/api/books/{book.id}/", response["ETag"], queries=2)
+
+    def test_missing_and_other_users_objects_are_not_found(self):
+        etag = self.client.get("/api/books/")["ETag"]
+        other = User.objects.create_user(username="other", password="pw")
+        create_library(other, 1)
+        theirs = Book.objects.get(user=other)
+        for url in [
+            f"/api/books/{theirs.id}/",
+            f"/api/books/{theirs.id + 1000}/",
+            "/api/books/not-an-id/",
+            f"/api/bookshelves/{theirs.bookshelf_id}/",
+        ]:
+            for if_none_match in [etag, "*"]:
+                with self.subTest(url=url, if_none_match=if_none_match):
+                    response = self.client.get(url, HTTP_IF_NONE_MATCH=if_none_match)
+                    self.assertEqual(response.status_code, 404)
+
+    def test_writes_change_the_etag(self):
+        etag = self.client.get("/api/books/")["ETag"]
+        writes = [
+            lambda: Category.objects.create(name="New", user=self.user),
+            lambda: Series.objects.filter(user=self.user).first().delete(),
+            lambda: self.client.patch(
+                f"/api/bookshelves/{self.bookshelves[0].id}/", {"name": "Renamed"}
+            ),
+            lambda: Book.objects.filter(user=self.user).first().delete(),
+            lambda: enrichment.enqueue([Book.objects.filter(user=self.user).first()]),
+            lambda: Bookshelf.objects.filter(id=self.bookshelves[2].id).delete(),
+        ]
+        for write in writes:
+            write()
+            response = self.client.get("/api/books/", HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 200)
+            self.assertNotEqual(response["ETag"], etag)
+            etag = response["ETag"]
+
+    def test_other_users_writes_keep_the_etag(self):
+        etag = self.client.get("/api/books/")["ETag"]
+        other = User.objects.create_user(username="other", password="pw")
+        create_library(other, 3)
+
+        response = self.client.get("/api/books/", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+    def test_cascading_deletes_stay_in_bulk(self):
+        def queries_to_delete_shelf(size):
+            shelf = Bookshelf.objects.create(name=f"Shelf of {size}", user=self.user)
+            for i in range(size):
+                Book.objects.create(
+                    isbn=f"{9781000000000 + i}", bookshelf=shelf, user=self.user
+                )
+            with CaptureQueriesContext(connection) as queries:
+                shelf.delete()
+            return len(queries)
+
+        # The books go in one DELETE, with a single version bump
+        self.assertEqual(queries_to_delete_shelf(1), queries_to_delete_shelf(20))
+
+    def test_deleting_a_user_doesnt_recreate_their_version(self):
+        other = User.objects.create_user(username="other", password="pw")
+        create_library(other, 3)
+        other.delete()
+        self.assertFalse(Book.objects.filter(user_id=other.id).exists())
+
+
+class BookFieldsTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="reader", password="pw")
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+        create_library(self.user, 5)
+        Book.objects.update(details="A long description. " * 50)
+
+    def get(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        # The last query loads the books
+        return response, queries[-1]["sql"]
+
+    def test_list_is_full_by_default(self):
+        response, sql = self.get("/api/books/")
+
+        self.assertEqual(set(response.data[0]), set(BookSerializer.Meta.fields))
+        self.assertNotIn('"search_vector"', sql)
+
+    def test_compact_view(self):
+        response, sql = self.get("/api/books/?view=compact")
+
+        self.assertEqual(set(response.data[0]), set(BookListSerializer.Meta.fields))
+        self.assertTrue(all(book["sort_key"] for book in response.data))
+        self.assertNotIn('"details"', sql)
+        self.assertNotIn('"search_vector"', sql)
+
+    def test_fields_select_only_their_columns(self):
+        response, sql = self.get("/api/books/?fields=title,details,category_name")
+
+        self.assertEqual(set(response.data[0]), {"title", "details", "category_name"})
+        self.assertTrue(response.data[0]["details"])
+        self.assertIn('"library_api_category"."name"', sql)
+        self.assertNotIn('"library_api_series"', sql)
+        self.assertNotIn('"author"', sql)
+
+    def test_fields_with_pagination_and_detail(self):
+        response, _ = self.get("/api/books/?fields=id&page_size=2")
+        self.assertEqual(set(response.data["results"][0]), {"id"})
+        next_page, _ = self.get(response.data["next"])
+        self.assertEqual(len(next_page.data["results"]), 2)
+
+        book_id = response.data["results"][0]["id"]
+        # Leaving out google_data skips the Google Books lookup
+        with mock.patch("library_api.services.google_books.fetch_book_data") as fetch:
+            detail, _ = self.get(f"/api/books/{book_id}/?fields=id,isbn")
+        self.assertEqual(set(detail.data), {"id", "isbn"})
+        fetch.assert_not_called()
+
+    def test_unknown_fields_are_rejected(self):
+        response = self.client.get("/api/books/?fields=title,password")
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data, {"error": "Unknown fields: password."})
+
+
+
+class BookRowParityTests(TestCase):
+    """
+    The list fast path (BookRowSerializer over .values() rows) must render
+    byte-for-byte what the DRF serializers render from model instances.
+    """
+
+    def setUp(self):
+        self.user = User.objects.create_user(username="reader", password="pw")
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+        self.bookshelves = create_library(self.user, 12)
+        series = Series.objects.create(title="Ünïcode \u2028 Series", user=self.user)
+        odd_books = [
+            # No category or series, empty and null optional fields
+            {"title": "", "subtitle": "", "details": None},
+            {
+                "title": "Line\u2028separator \"quoted\" \\ 日本語 😀",
+                "author": "Émile Zola",
+                "series": series,
+                "volume_number": 0,
+                "details": "x" * 5000,
+                "small_thumbnail": "http://books.google.com/books/content?id=a&zoom=5",
+                "large_thumbnail": "https://books.google.com/books/content?id=a b&z=1",
+            },
+            {
+                "series": series,
+                "small_thumbnail": "http://elsewhere.example/cover.jpg",
+                "large_thumbnail": "",
+            },
+        ]
+        for i, fields in enumerate(odd_books):
+            Book.objects.create(
+                isbn=f"978100000000{i}",
+                bookshelf=self.bookshelves[0],
+                user=self.user,
+                **fields,
+            )
+        Book.objects.filter(user=self.user, volume_number=3).update(
+            enrichment_status=Book.EnrichmentStatus.PENDING
+        )
+
+    def get_both(self, url):
+        fast = self.client.get(url)
+        with mock.patch.object(BookViewSet, "fast_list", False):
+            slow = self.client.get(url)
+        self.assertEqual(fast.status_code, 200)
+        self.assertEqual(slow.status_code, 200)
+        return fast.content, slow.content
+
+    def assertSameResponse(self, url):
+        fast, slow = self.get_both(url)
+        self.assertEqual(fast, slow)
+
+    def test_default_list(self):
+        self.assertSameResponse("/api/books/")
+        self.assertSameResponse(f"/api/books/?bookshelf={self.bookshelves[0].id}")
+
+    def test_every_field(self):
+        for field in BookSerializer.Meta.fields:
+            with self.subTest(field=field):
+                self.assertSameResponse(f"/api/books/?fields={field}")
+        self.assertSameResponse(
+            f"/api/books/?fields={','.join(BookSerializer.Meta.fields)}"
+        )
+        # Fields come back in the serializer's order, not the request's
+        self.assertSameResponse("/api/books/?fields=sort_key,title,id")
+
+    def test_pages(self):
+        url = "/api/books/?page_size=4&fields=id,title,sort_key"
+        pages = 0
+        while url:
+            fast, slow = self.get_both(url)
+            self.assertEqual(fast, slow)
+            url = json.loads(fast)["next"]
+            pages += 1
+        self.assertEqual(pages, 4)
+
+    def test_browsable_api_and_indented_json(self):
+        for accept in ["application/json; indent=2", "text/html"]:
+            with self.subTest(accept=accept):
+                self.client.credentials(HTTP_ACCEPT=accept)
+                fast, slow = self.get_both("/api/books/?fields=id,title")
+                if accept == "text/html":
+                    # The page embeds a CSRF token that differs per request
+                    fast, slow = (
+                        content.split(b"<pre")[-1].split(b"</pre>")[0]
+                        for content in (fast, slow)
+                    )
+                self.assertEqual(fast, slow)
+
+    def test_serializers_directly(self):
+        books = Book.objects.filter(user=self.user).order_by("sort_key_text", "id")
+        for serializer_class, fields in [
+            (BookListSerializer, None),
+            (BookSerializer, None),
+            (BookSerializer, ["sort_key", "large_cover_url", "user"]),
+        ]:
+            with self.subTest(serializer=serializer_class.__name__, fields=fields):
+                rows = BookRowSerializer(serializer_class, fields)
+                expected = serializer_class(books, many=True, fields=fields).data
+                actual = rows.to_representation(books.values(*rows.value_paths))
+                self.assertEqual(
+                    JSONRenderer().render(actual), JSONRenderer().render(expected)
+                )
+
+    def test_detail_only_fields_are_rejected(self):
+        with self.assertRaises(ValueError):
+            BookRowSerializer(BookDetailSerializer)
+
+
+
+class UserCacheTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="reader", password="pw")
+        self.client = APIClient()
+        self.login(self.user)
+        user_cache.clear()
+        user_cache.reset_stats()
+
+    def login(self, user):
+        self.client.cookies["access_token"] = str(AccessToken.for_user(user))
+
+    def get_me(self, expected_queries):
+        with self.assertNumQueries(expected_queries):
+            return self.client.get("/api/users/me/")
+
+    def test_user_is_loaded_once_per_token(self):
+        self.assertEqual(self.get_me(1).data["username"], "reader")
+        self.assertEqual(self.get_me(0).data["username"], "reader")
+
+        # A new token for the same user is a separate entry
+        self.login(self.user)
+        self.get_me(1)
+        self.get_me(0)
+        self.assertEqual(user_cache.stats()["hits"], 2)
+        self.assertEqual(user_cache.stats()["misses"], 2)
+
+    def test_password_and_active_changes_take_effect_at_once(self):
+        self.get_me(1)
+
+        self.user.set_password("new password")
+        self.user.save()
+        self.get_me(1)
+
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.get_me(1).status_code, 401)
+        # Failed checks aren't cached
+        self.assertEqual(self.get_me(1).status_code, 401)
+
+    def test_deleted_user_is_rejected(self):
+        self.get_me(1)
+        self.user.delete()
+        self.assertEqual(self.client.get("/api/users/me/").status_code, 401)
+
+    def test_entries_expire(self):
+        self.get_me(1)
+        with mock.patch(
+            "library_api.services.metadata_cache.monotonic", return_value=float("inf")
+        ):
+            self.get_me(1)
+
+    def test_cached_users_are_not_shared(self):
+        self.get_me(1)
+        first = user_cache.get_user(self.user.id, "x", lambda: self.user)
+        first.username = "changed"
+        second = user_cache.get_user(self.user.id, "x", lambda: self.user)
+        self.assertEqual(second.username, "reader")
+
+
+class ExportTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="reader", password="pw")
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+        create_library(self.user, 25)
+
+    def test_ndjson_export_streams_every_book_in_list_order(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get("/api/books/export/ndjson/")
+            self.assertTrue(response.streaming)
+            lines = b"".join(response.streaming_content).decode().splitlines()
+
+        # One query however many rows, with names from joins, read through a
+        # server-side cursor that Postgres doesn't materialize up front
+        statements = [q["sql"] for q in queries if "SAVEPOINT" not in q["sql"]]
+        self.assertEqual(len(statements), 1)
+        self.assertIn("CURSOR WITHOUT HOLD", statements[0])
+
+        rows = [json.loads(line) for line in lines]
+        listed = self.client.get("/api/books/").data
+        self.assertEqual([row["isbn"] for row in rows], [book["isbn"] for book in listed])
+        self.assertEqual(
+            [(row["bookshelf"], row["category"], row["series"]) for row in rows],
+            [
+                (book["bookshelf_name"], book["category_name"], book["series_title"])
+                for book in listed
+            ],
+        )
+        self.assertIn("attachment", response["Content-Disposition"])
+
+    def test_csv_export_has_a_header_and_a_row_per_book(self):
+        response = self.client.get("/api/books/export/csv/")
+        self.assertEqual(response["Content-Type"], "text/csv; charset=utf-8")
+        rows = list(
+            csv.DictReader(io.StringIO(b"".join(response.streaming_content).decode()))
+        )
+        self.assertEqual(len(rows), 25)
+        self.assertEqual(list(rows[0]), export.EXPORT_FIELDS)
+
+    def test_encoders_emit_chunks(self):
+        rows = list(export.export_rows(self.user))
+        chunks = list(export.ndjson_export(iter(rows), chunk_size=10))
+        self.assertEqual(len(chunks), 3)
+        self.assertEqual(len(list(export.csv_export(iter(rows), chunk_size=10))), 4)
+
+    def test_unknown_format(self):
+        self.assertEqual(self.client.get("/api/books/export/xml/").status_code, 404)
+
+
+@mock.patch(
+    "library_api.services.google_books.fetch_volume_info",
+    side_effect=AssertionError("restores must not call Google Books"),
+)
+class RestoreTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="reader", password="pw")
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+        self.source = User.objects.create_user(username="source", password="pw")
+        create_library(self.source, 30)
+
+    def export(self, export_format):
+        rows = export.export_rows(self.source)
+        encode = export.ndjson_export if export_format == "ndjson" else export.csv_export
+        return b"".join(encode(rows))
+
+    def restore(self, name, content, **extra):
+        upload = SimpleUploadedFile(name, content)
+        return self.client.post(
+            "/api/books/restore/", {"file": upload, **extra}, format="multipart"
+        )
+
+    def assertSameLibrary(self):
+        def library(user):
+            return [
+                (
+                    book.isbn,
+                    book.title,
+                    book.author,
+                    book.bookshelf.name,
+                    book.category.name if book.category else None,
+                    book.series.title if book.series else None,
+                    book.volume_number,
+                    book.sort_key_text,
+                )
+                for book in Book.objects.filter(user=user)
+                .select_related("bookshelf", "category", "series")
+                .order_by("sort_key_text", "id")
+            ]
+
+        self.assertEqual(library(self.user), library(self.source))
+
+    def test_round_trip_through_each_format(self, _fetch):
+        for export_format in ["ndjson", "csv"]:
+            with self.subTest(export_format=export_format):
+                Book.objects.filter(user=self.user).delete()
+                response = self.restore(
+                    f"library.{export_format}", self.export(export_format)
+                )
+                self.assertEqual(response.status_code, 201)
+                self.assertEqual(response.data["created"], 30)
+                self.assertEqual(response.data["errors"], 0)
+                self.assertSameLibrary()
+
+    def test_names_are_resolved_without_duplicates(self, _fetch):
+        Category.objects.create(name="Category 1", user=self.user)
+
+        report = self.restore("library.ndjson", self.export("ndjson")).data
+
+        self.assertEqual(report["categories_created"], 2)
+        self.assertEqual(report["bookshelves_created"], 3)
+        self.assertEqual(Category.objects.filter(user=self.user).count(), 3)
+
+    def test_existing_isbns_are_skipped(self, _fetch):
+        content = self.export("ndjson")
+        self.restore("library.ndjson", content)
+        response = self.restore("library.ndjson", content)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((response.data["created"], response.data["skipped"]), (0, 30))
+
+    def test_bad_rows_are_reported_and_the_rest_restored(self, _fetch):
+        content = b"\n".join(
+            [
+                b'{"isbn": "9780441172719", "title": "Dune"}',
+                b"not json",
+                b'{"isbn": "123"}',
+                b"",
+                b'{"isbn": "9780140449136", "volume_number": "two"}',
+                b'{"isbn": "9780765326355", "series": "' + b"x" * 300 + b'"}',
+            ]
+        )
+        report = self.restore("library.ndjson", content).data
+
+        self.assertEqual(report["created"], 1)
+        self.assertEqual(
+            [error["row"] for error in report["error_details"]], [2, 3, 5, 6]
+        )
+        book = Book.objects.get(user=self.user)
+        self.assertEqual((book.title, book.author), ("Dune", "Unknown Author"))
+        self.assertEqual(book.bookshelf.name, "Restored")
+
+    def test_query_count_does_not_grow_with_rows(self, _fetch):
+        content = self.export("csv")
+        lines = content.splitlines(keepends=True)
+
+        def queries_for(rows):
+            Book.objects.filter(user=self.user).delete()
+            with CaptureQueriesContext(connection) as queries:
+                restore.restore_library(
+                    self.user, restore.csv_rows(lines[: rows + 1]), batch_size=100
+                )
+            return len(queries)
+
+        queries_for(30)  # creates the bookshelves, categories and series
+        self.assertEqual(queries_for(5), queries_for(30))
+
+
+class LibraryStatsTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="reader", password="pw")
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+        self.bookshelves = create_library(self.user, 12)
+
+    def assertStatsUpToDate(self):
+        stored = {
+            (user_id, dimension, key): count
+            for user_id, dimension, key, count in LibraryStat.objects.values_list(
+                "user_id", "dimension", "key", "count"
+            )
+        }
+        self.assertEqual(stored, library_stats.compute_stats())
+
+    def test_every_write_path_is_counted(self):
+        book = Book.objects.filter(user=self.user, series__isnull=False).first()
+        category = Category.objects.filter(user=self.user).first()
+        writes = [
+            lambda: Book.objects.create(
+                isbn="9780441172719", bookshelf=self.bookshelves[0], user=self.user
+            ),
+            lambda: self.client.patch(
+                f"/api/books/{book.id}/",
+                {"author": "Someone Else", "volume_number": 99},
+            ),
+            lambda: Book.objects.filter(user=self.user, category=category).update(
+                series=None
+            ),
+            lambda: restore.restore_library(
+                self.user,
+                [{"isbn": "9780140449136", "series": "New Series", "volume_number": 2}],
+            ),
+            lambda: category.delete(),
+            lambda: Book.objects.filter(user=self.user).first().delete(),
+            lambda: self.bookshelves[1].delete(),
+            lambda: self.user.delete(),
+        ]
+        for write in writes:
+            write()
+            self.assertStatsUpToDate()
+        self.assertFalse(LibraryStat.objects.exists())
+
+    def test_stats_endpoint(self):
+        series = Series.objects.create(title="Dune", user=self.user)
+        for volume_number in [1, 2, 4, None]:
+            Book.objects.create(
+                isbn="9780441172719",
+                author="Frank Herbert",
+                bookshelf=self.bookshelves[0],
+                user=self.user,
+                series=series,
+                volume_number=volume_number,
+            )
+
+        response = self.client.get("/api/books/stats/")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["total"], 16)
+        self.assertEqual(
+            response.data["authors"][0], {"name": "Frank Herbert", "count": 4}
+        )
+        self.assertEqual(
+            sum(entry["count"] for entry in response.data["categories"]), 16
+        )
+        self.assertIn(
+            {"id": None, "name": None, "count": 7}, response.data["categories"]
+        )
+        dune = next(
+            entry for entry in response.data["series"] if entry["title"] == "Dune"
+        )
+        self.assertEqual(
+            dune,
+            {
+                "id": series.id,
+                "title": "Dune",
+                "count": 4,
+                "volumes": [1, 2, 4],
+                "missing_volumes": [3],
+                "unnumbered": 1,
+            },
+        )
+        not_modified = self.client.get(
+            "/api/books/stats/", HTTP_IF_NONE_MATCH=response["ETag"]
+        )
+        self.assertEqual(not_modified.status_code, 304)
+
+    def test_query_count_does_not_grow_with_library(self):
+        def queries():
+            with CaptureQueriesContext(connection) as captured:
+                self.client.get("/api/books/stats/")
+            return len(captured)
+
+        small = queries()
+        create_library(self.user, 40)
+        self.assertEqual(queries(), small)
+
+    def test_recompute_repairs_stats(self):
+        LibraryStat.objects.filter(dimension=LibraryStat.Dimension.AUTHOR).delete()
+        LibraryStat.objects.filter(dimension=LibraryStat.Dimension.TOTAL).update(
+            count=1
+        )
+
+        with self.assertRaises(CommandError):
+            call_command("recompute_library_stats", "--check", stdout=io.StringIO())
+        out = io.StringIO()
+        call_command("recompute_library_stats", "reader", stdout=out)
+
+        self.assertEqual(json.loads(out.getvalue())["mismatched"], 8)
+        self.assertStatsUpToDate()
+        self.assertEqual(library_stats.recompute(dry_run=True)["mismatched"], 0)
+
+
+class CoverSource(BaseHTTPRequestHandler):
+    """Image host for CoverTests: /a.jpg and /b.jpg are the same image."""
+
+    image = b"\xff\xd8\xff\xe0 fake jpeg"
+    requests = []
+
+    redirects = {
+        "/moved.jpg": "/a.jpg",
+        "/elsewhere.jpg": "http://169.254.169.254/latest/meta-data/",
+    }
+
+    def do_GET(self):
+        self.requests.append(self.path)
+        if self.path in self.redirects:
+            self.send_response(302)
+            self.send_header("Location", self.redirects[self.path])
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        if self.path in ("/a.jpg", "/b.jpg"):
+            content_type, body = "image/jpeg", self.image
+        elif self.path == "/page.html":
+            content_type, body = "text/html", b"<html></html>"
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class CoverTests(TestCase):
+    def setUp(self):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), CoverSource)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        CoverSource.requests = []
+        self.base = f"http://127.0.0.1:{self.server.server_port}"
+
+        store_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(store_dir.cleanup)
+        overrides = override_settings(
+            BOOK_COVERS={"STORE_DIR": store_dir.name, "ALLOWED_HOSTS": ["127.0.0.1"]}
+        )
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+        self.user = User.objects.create_user(username="reader", password="password")
+        self.bookshelf = Bookshelf.objects.create(name="Shelf", user=self.user)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def add_book(self, path, user=None):
+        user = user or self.user
+        return Book.objects.create(
+            isbn="9780441172719",
+            bookshelf=Bookshelf.objects.filter(user=user).first(),
+            user=user,
+            small_thumbnail=f"{self.base}{path}",
+        )
+
+    def get_cover(self, path, **headers):
+        if not Book.objects.filter(small_thumbnail=f"{self.base}{path}").exists():
+            self.add_book(path)
+        return self.client.get(
+            "/api/covers/", {"url": f"{self.base}{path}"}, headers=headers
+        )
+
+    def test_cover_is_downloaded_once_and_cacheable(self):
+        first = self.get_cover("/a.jpg")
+        second = self.get_cover("/a.jpg")
+
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(b"".join(second.streaming_content), CoverSource.image)
+        self.assertEqual(second["Content-Type"], "image/jpeg")
+        self.assertIn("immutable", second["Cache-Control"])
+        self.assertEqual(first["ETag"], second["ETag"])
+        self.assertEqual(CoverSource.requests, ["/a.jpg"])
+
+        not_modified = self.get_cover("/a.jpg", if_none_match=first["ETag"])
+        self.assertEqual(not_modified.status_code, 304)
+
+    def test_identical_images_share_one_file(self):
+        self.get_cover("/a.jpg")
+        self.get_cover("/b.jpg")
+
+        digests = set(CoverImage.objects.values_list("digest", flat=True))
+        self.assertEqual(len(digests), 1)
+        stored = list(covers.store_path(digests.pop()).parent.parent.rglob("*"))
+        self.assertEqual(len([path for path in stored if path.is_file()]), 1)
+
+    def test_missing_and_invalid_covers(self):
+        self.assertEqual(self.get_cover("/missing.jpg").status_code, 404)
+        self.assertEqual(self.get_cover("/page.html").status_code, 502)
+        response = self.client.get(
+            "/api/covers/", {"url": "http://169.254.169.254/latest/meta-data/"}
+        )
+        self.assertEqual(response.status_code, 400)
+
+        # The miss is remembered; the failure is retried
+        self.get_cover("/missing.jpg")
+        self.get_cover("/page.html")
+        self.assertEqual(
+            CoverSource.requests, ["/missing.jpg", "/page.html", "/page.html"]
+        )
+
+    def test_covers_removed_from_the_store(self):
+        self.get_cover("/a.jpg")
+        cover = CoverImage.objects.get()
+        covers.store_path(cover.digest).unlink()
+
+        # Downloaded again when the store no longer has it
+        self.assertEqual(self.get_cover("/a.jpg").status_code, 200)
+        self.assertEqual(CoverSource.requests, ["/a.jpg", "/a.jpg"])
+
+        # Removed between the check and the read: a 404, not an error
+        covers.store_path(cover.digest).unlink()
+        with mock.patch.object(covers, "get_cover", return_value=cover):
+            self.assertEqual(self.get_cover("/a.jpg").status_code, 404)
+        self.assertEqual(self.get_cover("/a.jpg").status_code, 200)
+
+    def test_redirects_are_only_followed_to_allowed_hosts(self):
+        self.assertEqual(self.get_cover("/moved.jpg").status_code, 200)
+        self.assertEqual(self.get_cover("/elsewhere.jpg").status_code, 502)
+        self.assertEqual(
+            CoverSource.requests, ["/moved.jpg", "/a.jpg", "/elsewhere.jpg"]
+        )
+
+    def test_only_serves_covers_of_the_users_books(self):
+        url = f"{self.base}/a.jpg"
+        response = self.client.get("/api/covers/", {"url": url})
+        self.assertEqual(response.status_code, 404)
+
+        other = User.objects.create_user(username="other", password="password")
+        Bookshelf.objects.create(name="Shelf", user=other)
+        self.add_book("/a.jpg", user=other)
+        response = self.client.get("/api/covers/", {"url": url})
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(CoverSource.requests, [])
+
+        self.client.force_authenticate(None)
+        response = self.client.get("/api/covers/", {"url": url})
+        self.assertEqual(response.status_code, 401)
+
+    def test_serializer_links_allowed_covers_only(self):
+        Book.objects.create(
+            isbn="9780441172719",
+            bookshelf=self.bookshelf,
+            user=self.user,
+            small_thumbnail=f"{self.base}/a.jpg",
+            large_thumbnail="http://elsewhere.example/a.jpg",
+        )
+
+        book = self.client.get(
+            "/api/books/?fields=small_cover_url,large_cover_url"
+        ).data[0]
+
+        self.assertEqual(
+            book["small_cover_url"], covers.cover_url(f"{self.base}/a.jpg")
+        )
+        self.assertIsNone(book["large_cover_url"])
+
+    def test_prewarm_command(self):
+        for path in ["/a.jpg", "/b.jpg", "/a.jpg", "/missing.jpg"]:
+            self.add_book(path)
+
+        out = io.StringIO()
+        call_command("prewarm_covers", stdout=out)
+        call_command("prewarm_covers", "--user", "reader", stdout=out)
+
+        self.assertEqual(
+            out.getvalue().splitlines(),
+            [
+                "Stored 2, already cached 0, missing 1, failed 0",
+                "Stored 0, already cached 3, missing 0, failed 0",
+            ],
+        )
+        self.assertEqual(len(CoverSource.requests), 3)
+        self.assertEqual(self.get_cover("/b.jpg").status_code, 200)
+        self.assertEqual(len(CoverSource.requests), 3)
+
+
+class LoadHarnessTests(TestCase):
+    def test_generated_libraries_are_deterministic(self):
+        def generate(prefix):
+            return synthetic_data.generate_libraries(3, 40, prefix=prefix, seed=7)
+
+        report = generate("first")
+        self.assertEqual(report["users_created"], 3)
+        self.assertEqual(report["usernames"], ["first-0", "first-1", "first-2"])
+        self.assertEqual(
+            report["books_created"],
+            Book.objects.filter(user__username__startswith="first-").count(),
+        )
+        self.assertEqual(generate("first")["books_created"], 0)
+
+        generate("second")
+
+        def library(username):
+            return list(
+                Book.objects.filter(user__username=username)
+                .order_by("isbn")
+                .values_list(
+                    "isbn", "title", "author", "series__title", "volume_number"
+                )
+            )
+
+        self.assertEqual(library("first-1"), library("second-1"))
+        for isbn in Book.objects.values_list("isbn", flat=True):
+            total = sum(int(d) * (3 if i % 2 else 1) for i, d in enumerate(isbn))
+            self.assertEqual(total % 10, 0, isbn)
+
+    def test_load_test_reports_each_scenario(self):
+        synthetic_data.generate_libraries(2, 30, prefix="lt")
+        path = f"{self.enterContext(tempfile.TemporaryDirectory())}/report.json"
+        call_command(
+            "load_test",
+            "--prefix=lt",
+            "--requests=6",
+            "--concurrency=1",
+            "--warmup=1",
+            "--scenarios=list,detail,stats",
+            "--stub-latency=0",
+            f"--json={path}",
+            stdout=io.StringIO(),
+        )
+        with open(path) as f:
+            report = json.load(f)
+
+        self.assertEqual(report["users"], 2)
+        self.assertEqual(report["target"], "in-process")
+        self.assertEqual(
+            [result["scenario"] for result in report["results"]],
+            ["list", "detail", "stats"],
+        )
+        for result in report["results"]:
+            self.assertEqual(result["requests"], 6)
+            self.assertEqual(result["errors"], 0)
+            self.assertLessEqual(result["p50_ms"], result["p99_ms"])
+            self.assertGreater(result["mean_queries"], 0)
+
+        out = io.StringIO()
+        call_command(
+            "load_test",
+            "--prefix=lt",
+            "--requests=2",
+            "--concurrency=1",
+            "--scenarios=stats",
+            f"--compare={path}",
+            stdout=out,
+        )
+        self.assertIn("stats: p95", out.getvalue())
+
+    def test_unknown_scenario(self):
+        with self.assertRaisesMessage(CommandError, "Unknown scenario 'nope'."):
+            call_command("load_test", "--scenarios=nope")
+
+
+@override_settings(REQUEST_METRICS={"ENABLED": True})
+class RequestMetricsTests(TestCase):
+    def setUp(self):
+        metadata_cache.clear()
+        request_metrics.registry.reset()
+        self.user = User.objects.create_user(username="reader", password="pw")
+        create_library(self.user, 5)
+        self.client = APIClient()
+        self.client.cookies["access_token"] = str(AccessToken.for_user(self.user))
+
+    def timings(self, response):
+        """Server-Timing entries as {name: (milliseconds, description)}."""
+        entries = {}
+        for entry in response["Server-Timing"].split(", "):
+            name, *params = entry.split(";")
+            params = dict(param.split("=", 1) for param in params)
+            entries[name] = (float(params["dur"]), params.get("desc"))
+        return entries
+
+    def test_server_timing_and_histograms(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get("/api/books/")
+        self.assertEqual(response.status_code, 200)
+        timings = self.timings(response)
+        self.assertEqual(set(timings), {"auth", "db", "serialize", "render", "total"})
+        self.assertEqual(timings["db"][1], f'"{len(queries)} queries"')
+        for name in ["auth", "db", "serialize", "render"]:
+            self.assertLessEqual(timings[name][0], timings["total"][0])
+
+        self.client.get("/api/books/stats/")
+        metrics = self.client.get("/api/metrics/")
+        self.assertEqual(metrics.status_code, 200)
+        self.assertTrue(metrics["Content-Type"].startswith("text/plain; version=0.0.4"))
+        text = metrics.content.decode()
+        self.assertIn(
+            'library_request_duration_seconds_count{view="book-list",method="GET",'
+            'status="200"} 1',
+            text,
+        )
+        self.assertIn(
+            'library_request_queries_bucket{view="book-list",le="+Inf"} 1', text
+        )
+        self.assertIn(
+            'library_request_phase_seconds_count{view="book-stats",phase="db"} 1', text
+        )
+
+    def test_google_books_time_is_reported(self):
+        with BooksAPIStub(generate_missing=True) as stub, override_settings(
+            GOOGLE_BOOKS_API_URL=stub.url
+        ):
+            response = self.client.get("/api/books/search/?isbn=9780441172719")
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("google", self.timings(response))
+
+    def test_async_views_are_timed(self):
+        bookshelf = Bookshelf.objects.filter(user=self.user).first()
+        self.async_client.cookies = self.client.cookies
+        # The test's connection was opened before the middleware loaded, so
+        # only a sync request adds the timer to it
+        self.client.get("/api/books/")
+
+        async def create():
+            try:
+                return await self.async_client.post(
+                    "/api/books/async/",
+                    {"isbn": "9780441172719", "bookshelf": bookshelf.id},
+                    content_type="application/json",
+                )
+            finally:
+                await close_session()
+
+        with BooksAPIStub(generate_missing=True) as stub, override_settings(
+            GOOGLE_BOOKS_API_URL=stub.url
+        ):
+            response = async_to_sync(create)()
+        self.assertEqual(response.status_code, 201)
+        self.assertLessEqual({"db", "google", "total"}, set(self.timings(response)))
+
+    def test_queries_on_other_threads_are_timed(self):
+        self.client.get("/api/books/")  # loads the middleware
+
+        def count_books():
+            try:
+                return Book.objects.count()
+            finally:
+                connection.close()
+
+        async def count_elsewhere():
+            with request_metrics.collect() as timings:
+                # A thread of its own, so a connection of its own
+                await sync_to_async(count_books, thread_sensitive=False)()
+            return timings
+
+        self.assertEqual(async_to_sync(count_elsewhere)().counts["db"], 1)
+
+    def test_timings_shared_between_threads_add_up(self):
+        def work():
+            for _ in range(1000):
+                request_metrics.current().add("db", 0.001)
+                with request_metrics.timed("google"):
+                    pass
+
+        with request_metrics.collect() as timings:
+            # Like the provider pools, each thread runs in a copy of the context
+            with ThreadPoolExecutor(max_workers=8) as pool:
+                futures = [
+                    pool.submit(contextvars.copy_context().run, work) for _ in range(8)
+                ]
+                for future in futures:
+                    future.result()
+
+        self.assertEqual(timings.counts["db"], 8000)
+        self.assertAlmostEqual(timings.seconds["db"], 8.0)
+        self.assertEqual(timings.active, set())
+
+    @override_settings(REQUEST_METRICS={"ENABLED": True, "TOKEN": "secret"})
+    def test_metrics_token(self):
+        self.assertEqual(self.client.get("/api/metrics/").status_code, 401)
+        response = self.client.get("/api/metrics/", HTTP_AUTHORIZATION="Bearer secret")
+        self.assertEqual(response.status_code, 200)
+
+    @override_settings(REQUEST_METRICS={"ENABLED": False})
+    def test_disabled(self):
+        response = self.client.get("/api/books/")
+        self.assertNotIn("Server-Timing", response)
+        self.assertEqual(self.client.get("/api/metrics/").status_code, 404)
+        self.assertIsNone(request_metrics.current())
+        self.assertNotIn("book-list", request_metrics.registry.render())
+
+
+class FlakyBooksAPIStub(BooksAPIStub):
+    """Answers the next `failures` requests with HTTP 503."""
+
+    failures = 0
+
+    def respond(self, method, target):
+        with self._lock:
+            failing = self.failures > 0
+            self.failures -= failing
+        if failing:
+            self.request_count += 1
+            return 503, {"error": {"code": 503, "message": "Backend Error"}}
+        return super().respond(method, target)
+
+
+@override_settings(GOOGLE_BOOKS_CLIENT={"RETRIES": 2, "BACKOFF": 0.01})
+class GoogleBooksResilienceTests(TestCase):
+    def setUp(self):
+        metadata_cache.clear()
+        self.stub = FlakyBooksAPIStub(
+            volumes={"9780441172719": {"title": "Dune", "authors": ["Frank Herbert"]}}
+        ).start()
+        self.addCleanup(self.stub.stop)
+        settings_override = override_settings(GOOGLE_BOOKS_API_URL=self.stub.url)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        # Opens after three failed attempts, i.e. one lookup that used up
+        # its retries
+        breaker_patch = mock.patch.object(
+            google_books, "breaker", CircuitBreaker(3, reset_timeout=60)
+        )
+        self.breaker = breaker_patch.start()
+        self.addCleanup(breaker_patch.stop)
+
+        self.client = APIClient()
+        self.client.force_authenticate(
+            User.objects.create_user(username="reader", password="pw")
+        )
+
+    def search(self, isbn):
+        return self.client.get(f"/api/books/search/?isbn={isbn}")
+
+    def test_transient_errors_are_retried(self):
+        self.stub.failures = 2
+        self.assertEqual(google_books.fetch_book_data("9780441172719")["title"], "Dune")
+        # Two failed searches, then a search and the volume detail
+        self.assertEqual(self.stub.request_count, 4)
+        self.assertEqual(self.breaker.state, "closed")
+
+    def test_not_found_and_unavailable_are_reported_separately(self):
+        self.assertEqual(self.search("9781111111111").status_code, 404)
+
+        self.stub.failures = 3
+        response = self.search("9780441172719")
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(
+            response.data["error"],
+            "Google Books is unavailable. Please try again later.",
+        )
+        self.assertEqual(self.stub.request_count, 4)
+        # Failures aren't cached
+        self.assertFalse(BookMetadata.objects.filter(isbn="9780441172719").exists())
+
+    def test_open_breaker_fails_fast_and_serves_stale_data(self):
+        BookMetadata.objects.create(
+            isbn="9780441172719",
+            data={"title": "Dune (stale)"},
+            fetched_at=timezone.now() - timedelta(days=365),
+        )
+        self.stub.failures = 100
+
+        # The lookup fails, opening the breaker, and falls back to the
+        # expired cache entry
+        response = self.search("9780441172719")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["title"], "Dune (stale)")
+        self.assertEqual(self.breaker.state, "open")
+        self.assertEqual(self.stub.request_count, 3)
+
+        # While it's open, nothing is sent upstream
+        self.assertEqual(self.search("9780441172719").data["title"], "Dune (stale)")
+        self.assertEqual(self.search("9781111111111").status_code, 503)
+        self.assertEqual(
+            google_books.fetch_many(["9781111111111"]), {"9781111111111": None}
+        )
+        with self.assertRaises(google_books.GoogleBooksUnavailable):
+            async_to_sync(afetch_book_data)("9781111111111")
+        self.assertEqual(self.stub.request_count, 3)
+
+    @override_settings(GOOGLE_BOOKS_CLIENT={"RETRIES": 0, "READ_TIMEOUT": 0.1})
+    def test_stalled_upstream_times_out(self):
+        self.stub.latency = 2
+        start = time.monotonic()
+        with self.assertRaises(google_books.GoogleBooksUnavailable):
+            google_books.fetch_book_data("9780441172719")
+        self.assertLess(time.monotonic() - start, 1)
+
+    def test_breaker_lets_one_trial_call_through_after_reset_timeout(self):
+        breaker = CircuitBreaker(2, reset_timeout=0.05)
+        breaker.before_call()
+        breaker.record_failure()
+        breaker.record_failure()
+        with self.assertRaises(CircuitOpenError):
+            breaker.before_call()
+
+        time.sleep(0.06)
+        breaker.before_call()
+        # Only one trial at a time
+        with self.assertRaises(CircuitOpenError):
+            breaker.before_call()
+        breaker.record_failure()
+        with self.assertRaises(CircuitOpenError):
+            breaker.before_call()
+
+        time.sleep(0.06)
+        breaker.before_call()
+        breaker.record_success()
+        self.assertEqual(breaker.state, "closed")
+        breaker.before_call()
+        self.assertEqual(breaker.stats()["times_opened"], 2)
+
+
+def edition_line(**record):
+    """An Open Library editions dump line (type, key, revision, modified, JSON)."""
+    return "\t".join(
+        ["/type/edition", "/books/OL1M", "1", "2024-01-01", json.dumps(record)]
+    )
+
+
+class ISBNStoreTests(TestCase):
+    def setUp(self):
+        metadata_cache.clear()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        self.path = f"{self.directory}/isbn_store.sqlite3"
+        self.stub = BooksAPIStub(
+            volumes={"9780441172719": {"title": "Dune (Google)"}}
+        ).start()
+        self.addCleanup(self.stub.stop)
+        settings_override = override_settings(
+            GOOGLE_BOOKS_API_URL=self.stub.url, BOOK_ISBN_STORE={"PATH": self.path}
+        )
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def write_dump(self, name, lines):
+        path = f"{self.directory}/{name}"
+        with gzip.open(path, "wt") if name.endswith(".gz") else open(path, "w") as f:
+            f.write("\n".join(lines) + "\n")
+        return path
+
+    def import_dumps(self, *paths, **options):
+        out = io.StringIO()
+        call_command("import_isbn_dump", *paths, stdout=out, **options)
+        return json.loads(out.getvalue())
+
+    def test_import_and_lookup_without_network(self):
+        editions = self.write_dump(
+            "editions.txt.gz",
+            [
+                edition_line(
+                    title="Dune",
+                    isbn_10=["0-441-17271-7"],
+                    authors=[{"key": "/authors/OL1A"}, {"key": "/authors/OL2A"}],
+                    publishers=["Ace"],
+                    number_of_pages=535,
+                    description={"type": "/type/text", "value": "Spice."},
+                    covers=[42],
+                ),
+                json.dumps({"title": "No ISBN"}),
+                "not json",
+            ],
+        )
+        authors = self.write_dump(
+            "authors.jsonl",
+            [json.dumps({"key": "/authors/OL1A", "name": "Frank Herbert"})],
+        )
+        report = self.import_dumps(editions, authors)
+        self.assertEqual(
+            {key: report[key] for key in ("editions", "isbns", "authors", "skipped")},
+            {"editions": 1, "isbns": 1, "authors": 1, "skipped": 2},
+        )
+
+        # Stored under the ISBN-13 and found by either form
+        data = google_books.fetch_book_data("9780441172719")
+        self.assertEqual(google_books.fetch_book_data("0441172717"), data)
+        self.assertEqual(data["title"], "Dune")
+        # The author missing from the authors dump is left out
+        self.assertEqual(data["authors"], ["Frank Herbert"])
+        self.assertEqual(data["pageCount"], 535)
+        self.assertEqual(data["description"], "Spice.")
+        self.assertEqual(
+            data["imageLinks"]["thumbnail"],
+            "https://covers.openlibrary.org/b/id/42-M.jpg",
+        )
+        self.assertEqual(
+            google_books.book_fields_from_data(data)["author"], "Herbert, Frank"
+        )
+        self.assertEqual(self.stub.request_count, 0)
+
+    def test_misses_go_online_unless_offline_only(self):
+        self.import_dumps(
+            self.write_dump(
+                "editions.jsonl",
+                [json.dumps({"title": "Other", "isbn_13": ["9780000000002"]})],
+            )
+        )
+        self.assertEqual(
+            google_books.fetch_book_data("9780441172719")["title"], "Dune (Google)"
+        )
+        metadata_cache.clear()
+        BookMetadata.objects.all().delete()
+        requests_made = self.stub.request_count
+
+        with override_settings(
+            BOOK_ISBN_STORE={"PATH": self.path, "OFFLINE_ONLY": True}
+        ):
+            self.assertEqual(google_books.fetch_book_data("9780441172719"), {})
+            self.assertEqual(
+                google_books.fetch_book_data("9780000000002")["title"], "Other"
+            )
+        self.assertEqual(self.stub.request_count, requests_made)
+
+    def test_rebuild_replaces_store_and_append_adds_to_it(self):
+        first = json.dumps({"title": "First", "isbn_13": ["9780000000002"]})
+        second = json.dumps({"title": "Second", "isbn_13": ["9780000000019"]})
+        self.import_dumps(self.write_dump("first.jsonl", [first]))
+        self.assertEqual(isbn_store.lookup("9780000000002")["title"], "First")
+
+        self.import_dumps(self.write_dump("second.jsonl", [second]))
+        self.assertIsNone(isbn_store.lookup("9780000000002"))
+        self.assertEqual(isbn_store.lookup("9780000000019")["title"], "Second")
+
+        self.import_dumps(self.write_dump("first.jsonl", [first]), append=True)
+        self.assertEqual(isbn_store.lookup("9780000000002")["title"], "First")
+        self.assertEqual(isbn_store.lookup("9780000000019")["title"], "Second")
+
+    def test_lookups_are_sub_millisecond(self):
+        isbns = [synthetic_data.isbn13(i) for i in range(5000)]
+        self.import_dumps(
+            self.write_dump(
+                "editions.jsonl",
+                [
+                    json.dumps({"title": f"Book {i}", "isbn_13": [isbn]})
+                    for i, isbn in enumerate(isbns)
+                ],
+            )
+        )
+        isbn_store.lookup(isbns[0])  # open this thread's connection
+        start = time.perf_counter()
+        for isbn in isbns[:1000]:
+            self.assertIsNotNone(isbn_store.lookup(isbn))
+        self.assertLess((time.perf_counter() - start) / 1000, 0.001)
+
+
+@override_settings(GOOGLE_BOOKS_CLIENT={"RETRIES": 0})
+class MetadataProviderTests(TestCase):
+    def setUp(self):
+        metadata_cache.clear()
+        google_books.breaker.reset()
+        self.addCleanup(google_books.breaker.reset)
+        self.google = BooksAPIStub().start()
+        self.addCleanup(self.google.stop)
+        self.open_library = BooksAPIStub().start()
+        self.addCleanup(self.open_library.stop)
+        chain_patch = mock.patch.object(
+            metadata_providers, "chain", metadata_providers.ProviderChain()
+        )
+        self.chain = chain_patch.start()
+        self.addCleanup(chain_patch.stop)
+        self.configure()
+
+    def configure(self, **options):
+        settings_override = override_settings(
+            GOOGLE_BOOKS_API_URL=self.google.url,
+            BOOK_METADATA_PROVIDERS={
+                "PROVIDERS": ["google_books", "open_library"],
+                "OPEN_LIBRARY_URL": self.open_library.open_library_url,
+                **options,
+            },
+        )
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def test_next_provider_is_asked_when_a_book_is_not_found(self):
+        self.open_library.volumes["9780441172719"] = {
+            "title": "Dune",
+            "authors": ["Frank Herbert"],
+            "imageLinks": {"thumbnail": "https://covers.openlibrary.org/b/id/1-M.jpg"},
+        }
+        data = google_books.fetch_book_data("9780441172719")
+        self.assertEqual(data["title"], "Dune")
+        self.assertEqual(data["authors"], ["Frank Herbert"])
+        self.assertEqual(
+            data["imageLinks"]["smallThumbnail"],
+            "https://covers.openlibrary.org/b/id/1-M.jpg",
+        )
+        stats = self.chain.stats()["providers"]
+        self.assertEqual(stats["google_books"]["not_found"], 1)
+        self.assertEqual(stats["open_library"]["found"], 1)
+
+        self.assertEqual(google_books.fetch_book_data("9781111111111"), {})
+
+    def test_failed_provider_falls_back_and_all_failing_is_unavailable(self):
+        self.google.error_rate = 1
+        self.open_library.volumes["9780441172719"] = {"title": "Dune"}
+        self.assertEqual(google_books.fetch_book_data("9780441172719")["title"], "Dune")
+        self.assertEqual(self.chain.stats()["providers"]["google_books"]["errors"], 1)
+
+        self.open_library.error_rate = 1
+        with self.assertRaises(google_books.GoogleBooksUnavailable):
+            google_books.fetch_book_data("9781111111111")
+
+    def test_not_found_is_not_final_if_a_provider_failed(self):
+        async def alookup(isbn):
+            try:
+                return await afetch_book_data(isbn)
+            finally:
+                await close_session()
+
+        def check(lookup, isbn):
+            # Google Books doesn't know the book and Open Library is down
+            self.open_library.error_rate = 1
+            with self.assertRaises(google_books.GoogleBooksUnavailable):
+                lookup(isbn)
+            self.chain.provider("open_library").breaker.reset()
+
+            # Nothing was remembered, so the book is found once it's back
+            self.open_library.error_rate = 0
+            self.open_library.volumes[isbn] = {"title": "Dune"}
+            self.assertEqual(lookup(isbn)["title"], "Dune")
+
+        check(google_books.fetch_book_data, synthetic_data.isbn13(0))
+        check(async_to_sync(alookup), synthetic_data.isbn13(1))
+        self.configure(HEDGE_AFTER=0.02)
+        check(google_books.fetch_book_data, synthetic_data.isbn13(2))
+
+        self.open_library.error_rate = 1
+        results = google_books.fetch_many(["9781111111111"])
+        self.assertEqual(results, {"9781111111111": None})
+
+    def test_open_library_time_is_reported_separately(self):
+        self.open_library.volumes["9780441172719"] = {"title": "Dune"}
+        with request_metrics.collect() as timings:
+            google_books.fetch_book_data("9780441172719")
+
+        self.assertEqual(timings.counts["google"], 1)
+        self.assertEqual(timings.counts["openlibrary"], 1)
+
+    def test_hedged_lookup_is_bounded_by_the_fastest_provider(self):
+        self.configure(HEDGE_AFTER=0.05)
+        self.google.latency = 1
+        for stub in (self.google, self.open_library):
+            stub.volumes["9780441172719"] = {"title": f"Dune ({stub.port})"}
+
+        start = time.monotonic()
+        data = google_books.fetch_book_data("9780441172719")
+        self.assertLess(time.monotonic() - start, 0.5)
+        self.assertEqual(data["title"], f"Dune ({self.open_library.port})")
+        self.assertEqual(self.chain.stats()["hedges"], 1)
+
+        async def lookup():
+            try:
+                return await afetch_book_data("9780441172720")
+            finally:
+                await close_session()
+
+        self.open_library.volumes["9780441172720"] = {"title": "Dune Messiah"}
+        start = time.monotonic()
+        data = async_to_sync(lookup)()
+        self.assertLess(time.monotonic() - start, 0.5)
+        self.assertEqual(data["title"], "Dune Messiah")
+        self.assertEqual(self.chain.stats()["hedges"], 2)
+
+    def test_reorder_asks_the_fastest_healthy_provider_first(self):
+        self.configure(HEDGE_AFTER=0.02, REORDER=True)
+        self.google.latency = 0.1
+        self.assertEqual(
+            [provider.name for provider in self.chain.ordered()],
+            ["google_books", "open_library"],
+        )
+        google_books.fetch_book_data("9780441172719")
+        time.sleep(0.3)  # let the slow request finish in the background
+        self.assertEqual(
+            [provider.name for provider in self.chain.ordered()],
+            ["open_library", "google_books"],
+        )
+
+        # A provider whose breaker is open goes last however fast it was
+        for _ in range(google_books.get_client_settings()["FAILURE_THRESHOLD"]):
+            self.chain.provider("open_library").breaker.record_failure()
+        self.assertEqual(
+            [provider.name for provider in self.chain.ordered()],
+            ["google_books", "open_library"],
+        )
+
+    def test_batches_go_to_the_next_provider_together(self):
+        known = [synthetic_data.isbn13(i) for i in range(3)]
+        self.google.volumes[known[0]] = {"title": "From Google"}
+        for isbn in known[1:]:
+            self.open_library.volumes[isbn] = {"title": "From Open Library"}
+
+        results = google_books.fetch_many([*known, "9781111111111"])
+        self.assertEqual(
+            [results[isbn]["title"] for isbn in known],
+            ["From Google", "From Open Library", "From Open Library"],
+        )
+        self.assertEqual(results["9781111111111"], {})
+        # One search and one volume detail, then one Open Library request
+        self.assertEqual(self.google.request_count, 2)
+        self.assertEqual(self.open_library.request_count, 1)
+
+
+@override_settings(GOOGLE_BOOKS_CLIENT={"RETRIES": 0, "BATCH_SIZE": 20})
+class BatchLookupTests(TestCase):
+    def setUp(self):
+        metadata_cache.clear()
+        google_books.breaker.reset()
+        self.addCleanup(google_books.breaker.reset)
+        self.known = [synthetic_data.isbn13(i) for i in range(3)]
+        self.stub = BooksAPIStub(
+            volumes={isbn: {"title": f"Book {isbn}"} for isbn in self.known},
+            latency=0.05,
+        ).start()
+        self.addCleanup(self.stub.stop)
+        settings_override = override_settings(GOOGLE_BOOKS_API_URL=self.stub.url)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        self.client = APIClient()
+        self.client.force_authenticate(
+            User.objects.create_user(username="reader", password="pw")
+        )
+
+    def lookup(self, isbns):
+        return self.client.get(f"/api/books/search/batch/?isbns={','.join(isbns)}")
+
+    def test_batch_is_answered_with_few_concurrent_requests(self):
+        unknown = [synthetic_data.isbn13(i) for i in range(100, 125)]
+        start = time.monotonic()
+        response = self.lookup([*self.known, *unknown, "nope"])
+        elapsed = time.monotonic() - start
+
+        self.assertEqual(response.status_code, 200)
+        results = response.data["results"]
+        self.assertEqual(list(results), [*self.known, *unknown, "nope"])
+        self.assertEqual(
+            results[self.known[0]],
+            {"status": "found", "data": self.stub.volumes[self.known[0]]},
+        )
+        self.assertEqual(results[unknown[0]], {"status": "not_found"})
+        self.assertEqual(results["nope"], {"status": "invalid"})
+        # Two searches of up to 20 ISBNs, then the three volumes' details,
+        # each step in parallel: about as long as one lookup
+        self.assertEqual(self.stub.request_count, 5)
+        self.assertLess(elapsed, 0.5)
+
+        # Everything is cached now
+        self.assertEqual(self.lookup(self.known).status_code, 200)
+        self.assertEqual(self.stub.request_count, 5)
+
+    def test_isbns_missing_from_cut_short_results_are_looked_up_alone(self):
+        with mock.patch.object(google_books, "MAX_RESULTS", 2):
+            results = google_books.fetch_many(self.known)
+        self.assertEqual(
+            [results[isbn]["title"] for isbn in self.known],
+            [f"Book {isbn}" for isbn in self.known],
+        )
+        # The batch search, two details, then a search and detail for the third
+        self.assertEqual(self.stub.request_count, 5)
+
+    def test_failed_lookups(self):
+        self.stub.error_rate = 1
+        response = self.lookup(self.known)
+        self.assertEqual(response.status_code, 503)
+
+        self.stub.error_rate = 0
+        google_books.fetch_book_data(self.known[0])
+        google_books.breaker.reset()
+        self.stub.error_rate = 1
+        response = self.lookup(self.known)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["results"][self.known[0]]["status"], "found")
+        self.assertEqual(response.data["results"][self.known[1]], {"status": "error"})
+
+    def test_requires_isbns(self):
+        self.assertEqual(self.client.get("/api/books/search/batch/").status_code, 400)
+        with override_settings(BATCH_LOOKUP_MAX_ISBNS=2):
+            self.assertEqual(self.lookup(self.known).status_code, 400)
+
+
+@override_settings(GOOGLE_BOOKS_CLIENT={"LAZY_DETAILS": True})
+class LazyDetailsTests(TestCase):
+    def setUp(self):
+        metadata_cache.clear()
+        google_books.breaker.reset()
+        self.known = [synthetic_data.isbn13(i) for i in range(3)]
+        self.stub = BooksAPIStub(
+            volumes={
+                isbn: {
+                    "title": f"Book {isbn}",
+                    "imageLinks": {
+                        "thumbnail": f"https://books.google.com/{isbn}/m",
+                        "large": f"https://books.google.com/{isbn}/l",
+                    },
+                }
+                for isbn in self.known
+            }
+        ).start()
+        self.addCleanup(self.stub.stop)
+        settings_override = override_settings(GOOGLE_BOOKS_API_URL=self.stub.url)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def test_lookup_takes_one_request_and_details_are_fetched_when_shown(self):
+        isbn = self.known[0]
+        data = google_books.fetch_book_data(isbn)
+        self.assertEqual(self.stub.request_count, 1)
+        self.assertTrue(google_books.is_partial(data))
+        self.assertEqual(data["volumeId"], f"vol-{isbn}")
+        self.assertNotIn("large", data["imageLinks"])
+        self.assertEqual(
+            google_books.book_fields_from_data(data)["title"], f"Book {isbn}"
+        )
+
+        user = User.objects.create_user(username="reader", password="pw")
+        shelf = Bookshelf.objects.create(name="Shelf", user=user)
+        book = Book.objects.create(isbn=isbn, bookshelf=shelf, user=user)
+        client = APIClient()
+        client.force_authenticate(user)
+        google_data = client.get(f"/api/books/{book.id}/").data["google_data"]
+        self.assertEqual(google_data, self.stub.volumes[isbn])
+        self.assertEqual(self.stub.request_count, 2)
+
+        # The upgraded details replace the partial result in the cache
+        metadata_cache.clear()
+        self.assertEqual(google_books.fetch_book_data(isbn), self.stub.volumes[isbn])
+        self.assertEqual(self.stub.request_count, 2)
+
+    def test_full_lookup_of_an_uncached_isbn(self):
+        data = google_books.fetch_book_data(self.known[0], full=True)
+        self.assertEqual(data, self.stub.volumes[self.known[0]])
+        self.assertEqual(self.stub.request_count, 2)
+        self.assertEqual(google_books.fetch_book_data("9781111111111", full=True), {})
+
+    def test_batches_skip_the_detail_requests(self):
+        results = google_books.fetch_many(self.known)
+        self.assertTrue(all(map(google_books.is_partial, results.values())))
+        self.assertEqual(self.stub.request_count, 1)
+
+    def test_async_lookup_takes_one_request(self):
+        async def lookup():
+            try:
+                return await afetch_book_data(self.known[0])
+            finally:
+                await close_session()
+
+        self.assertTrue(google_books.is_partial(async_to_sync(lookup)()))
+        self.assertEqual(self.stub.request_count, 1)
+
+
+class MetadataSnapshotTests(TestCase):
+    def setUp(self):
+        metadata_cache.clear()
+        google_books.breaker.reset()
+        self.known = [synthetic_data.isbn13(i) for i in range(4)]
+        self.stub = BooksAPIStub(
+            volumes={
+                isbn: {
+                    "title": f"Book {isbn}",
+                    "description": "A long description. " * 100,
+                    "imageLinks": {
+                        "thumbnail": f"https://books.google.com/{isbn}/m",
+                        "large": f"https://books.google.com/{isbn}/l",
+                    },
+                }
+                for isbn in self.known
+            }
+        ).start()
+        self.addCleanup(self.stub.stop)
+        settings_override = override_settings(GOOGLE_BOOKS_API_URL=self.stub.url)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        self.user = User.objects.create_user(username="reader", password="pw")
+        self.shelf = Bookshelf.objects.create(name="Shelf", user=self.user)
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+
+    def test_details_are_served_from_the_snapshot(self):
+        isbn = self.known[0]
+        book = Book.objects.create(isbn=isbn, bookshelf=self.shelf, user=self.user)
+        response = self.client.get(f"/api/books/{book.id}/")
+        self.assertEqual(response.data["google_data"], self.stub.volumes[isbn])
+        requests_made = self.stub.request_count
+
+        book.refresh_from_db()
+        self.assertIsNotNone(book.metadata_fetched_at)
+        # Stored compressed
+        self.assertLess(len(book.metadata_snapshot), 1000)
+
+        metadata_cache.clear()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(f"/api/books/{book.id}/")
+        self.assertEqual(response.data["google_data"], self.stub.volumes[isbn])
+        self.assertEqual(self.stub.request_count, requests_made)
+        book_queries = [q for q in queries if '"library_api_book"' in q["sql"]]
+        self.assertEqual(len(book_queries), 1)
+
+    def test_enrichment_takes_a_snapshot_and_a_new_isbn_drops_it(self):
+        response = self.client.post(
+            "/api/books/", {"isbn": self.known[0], "bookshelf": self.shelf.id}
+        )
+        call_command("process_enrichment_queue", "--once", stdout=io.StringIO())
+        book = Book.objects.get(id=response.data["id"])
+        self.assertEqual(
+            book.get_google_data()["title"], self.stub.volumes[self.known[0]]["title"]
+        )
+
+        self.client.put(
+            f"/api/books/{book.id}/",
+            {"isbn": self.known[1], "bookshelf": self.shelf.id},
+        )
+        book.refresh_from_db()
+        self.assertIsNone(book.metadata_snapshot)
+        self.assertEqual(
+            self.client.get(f"/api/books/{book.id}/").data["google_data"]["title"],
+            self.stub.volumes[self.known[1]]["title"],
+        )
+
+    @override_settings(GOOGLE_BOOKS_CLIENT={"LAZY_DETAILS": True})
+    def test_refresh_command_updates_stale_snapshots_in_batches(self):
+        now = timezone.now()
+        books = [
+            Book.objects.create(
+                isbn=isbn,
+                bookshelf=self.shelf,
+                user=self.user,
+                metadata_snapshot=metadata_snapshots.encode({"title": "Old"}),
+                metadata_fetched_at=now - timedelta(days=days),
+            )
+            for isbn, days in zip(self.known, [40, 40, 1])
+        ]
+        # Never snapshotted, and unknown to Google Books
+        books.append(
+            Book.objects.create(
+                isbn="9781111111111", bookshelf=self.shelf, user=self.user
+            )
+        )
+
+        out = io.StringIO()
+        call_command("refresh_metadata_snapshots", "--batch-size", "2", stdout=out)
+        report = json.loads(out.getvalue())
+        counts = ["books", "refreshed", "not_found", "failed", "batches"]
+        self.assertEqual(
+            {key: report[key] for key in counts},
+            {"books": 3, "refreshed": 2, "not_found": 1, "failed": 0, "batches": 2},
+        )
+
+        data = [Book.objects.get(id=book.id).get_google_data() for book in books]
+        # Partial search results were upgraded to the full details
+        self.assertEqual(data[:2], [self.stub.volumes[i] for i in self.known[:2]])
+        self.assertEqual(data[2:], [{"title": "Old"}, {}])
+
+        # The confirmed miss isn't looked up again until it's stale
+        out = io.StringIO()
+        call_command("refresh_metadata_snapshots", stdout=out)
+        self.assertEqual(json.loads(out.getvalue())["books"], 0)
+
+    def test_refresh_bypasses_the_metadata_cache(self):
+        isbn = self.known[0]
+        book = Book.objects.create(
+            isbn=isbn,
+            bookshelf=self.shelf,
+            user=self.user,
+            metadata_snapshot=metadata_snapshots.encode({"title": "Old"}),
+            metadata_fetched_at=timezone.now(),
+        )
+        metadata_cache.set(isbn, {"title": "Cached"})
+
+        report = metadata_snapshots.refresh(max_age=0)
+
+        self.assertEqual(report["refreshed"], 1)
+        book.refresh_from_db()
+        self.assertEqual(book.get_google_data(), self.stub.volumes[isbn])
+        # The fresh result replaces the cached one
+        self.assertEqual(metadata_cache.get(isbn), self.stub.volumes[isbn])
+
+    def test_failed_lookups_keep_the_old_snapshot(self):
+        stale = timezone.now() - timedelta(days=40)
+        book = Book.objects.create(
+            isbn=self.known[0],
+            bookshelf=self.shelf,
+            user=self.user,
+            metadata_snapshot=metadata_snapshots.encode({"title": "Old"}),
+            metadata_fetched_at=stale,
+        )
+        failed_lookup = mock.patch.object(
+            metadata_snapshots, "fetch_many_from_providers", return_value={}
+        )
+        with failed_lookup:
+            report = metadata_snapshots.refresh()
+        self.assertEqual(report["failed"], 1)
+        book.refresh_from_db()
+        self.assertEqual(book.get_google_data(), {"title": "Old"})
+        self.assertEqual(book.metadata_fetched_at, stale)
+
+
+
+class QueryPlanTests(TestCase):
+    """
+    Every query behind the library endpoints must be answered through
+    indexes however many users there are. The tables are seeded with many
+    synthetic libraries and analyzed, then each endpoint's queries are
+    EXPLAINed: a sequential or full index scan of a library table, or a
+    sort, fails the test.
+
+    Test-sized tables are still small enough that scanning or sorting them
+    is sometimes the cheapest plan, so the plans are made with sequential
+    scans and sorts priced out (enable_seqscan and enable_sort off). What
+    remains is what no index can serve, i.e. what gets slower as the
+    tables grow.
+    """
+
+    # Tables that grow with the number of users
+    library_tables = {
+        "library_api_book",
+        "library_api_bookshelf",
+        "library_api_category",
+        "library_api_series",
+        "library_api_librarystat",
+        "library_api_libraryversion",
+    }
+
+    @classmethod
+    def setUpTestData(cls):
+        synthetic_data.generate_libraries(200, 50, prefix="plan")
+        cls.user = User.objects.get(username="plan-0")
+        # Book details come from the stored snapshot, without a lookup
+        Book.objects.filter(user=cls.user).update(
+            **metadata_snapshots.snapshot_fields({})
+        )
+        with connection.cursor() as cursor:
+            for table in sorted(cls.library_tables):
+                cursor.execute(f"ANALYZE {table}")
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+        self.book = Book.objects.filter(user=self.user).first()
+
+    def explain(self, sql):
+        with connection.cursor() as cursor:
+            cursor.execute("SET enable_seqscan = off")
+            cursor.execute("SET enable_sort = off")
+            try:
+                cursor.execute(f"EXPLAIN (FORMAT JSON) {sql}")
+                plan = cursor.fetchone()[0]
+            finally:
+                cursor.execute("RESET enable_seqscan")
+                cursor.execute("RESET enable_sort")
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        return plan[0]["Plan"]
+
+    def plan_problems(self, plan, allow_sort=False):
+        """Describe the scans and sorts in a plan that grow with the tables."""
+        problems = []
+        nodes = [plan]
+        while nodes:
+            node = nodes.pop()
+            nodes.extend(node.get("Plans", []))
+            node_type = node["Node Type"]
+            if node.get("Relation Name") in self.library_tables:
+                full_index_scan = (
+                    node_type in ("Index Scan", "Index Only Scan")
+                    and "Index Cond" not in node
+                )
+                if node_type == "Seq Scan" or full_index_scan:
+                    problems.append(f"{node_type} on {node['Relation Name']}")
+            if node_type in ("Sort", "Incremental Sort") and not allow_sort:
+                problems.append(f"{node_type} by {', '.join(node['Sort Key'])}")
+        return problems
+
+    def assertIndexedPlans(self, method, url, data=None, allow_sort=False, **kwargs):
+        """Make a request and check the plans of the SELECTs it runs."""
+        with CaptureQueriesContext(connection) as queries:
+            response = getattr(self.client, method)(url, data, **kwargs)
+            if response.streaming:
+                # Run the streamed queries, keeping the content for the caller
+                response.streaming_content = [b"".join(response.streaming_content)]
+        self.assertLess(response.status_code, 300, url)
+
+        # Chunked reads run their SELECT through a server-side cursor
+        selects = [
+            re.sub(r"^DECLARE .+? CURSOR .*?FOR ", "", q["sql"]) for q in queries
+        ]
+        selects = [sql for sql in selects if sql.startswith("SELECT")]
+        self.assertTrue(selects, url)
+        for sql in selects:
+            problems = self.plan_problems(self.explain(sql), allow_sort)
+            self.assertEqual(problems, [], f"{method.upper()} {url}: {sql}")
+        return response
+
+    def test_book_endpoints(self):
+        for url in [
+            "/api/books/",
+            f"/api/books/?bookshelf={self.book.bookshelf_id}",
+            "/api/books/?view=compact",
+            "/api/books/?fields=id,title,details",
+            f"/api/books/{self.book.id}/",
+            "/api/books/stats/",
+        ]:
+            self.assertIndexedPlans("get", url)
+
+        page = self.assertIndexedPlans("get", "/api/books/?page_size=10")
+        self.assertIndexedPlans("get", page.data["next"])
+        page = self.assertIndexedPlans(
+            "get", f"/api/books/?bookshelf={self.book.bookshelf_id}&page_size=5"
+        )
+        self.assertIndexedPlans("get", page.data["next"])
+
+        # Ranked by relevance, so only the scans are checked
+        self.assertIndexedPlans("get", "/api/books/find/?q=night", allow_sort=True)
+
+    def test_organization_endpoints(self):
+        for model, prefix in [
+            (Bookshelf, "bookshelves"),
+            (Category, "categories"),
+            (Series, "series"),
+        ]:
+            instance = model.objects.filter(user=self.user).first()
+            self.assertIndexedPlans("get", f"/api/{prefix}/")
+            self.assertIndexedPlans("get", f"/api/{prefix}/{instance.id}/")
+
+    def test_import_export_and_restore_duplicate_checks(self):
+        export = self.assertIndexedPlans("get", "/api/books/export/ndjson/")
+        upload = SimpleUploadedFile(
+            "library.ndjson", b"".join(export.streaming_content)
+        )
+        # Every book is already in the library, so both only check for them
+        self.assertIndexedPlans("post", "/api/books/restore/", {"file": upload})
+        self.assertIndexedPlans(
+            "post",
+            "/api/books/import/",
+            {"bookshelf": self.book.bookshelf_id, "isbns": [self.book.isbn]},
+            format="json",
+        )
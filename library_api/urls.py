@@ -1,5 +1,6 @@
 from django.urls import path
 from rest_framework.routers import DefaultRouter
+from .async_views import create_book_async, search_book_by_isbn_async
 from .views import (
     BookViewSet,
     BookshelfViewSet,
@@ -9,6 +10,12 @@ from .views import (
     current_user,
     register_user,
     search_book_by_isbn,
+    search_books_by_isbns,
+    import_books,
+    export_books,
+    restore_books,
+    book_cover,
+    metrics,
 )
 
 # Create custom URL patterns first
@@ -20,6 +27,21 @@ urlpatterns = [
     path(
         "books/search/", search_book_by_isbn, name="search_book_by_isbn"
     ),  # Add new endpoint
+    path(
+        "books/search/batch/", search_books_by_isbns, name="search_books_by_isbns"
+    ),
+    path("books/import/", import_books, name="import_books"),
+    path("books/export/<str:export_format>/", export_books, name="export_books"),
+    path("books/restore/", restore_books, name="restore_books"),
+    path("covers/", book_cover, name="book_cover"),
+    path("metrics/", metrics, name="metrics"),
+    # Async variants, for deployments running under ASGI
+    path(
+        "books/search/async/",
+        search_book_by_isbn_async,
+        name="search_book_by_isbn_async",
+    ),
+    path("books/async/", create_book_async, name="create_book_async"),
 ]
 
 # Then add router-generated URLs
@@ -1,7 +1,22 @@
+from django.conf import settings
+from django.http import (
+    FileResponse,
+    Http404,
+    HttpResponse,
+    HttpResponseNotModified,
+    StreamingHttpResponse,
+)
+from django.db.models import Q
+from django.utils.crypto import constant_time_compare
+from django.utils.cache import patch_cache_control
+from django.utils.http import parse_etags, quote_etag
 from rest_framework import viewsets, status
+from rest_framework.decorators import action
 from .models import Book, Bookshelf, Category, Series
 from .serializers import (
     BookSerializer,
+    BookListSerializer,
+    BookRowSerializer,
     BookDetailSerializer,
     BookshelfSerializer,
     CategorySerializer,
@@ -11,22 +26,98 @@ from .serializers import (
 from django.contrib.auth.models import User
 from rest_framework.permissions import IsAdminUser, IsAuthenticated, AllowAny
 from rest_framework.decorators import api_view, permission_classes
+from rest_framework.exceptions import ValidationError
 from rest_framework.response import Response
-from .services.google_books import fetch_book_data
+from .services import (
+    covers,
+    enrichment,
+    export,
+    library_stats,
+    metadata_snapshots,
+    request_metrics,
+    restore,
+)
+from .services.google_books import GoogleBooksUnavailable, fetch_book_data, fetch_many
+from .services.bulk_import import (
+    import_isbns,
+    is_valid_isbn,
+    parse_isbn_csv,
+    split_isbns,
+)
+from .services.metadata_cache import normalize_isbn
+from .services.search import search_books
+from .etags import LibraryVersionETagMixin
+from .pagination import BookCursorPagination
 
 
-class BookViewSet(viewsets.ModelViewSet):
+class BookViewSet(LibraryVersionETagMixin, viewsets.ModelViewSet):
     permission_classes = [IsAuthenticated]
+    pagination_class = BookCursorPagination
+
+    # Actions that only read books: they take ?fields= and load only the
+    # columns their serializer needs
+    read_actions = ("list", "retrieve", "find")
 
     def get_serializer_class(self):
         """Return different serializers for list and detail views"""
         if self.action == "retrieve":
             return BookDetailSerializer
+        # Lists are compact only if asked for, and the client didn't pick
+        # its own fields
+        params = self.request.query_params
+        if (
+            self.action in ("list", "find")
+            and params.get("view") == "compact"
+            and "fields" not in params
+        ):
+            return BookListSerializer
         return BookSerializer
 
+    def get_requested_fields(self):
+        """Return the field names given in ?fields=, or None for the default set"""
+        if self.action not in self.read_actions:
+            return None
+        fields = [
+            name.strip()
+            for name in self.request.query_params.get("fields", "").split(",")
+            if name.strip()
+        ]
+        if not fields:
+            return None
+        available = self.get_serializer_class().Meta.fields
+        unknown = [name for name in fields if name not in available]
+        if unknown:
+            raise ValidationError({"error": f"Unknown fields: {', '.join(unknown)}."})
+        return fields
+
+    def get_serializer(self, *args, **kwargs):
+        kwargs.setdefault("fields", self.get_requested_fields())
+        return super().get_serializer(*args, **kwargs)
+
     def get_queryset(self):
         """Return books that belong to the current authenticated user, with optional filtering"""
-        queryset = Book.objects.filter(user=self.request.user)
+        # Join the related rows the serializer reads (names, titles and the
+        # sort key) so listing doesn't issue extra queries per book
+        queryset = (
+            Book.objects.filter(user=self.request.user)
+            .select_related("bookshelf", "category", "series")
+            .order_by("sort_key_text", "id")
+        )
+
+        if self.action in self.read_actions:
+            # Load only the columns the response shows, joining only the
+            # related rows it reads; pagination needs the sort key
+            paths = self.get_serializer_class().model_field_paths(
+                self.get_requested_fields()
+            )
+            related = list(
+                dict.fromkeys(path.split("__")[0] for path in paths if "__" in path)
+            )
+            queryset = queryset.select_related(None).only(
+                "id", "sort_key_text", *related, *paths
+            )
+            if related:
+                queryset = queryset.select_related(*related)
 
         # Filter by bookshelf/bookcase if provided in query params
         bookshelf_id = self.request.query_params.get("bookshelf", None)
@@ -35,59 +126,103 @@ class BookViewSet(viewsets.ModelViewSet):
 
         return queryset
 
-    def perform_create(self, serializer):
-        """
-        Automatically assign the current user when creating a new book
-        and populate book data from Google Books API
-        """
-        isbn = serializer.validated_data.get("isbn")
-
-        # Fetch book data from Google Books API
-        book_data = fetch_book_data(isbn)
-
-        # Extract title, subtitle and author
-        title = book_data.get("title", "Unknown Title")
-        subtitle = book_data.get("subtitle", "")
-
-        # Get primary author if available
-        authors = book_data.get("authors", ["Unknown Author"])
-        original_author = authors[0] if authors else "Unknown Author"
+    # Serve lists from .values() rows through BookRowSerializer instead of
+    # model instances through the DRF serializer (same JSON, less CPU)
+    fast_list = True
 
-        # Convert author name to "LastName, FirstName" format for better sorting
-        # This handles simple cases like "Stephen King" -> "King, Stephen"
-        name_parts = original_author.split()
-        if len(name_parts) > 1:
-            last_name = name_parts[-1]
-            first_names = " ".join(name_parts[:-1])
-            author = f"{last_name}, {first_names}"
-        else:
-            author = original_author  # Single name or already formatted
+    def list(self, request, *args, **kwargs):
+        if not self.fast_list:
+            return super().list(request, *args, **kwargs)
+        return self.conditional_response(request, self.list_rows, *args, **kwargs)
 
-        # Get thumbnail images
-        image_links = book_data.get("imageLinks", {})
-        small_thumbnail = image_links.get("smallThumbnail", None)
-        large_thumbnail = image_links.get("thumbnail", None)
+    def list_rows(self, request, *args, **kwargs):
+        """ListModelMixin.list, serializing .values() rows with BookRowSerializer"""
+        serializer = BookRowSerializer(
+            self.get_serializer_class(), self.get_requested_fields()
+        )
+        # The paginator reads the sort key and id from each row
+        queryset = self.filter_queryset(self.get_queryset()).values(
+            *dict.fromkeys(["id", "sort_key_text", *serializer.value_paths])
+        )
 
-        # Get description
-        details = book_data.get("description", None)
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            return self.get_paginated_response(serializer.to_representation(page))
+        return Response(serializer.to_representation(queryset))
 
-        # Save with data from Google Books
-        serializer.save(
-            user=self.request.user,
-            title=title,
-            subtitle=subtitle,
-            author=author,
-            small_thumbnail=small_thumbnail,
-            large_thumbnail=large_thumbnail,
-            details=details,
+    def perform_create(self, serializer):
+        """
+        Automatically assign the current user when creating a new book.
+        Book data comes from the metadata cache if the ISBN is known there;
+        otherwise the book is saved as pending and queued for enrichment,
+        so creating a book never waits on Google Books.
+        """
+        isbn = serializer.validated_data.get("isbn")
+        book = serializer.save(
+            user=self.request.user, **enrichment.initial_book_fields(isbn)
         )
+        if book.enrichment_status == Book.EnrichmentStatus.PENDING:
+            enrichment.enqueue([book])
 
     def perform_update(self, serializer):
         """Ensure updates maintain the current user ownership"""
-        serializer.save(user=self.request.user)
+        fields = {}
+        isbn = serializer.validated_data.get("isbn")
+        if isbn is not None and isbn != serializer.instance.isbn:
+            # The stored Google Books data is for the old ISBN
+            fields = dict.fromkeys(metadata_snapshots.SNAPSHOT_FIELDS)
+        serializer.save(user=self.request.user, **fields)
+
+    @action(detail=True, methods=["post"])
+    def enrich(self, request, pk=None):
+        """Queue the book to have its data fetched again from Google Books"""
+        book = self.get_object()
+        enrichment.enqueue([book])
+        serializer = self.get_serializer(book)
+        return Response(serializer.data, status=status.HTTP_202_ACCEPTED)
+
+    @action(detail=False, methods=["get"])
+    def find(self, request):
+        """
+        Search the user's books by title, subtitle, author and description.
 
+        Takes a "q" query and an optional "limit"; results are ranked by
+        relevance and tolerate typos in titles and author names.
+        """
+        query = request.query_params.get("q", "").strip()
+        if not query:
+            return Response(
+                {"error": "The q parameter is required."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        limit = request.query_params.get("limit")
+        if limit is not None:
+            try:
+                limit = int(limit)
+            except ValueError:
+                limit = 0
+            if limit < 1:
+                return Response(
+                    {"error": "limit must be a positive integer."},
+                    status=status.HTTP_400_BAD_REQUEST,
+                )
+
+        books = search_books(self.get_queryset(), query, limit=limit)
+        serializer = self.get_serializer(books, many=True)
+        return Response(serializer.data)
+
+    @action(detail=False, methods=["get"])
+    def stats(self, request):
+        """
+        Book counts for the user's library: the total, per category, author
+        and bookshelf, and per series with its missing volume numbers.
+        """
+        return self.conditional_response(
+            request, lambda request: Response(library_stats.get_stats(request.user))
+        )
 
-class BookshelfViewSet(viewsets.ModelViewSet):
+
+class BookshelfViewSet(LibraryVersionETagMixin, viewsets.ModelViewSet):
     serializer_class = BookshelfSerializer
     permission_classes = [IsAuthenticated]
 
@@ -104,7 +239,7 @@ class BookshelfViewSet(viewsets.ModelViewSet):
         serializer.save(user=self.request.user)
 
 
-class CategoryViewSet(viewsets.ModelViewSet):
+class CategoryViewSet(LibraryVersionETagMixin, viewsets.ModelViewSet):
     serializer_class = CategorySerializer
     permission_classes = [IsAuthenticated]
 
@@ -122,7 +257,7 @@ class CategoryViewSet(viewsets.ModelViewSet):
         serializer.save(user=self.request.user)
 
 
-class SeriesViewSet(viewsets.ModelViewSet):
+class SeriesViewSet(LibraryVersionETagMixin, viewsets.ModelViewSet):
     serializer_class = SeriesSerializer
     permission_classes = [IsAuthenticated]
 
@@ -191,10 +326,266 @@ def search_book_by_isbn(request):
             {"error": "ISBN parameter is required."}, status=status.HTTP_400_BAD_REQUEST
         )
 
-    data = fetch_book_data(isbn)
+    try:
+        data = fetch_book_data(isbn)
+    except GoogleBooksUnavailable:
+        return Response(
+            {"error": "Google Books is unavailable. Please try again later."},
+            status=status.HTTP_503_SERVICE_UNAVAILABLE,
+        )
     if not data:
         return Response(
             {"error": "No data found for the provided ISBN."},
             status=status.HTTP_404_NOT_FOUND,
         )
     return Response(data, status=status.HTTP_200_OK)
+
+
+@api_view(["GET"])
+@permission_classes([IsAuthenticated])
+def search_books_by_isbns(request):
+    """
+    Look many ISBNs up at once, e.g. after a session of scanning barcodes.
+
+    Takes "isbns" (comma or space separated, and/or repeated). Uncached
+    ISBNs are looked up together, in a few combined searches, so a batch
+    takes about as long as a single lookup. Answers with a map from each
+    ISBN to {"status": "found", "data": <volumeInfo>} or a status of
+    "not_found", "invalid" or "error" (the lookup failed).
+    """
+    isbns = [
+        isbn
+        for value in request.query_params.getlist("isbns")
+        for isbn in split_isbns(value)
+    ]
+    if not isbns:
+        return Response(
+            {"error": "ISBNs parameter is required."},
+            status=status.HTTP_400_BAD_REQUEST,
+        )
+    max_isbns = getattr(settings, "BATCH_LOOKUP_MAX_ISBNS", 100)
+    if len(isbns) > max_isbns:
+        return Response(
+            {"error": f"At most {max_isbns} ISBNs can be looked up at once."},
+            status=status.HTTP_400_BAD_REQUEST,
+        )
+
+    results = {}
+    valid = []
+    for raw in isbns:
+        isbn = normalize_isbn(raw)
+        if is_valid_isbn(isbn):
+            valid.append(isbn)
+            results[isbn] = None
+        else:
+            results[raw] = {"status": "invalid"}
+
+    metadata = fetch_many(valid)
+    for isbn in valid:
+        data = metadata.get(isbn)
+        if data is None:
+            results[isbn] = {"status": "error"}
+        elif data:
+            results[isbn] = {"status": "found", "data": data}
+        else:
+            results[isbn] = {"status": "not_found"}
+
+    if valid and all(metadata.get(isbn) is None for isbn in valid):
+        return Response(
+            {"error": "Google Books is unavailable. Please try again later."},
+            status=status.HTTP_503_SERVICE_UNAVAILABLE,
+        )
+    return Response({"results": results}, status=status.HTTP_200_OK)
+
+
+@api_view(["POST"])
+@permission_classes([IsAuthenticated])
+def import_books(request):
+    """
+    Add many books to one of the user's bookshelves at once.
+
+    Accepts a "bookshelf" id plus either "isbns" (a list, or a comma or
+    newline separated string) or an uploaded CSV "file" of ISBNs.
+    """
+    try:
+        bookshelf = Bookshelf.objects.get(
+            id=int(request.data.get("bookshelf")), user=request.user
+        )
+    except (TypeError, ValueError, Bookshelf.DoesNotExist):
+        return Response(
+            {"error": "A valid bookshelf is required."},
+            status=status.HTTP_400_BAD_REQUEST,
+        )
+
+    upload = request.FILES.get("file")
+    if upload is not None:
+        isbns = parse_isbn_csv(upload.read().decode("utf-8-sig"))
+    elif hasattr(request.data, "getlist"):
+        # Form data: repeated "isbns" fields, each possibly holding several
+        isbns = [
+            isbn for value in request.data.getlist("isbns") for isbn in split_isbns(value)
+        ]
+    else:
+        isbns = request.data.get("isbns") or []
+        if isinstance(isbns, str):
+            isbns = split_isbns(isbns)
+
+    if not isinstance(isbns, list) or not isbns:
+        return Response(
+            {"error": "Provide a list of ISBNs or a CSV file."},
+            status=status.HTTP_400_BAD_REQUEST,
+        )
+
+    max_isbns = getattr(settings, "BULK_IMPORT_MAX_ISBNS", 5000)
+    if len(isbns) > max_isbns:
+        return Response(
+            {"error": f"At most {max_isbns} ISBNs can be imported at once."},
+            status=status.HTTP_400_BAD_REQUEST,
+        )
+
+    report = import_isbns(request.user, bookshelf, [str(isbn) for isbn in isbns])
+    report["bookshelf"] = bookshelf.id
+    return Response(
+        report,
+        status=status.HTTP_201_CREATED if report["created"] else status.HTTP_200_OK,
+    )
+
+
+EXPORT_FORMATS = {
+    "ndjson": ("application/x-ndjson", export.ndjson_export),
+    "csv": ("text/csv; charset=utf-8", export.csv_export),
+}
+
+
+@api_view(["GET"])
+@permission_classes([IsAuthenticated])
+def export_books(request, export_format):
+    """
+    Stream every book in the user's library as NDJSON or CSV
+    """
+    if export_format not in EXPORT_FORMATS:
+        return Response(
+            {"error": "Export format must be ndjson or csv."},
+            status=status.HTTP_404_NOT_FOUND,
+        )
+
+    content_type, encode = EXPORT_FORMATS[export_format]
+    response = StreamingHttpResponse(
+        encode(export.export_rows(request.user)), content_type=content_type
+    )
+    response["Content-Disposition"] = f'attachment; filename="library.{export_format}"'
+    return response
+
+
+@api_view(["POST"])
+@permission_classes([IsAuthenticated])
+def restore_books(request):
+    """
+    Restore books from an uploaded NDJSON or CSV export ("file").
+
+    The file's metadata is used as is; nothing is fetched from Google Books.
+    Pass "file_format" to override the format implied by the file name.
+    """
+    upload = request.FILES.get("file")
+    if upload is None:
+        return Response(
+            {"error": "Upload an NDJSON or CSV export as \"file\"."},
+            status=status.HTTP_400_BAD_REQUEST,
+        )
+
+    file_format = request.data.get("file_format") or (
+        "csv" if upload.name.lower().endswith(".csv") else "ndjson"
+    )
+    if file_format not in ("ndjson", "csv"):
+        return Response(
+            {"error": "file_format must be ndjson or csv."},
+            status=status.HTTP_400_BAD_REQUEST,
+        )
+
+    parse = restore.csv_rows if file_format == "csv" else restore.ndjson_rows
+    report = restore.restore_library(request.user, parse(upload))
+    return Response(
+        report,
+        status=status.HTTP_201_CREATED if report["created"] else status.HTTP_200_OK,
+    )
+
+
+@api_view(["GET"])
+@permission_classes([IsAuthenticated])
+def book_cover(request):
+    """
+    Serve a book cover from the local cover store, downloading it on first use.
+
+    Takes the cover's source URL as "url", which must be the small_thumbnail
+    or large_thumbnail of one of the user's books; only the hosts in
+    BOOK_COVERS["ALLOWED_HOSTS"] are fetched. Stored images never change,
+    so responses are cacheable indefinitely and the ETag is the image's
+    digest.
+    """
+    url = request.query_params.get("url", "")
+    if not covers.is_allowed_url(url):
+        return Response(
+            {"error": "url must be a cover image URL from an allowed host."},
+            status=status.HTTP_400_BAD_REQUEST,
+        )
+    # Otherwise anyone could use the endpoint to download arbitrary images
+    if not (
+        Book.objects.filter(user=request.user)
+        .filter(Q(small_thumbnail=url) | Q(large_thumbnail=url))
+        .exists()
+    ):
+        return Response(
+            {"error": "No cover image found."}, status=status.HTTP_404_NOT_FOUND
+        )
+
+    try:
+        cover = covers.get_cover(url)
+    except covers.CoverError:
+        return Response(
+            {"error": "Could not fetch the cover image."},
+            status=status.HTTP_502_BAD_GATEWAY,
+        )
+    if not cover.found:
+        return Response(
+            {"error": "No cover image found."}, status=status.HTTP_404_NOT_FOUND
+        )
+
+    etag = quote_etag(cover.digest)
+    if etag in parse_etags(request.headers.get("If-None-Match", "")):
+        response = HttpResponseNotModified()
+    else:
+        try:
+            image = open(covers.store_path(cover.digest), "rb")
+        except FileNotFoundError:
+            # Removed from the store since get_cover checked for it (e.g. the
+            # store was cleaned out); the next request downloads it again
+            return Response(
+                {"error": "No cover image found."}, status=status.HTTP_404_NOT_FOUND
+            )
+        response = FileResponse(image, content_type=cover.content_type)
+    response["ETag"] = etag
+    patch_cache_control(
+        response, private=True, max_age=covers.CACHE_MAX_AGE, immutable=True
+    )
+    return response
+
+
+def metrics(request):
+    """
+    Request latency histograms in the Prometheus text format.
+
+    Only served when REQUEST_METRICS["ENABLED"] is set. If
+    REQUEST_METRICS["TOKEN"] is set too, scrapers must send it as a bearer
+    token.
+    """
+    config = request_metrics.get_request_metrics_settings()
+    if not config["ENABLED"]:
+        raise Http404
+    if config["TOKEN"]:
+        authorization = request.headers.get("Authorization", "")
+        if not constant_time_compare(authorization, f"Bearer {config['TOKEN']}"):
+            return HttpResponse(status=status.HTTP_401_UNAUTHORIZED)
+    return HttpResponse(
+        request_metrics.registry.render(),
+        content_type="text/plain; version=0.0.4; charset=utf-8",
+    )
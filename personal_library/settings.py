@@ -43,12 +43,15 @@ INSTALLED_APPS = [
     "django.contrib.sessions",
     "django.contrib.messages",
     "django.contrib.staticfiles",
+    "django.contrib.postgres",
     "rest_framework",
     "rest_framework_simplejwt",
     "library_api",
 ]
 
 MIDDLEWARE = [
+    # First, so its total covers the other middleware too
+    "library_api.middleware.RequestMetricsMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
@@ -170,6 +173,120 @@ SIMPLE_JWT = {
     "AUTH_COOKIE_SAMESITE": "Lax",
 }
 
+# Per-process cache of authenticated users (see
+# library_api/services/user_cache.py). Saving a user clears their entries in
+# the same process; other processes see the change within TTL seconds.
+AUTH_USER_CACHE = {
+    "MAX_ENTRIES": 1024,
+    "TTL": 30,
+}
+
+# Per-request timings (Server-Timing header) and latency histograms served at
+# /api/metrics/; see library_api/services/request_metrics.py
+REQUEST_METRICS = {
+    "ENABLED": os.environ.get("REQUEST_METRICS_ENABLED", "") == "true",
+    "SERVER_TIMING": True,
+    "TOKEN": os.environ.get("REQUEST_METRICS_TOKEN") or None,
+}
+
 # Google Books API settings
 GOOGLE_BOOKS_API_KEY = os.environ.get("GOOGLE_BOOKS_API_KEY", "")
-GOOGLE_BOOKS_API_URL = "https://www.googleapis.com/books/v1/volumes"
+# Point at a local stub (manage.py run_books_api_stub) for load tests
+GOOGLE_BOOKS_API_URL = os.environ.get(
+    "GOOGLE_BOOKS_API_URL", "https://www.googleapis.com/books/v1/volumes"
+)
+# Process-wide token bucket for Google Books requests (set to None to disable)
+GOOGLE_BOOKS_RATE_LIMIT = {"RATE": 10, "BURST": 20}
+# Also coalesce concurrent lookups of the same ISBN across processes, using a
+# PostgreSQL advisory lock (lookups are always coalesced within a process)
+GOOGLE_BOOKS_CROSS_PROCESS_LOCK = False
+# Timeouts, retries and circuit breaker for Google Books requests (see
+# DEFAULT_CLIENT_SETTINGS in library_api/services/google_books.py). While
+# the breaker is open, lookups fail fast and expired cached data is served.
+GOOGLE_BOOKS_CLIENT = {
+    "CONNECT_TIMEOUT": 3.05,
+    "READ_TIMEOUT": 10,
+    "RETRIES": 2,
+    "FAILURE_THRESHOLD": 5,
+    "RESET_TIMEOUT": 30,
+    # GOOGLE_BOOKS_LAZY_DETAILS=true answers lookups from the search alone
+    # (one request instead of two); a book's details are fetched when opened
+    "LAZY_DETAILS": os.environ.get("GOOGLE_BOOKS_LAZY_DETAILS") == "true",
+}
+# Worker threads used to fetch metadata concurrently (e.g. for bulk imports)
+GOOGLE_BOOKS_MAX_WORKERS = 8
+
+# Metadata providers asked, in order, for ISBNs missing from the local store
+# and cache (see library_api/services/metadata_providers.py), e.g.
+# METADATA_PROVIDERS=google_books,open_library. With METADATA_HEDGE_AFTER set
+# (in seconds), a provider that takes longer gets a backup request to the next.
+BOOK_METADATA_PROVIDERS = {
+    "PROVIDERS": os.environ.get("METADATA_PROVIDERS", "google_books").split(","),
+    "HEDGE_AFTER": (
+        float(os.environ["METADATA_HEDGE_AFTER"])
+        if os.environ.get("METADATA_HEDGE_AFTER")
+        else None
+    ),
+    "REORDER": os.environ.get("METADATA_REORDER") == "true",
+    "OPEN_LIBRARY_URL": os.environ.get(
+        "OPEN_LIBRARY_API_URL", "https://openlibrary.org/api/books"
+    ),
+}
+
+# Catalogue search (/api/books/find/); see library_api/services/search.py
+BOOK_SEARCH = {
+    "MAX_RESULTS": 100,
+    "WORD_SIMILARITY_THRESHOLD": 0.4,
+}
+
+# Bulk ISBN import limits
+BULK_IMPORT_MAX_ISBNS = 5000
+BULK_IMPORT_BATCH_SIZE = 500
+
+# Background metadata enrichment queue, drained by
+# `manage.py process_enrichment_queue`; see library_api/services/enrichment.py
+BOOK_ENRICHMENT = {
+    "BATCH_SIZE": 20,
+    "MAX_ATTEMPTS": 5,
+    "BACKOFF": 30,
+    "MAX_BACKOFF": 60 * 60,
+    "LEASE": 5 * 60,
+}
+
+# Local cover image store served by /api/covers/; see
+# library_api/services/covers.py for the other options.
+BOOK_COVERS = {
+    "STORE_DIR": BASE_DIR / "covers",
+    "ALLOWED_HOSTS": [
+        "books.google.com",
+        "books.googleusercontent.com",
+        "covers.openlibrary.org",
+    ],
+}
+
+# Two-tier (in-process LRU + database) cache for Google Books lookups.
+# TTLs are in seconds; see library_api/services/metadata_cache.py for defaults.
+BOOK_METADATA_CACHE = {
+    "MAX_ENTRIES": 1024,
+    "TTL": 60 * 60,
+    "NEGATIVE_TTL": 5 * 60,
+    "DB_TTL": 30 * 24 * 60 * 60,
+    "DB_NEGATIVE_TTL": 24 * 60 * 60,
+}
+
+# Google Books data stored with each book for its details view, refreshed by
+# `manage.py refresh_metadata_snapshots`; see
+# library_api/services/metadata_snapshots.py. MAX_AGE is in seconds.
+BOOK_METADATA_SNAPSHOTS = {
+    "MAX_AGE": 30 * 24 * 60 * 60,
+    "BATCH_SIZE": 200,
+}
+
+# Local ISBN store built by `manage.py import_isbn_dump`, consulted before the
+# cache and Google Books; see library_api/services/isbn_store.py. With
+# ISBN_STORE_OFFLINE_ONLY=true, ISBNs missing from it are reported as not
+# found instead of being looked up online.
+BOOK_ISBN_STORE = {
+    "PATH": os.environ.get("ISBN_STORE_PATH", BASE_DIR / "isbn_store.sqlite3"),
+    "OFFLINE_ONLY": os.environ.get("ISBN_STORE_OFFLINE_ONLY") == "true",
+}